@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+yt-dlp stand-in for the benchmarks.
+Accepts the command lines build_command produces (unknown options are
+ignored) and prints what yt-dlp would: extractor and [info] lines,
+Destination lines, progress (as "[yd-progress]" JSON lines when a
+--progress-template is given, else the classic "[download]  42.0% of ..."
+text with ETA and fragments), merger lines and errors. It writes real
+files of the configured size and the --print-to-file manifest, so the
+archive and post-processing steps see actual output.
+
+Knobs come from the environment so the same command line works unchanged:
+
+    FAKE_YTDLP_LINES       progress lines per download (default 100)
+    FAKE_YTDLP_RATE        lines per second, 0 = as fast as possible (default 0)
+    FAKE_YTDLP_SIZE        bytes per downloaded file, 0 = write no file (default 1048576)
+    FAKE_YTDLP_FRAGMENTS   report fragments "(frag i/n)" (default 0 = plain HTTP)
+    FAKE_YTDLP_MERGE       1 = two formats (video + audio) and a [Merger] step
+    FAKE_YTDLP_NOISE       extra log lines between progress lines (default 0)
+    FAKE_YTDLP_FAIL        exit code; fails halfway with an ERROR line (also for URLs containing "fail")
+"""
+import os
+import sys
+import json
+import time
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def parse_args(argv):
+    # the few yt-dlp options the stand-in acts on
+    args = {"output": "%(title)s.%(ext)s", "manifest": None, "template": False, "url": "https://example.invalid/watch?v=benchbench01"}
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a == "-o" and i + 1 < len(argv):
+            args["output"] = argv[i + 1]
+            i += 1
+        elif a == "--print-to-file" and i + 2 < len(argv):
+            args["manifest"] = argv[i + 2]
+            i += 2
+        elif a == "--progress-template":
+            args["template"] = True
+            i += 1
+        elif a in ("-f", "--ffmpeg-location", "--proxy", "--limit-rate", "--download-archive", "--remux-video",
+                   "--recode-video", "--audio-format", "--merge-output-format", "--postprocessor-args",
+                   "--sub-lang", "--sub-format", "--convert-subs", "-N", "--concurrent-fragments",
+                   "--http-chunk-size", "--downloader", "--downloader-args", "--buffer-size"):
+            i += 1
+        elif not a.startswith("-"):
+            args["url"] = a
+        i += 1
+    return args
+
+
+def progress_line(template, downloaded, total, speed, eta, filename, format_id, frag):
+    if template:
+        d = {"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": total, "speed": speed,
+             "eta": eta, "filename": filename, "tmpfilename": filename + ".part"}
+        if frag:
+            d["fragment_index"], d["fragment_count"] = frag
+        return f"[yd-progress] {json.dumps(d)} {json.dumps(format_id)}"
+    pct = downloaded * 100.0 / total if total else 0.0
+    frag_text = f" (frag {frag[0]}/{frag[1]})" if frag else ""
+    return (f"[download] {pct:5.1f}% of {total / 1048576:8.2f}MiB at {speed / 1048576:6.2f}MiB/s "
+            f"ETA {eta // 60:02d}:{eta % 60:02d}{frag_text}")
+
+
+def download(args, path, format_id, lines, size, rate, fragments, noise, fail_at, out):
+    """Print one format's download and write size bytes to path. Returns False if it failed."""
+    out.write(f"[download] Destination: {path}\n")
+    total = max(size, 1)
+    chunk = b"\0" * (size // lines) if size and lines else b""
+    f = open(path + ".part", "wb") if size else None
+    start = time.perf_counter()
+    try:
+        for i in range(1, lines + 1):
+            if fail_at and i == fail_at:
+                out.write("ERROR: unable to download video data: HTTP Error 403: Forbidden\n")
+                return False
+            if f:
+                f.write(chunk if i < lines else b"\0" * (size - len(chunk) * (lines - 1)))
+            downloaded = total * i // lines
+            speed = 4 * 1048576
+            eta = (total - downloaded) // speed
+            frag = (i * fragments // lines, fragments) if fragments else None
+            out.write(progress_line(args["template"], downloaded, total, speed, eta, path, format_id, frag) + "\n")
+            for n in range(noise):
+                out.write(f"[debug] bench noise line {i}.{n}\n")
+            if rate:
+                # steady line rate: sleep until this line's slot
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    out.flush()
+                    time.sleep(delay)
+    finally:
+        if f:
+            f.close()
+    if size:
+        os.replace(path + ".part", path)
+    out.write(f"[download] 100% of {total / 1048576:.2f}MiB in {time.perf_counter() - start:.2f}s\n")
+    return True
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    lines = max(1, env_int("FAKE_YTDLP_LINES", 100))
+    rate = env_int("FAKE_YTDLP_RATE", 0)
+    size = env_int("FAKE_YTDLP_SIZE", 1048576)
+    fragments = env_int("FAKE_YTDLP_FRAGMENTS", 0)
+    merge = env_int("FAKE_YTDLP_MERGE", 0)
+    noise = env_int("FAKE_YTDLP_NOISE", 0)
+    fail = env_int("FAKE_YTDLP_FAIL", 0) or (1 if "fail" in args["url"] else 0)
+    video_id = args["url"].rsplit("=", 1)[-1].rsplit("/", 1)[-1][:11] or "bench"
+    base = args["output"].replace("%(title)s", f"bench {video_id}").replace("%(id)s", video_id)
+    out = sys.stdout
+
+    out.write(f"[youtube] Extracting URL: {args['url']}\n")
+    out.write(f"[youtube] {video_id}: Downloading webpage\n")
+    formats = [("137", "mp4"), ("140", "m4a")] if merge else [("18", "mp4")]
+    out.write(f"[info] {video_id}: Downloading {len(formats)} format(s): {'+'.join(f[0] for f in formats)}\n")
+    if os.path.dirname(base):
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+    paths = []
+    for n, (format_id, ext) in enumerate(formats):
+        path = base.replace("%(ext)s", f"f{format_id}.{ext}" if merge else ext)
+        fail_at = lines // 2 + 1 if fail and n == len(formats) - 1 else 0
+        if not download(args, path, format_id, lines, size // len(formats), rate, fragments, noise, fail_at, out):
+            out.flush()
+            return fail
+        paths.append(path)
+    final = base.replace("%(ext)s", "mp4")
+    if merge:
+        out.write(f'[Merger] Merging formats into "{final}"\n')
+        if size:
+            with open(final, "wb") as dst:
+                for p in paths:
+                    with open(p, "rb") as src:
+                        dst.write(src.read())
+        for p in paths:
+            out.write(f'Deleting original file {p} (pass -k to keep)\n')
+            if size:
+                os.remove(p)
+    if args["manifest"]:
+        with open(args["manifest"], "a", encoding="utf-8") as f:
+            f.write(f"Youtube\t{video_id}\t{os.path.abspath(final)}\n")
+    out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
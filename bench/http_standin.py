@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Local HTTP / HLS server for the tuning benchmark.
+Serves generated bytes with injected latency and a per-connection rate
+cap, the two things that make fragment concurrency and chunk sizes matter
+on real CDNs:
+
+    /video.mp4           a plain file of --size bytes, with Range support
+    /hls/index.m3u8      an HLS media playlist of --segments segments
+    /hls/seg<N>.ts       --segment-size bytes each
+
+    python bench/http_standin.py --port 8770 --latency 150 --rate 2M
+
+yt-dlp downloads both URLs with its generic extractor, e.g.
+    yt-dlp -N 4 http://127.0.0.1:8770/hls/index.m3u8
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yd_units import parse_rate
+
+
+BLOCK = 64 * 1024
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, head=False):
+        cfg = self.server.config
+        # latency before the first byte of every request (connection setup, CDN lookup)
+        if cfg["latency"]:
+            time.sleep(cfg["latency"])
+        path = self.path.split("?", 1)[0]
+        if path == "/hls/index.m3u8":
+            body = self.server.playlist.encode()
+            return self._send(200, "application/vnd.apple.mpegurl", len(body), body, head)
+        if path.startswith("/hls/seg") and path.endswith(".ts"):
+            try:
+                n = int(path[8:-3])
+            except ValueError:
+                n = -1
+            if not 0 <= n < cfg["segments"]:
+                return self._send(404, "text/plain", 0, b"", head)
+            return self._send(200, "video/mp2t", cfg["segment_size"], None, head)
+        if path == "/video.mp4":
+            return self._send_range(cfg["size"], head)
+        self._send(404, "text/plain", 0, b"", head)
+
+    def _send_range(self, size, head):
+        start, end = 0, size - 1
+        rng = self.headers.get("Range", "")
+        if rng.startswith("bytes="):
+            first, _, last = rng[6:].split(",", 1)[0].partition("-")
+            try:
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    start = max(0, size - int(last))
+            except ValueError:
+                start, end = 0, size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self._body("video/mp4", end - start + 1, None, head, accept_ranges=True)
+
+    def _send(self, status, ctype, length, body, head):
+        self.send_response(status)
+        self._body(ctype, length, body, head)
+
+    def _body(self, ctype, length, body, head, accept_ranges=False):
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(length))
+        if accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if head:
+            return
+        if body is not None:
+            self.wfile.write(body)
+            return
+        # per-connection rate cap: one block per slot
+        rate = self.server.config["rate"]
+        block = b"\0" * BLOCK
+        started = time.monotonic()
+        sent = 0
+        try:
+            while sent < length:
+                n = min(BLOCK, length - sent)
+                self.wfile.write(block[:n])
+                sent += n
+                if rate:
+                    delay = started + sent / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def make_playlist(segments, duration=4):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{duration}", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for n in range(segments):
+        lines.extend([f"#EXTINF:{duration}.0,", f"seg{n}.ts"])
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def start_server(port=0, latency=0.1, rate=2 * 1024 * 1024, size=32 * 1024 * 1024, segments=40,
+                 segment_size=512 * 1024):
+    """Start the server on a daemon thread. Returns it; server.server_address[1] is the port."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.config = {"latency": latency, "rate": rate, "size": size, "segments": segments, "segment_size": segment_size}
+    server.playlist = make_playlist(segments)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP / HLS stand-in with injected latency.")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--latency", type=float, default=100, help="milliseconds before each response (default: 100)")
+    parser.add_argument("--rate", default="2M", help="bytes per second per connection, 0 = unlimited (default: 2M)")
+    parser.add_argument("--size", default="32M", help="size of /video.mp4 (default: 32M)")
+    parser.add_argument("--segments", type=int, default=40, help="HLS segments (default: 40)")
+    parser.add_argument("--segment-size", default="512K", help="bytes per HLS segment (default: 512K)")
+    args = parser.parse_args(argv)
+    server = start_server(args.port, args.latency / 1000, parse_rate(args.rate), parse_rate(args.size),
+                          args.segments, parse_rate(args.segment_size))
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}/ (video.mp4, hls/index.m3u8); Ctrl+C stops")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Forwarding HTTP proxy for trying the proxy pool locally.
+Forwards plain HTTP requests (absolute URIs) and tunnels CONNECT, with
+injected latency, a per-connection rate cap and an optional stall: after
+--stall-after bytes of a response it stops forwarding but keeps the
+connection open, like a proxy that died mid-download.
+
+    python bench/proxy_standin.py --port 8881 --latency 50
+    python bench/proxy_standin.py --port 8882 --latency 300 --rate 500K
+    python bench/proxy_standin.py --port 8883 --stall-after 2M
+    python yd_cli.py --proxy 127.0.0.1:8881,127.0.0.1:8882,127.0.0.1:8883 URL...
+"""
+import os
+import sys
+import time
+import socket
+import select
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yd_units import parse_rate
+
+
+BLOCK = 64 * 1024
+_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "proxy-authorization", "te", "trailer",
+                "transfer-encoding", "upgrade")
+
+
+class Relay:
+    """Rate cap and stall for the bytes one connection sends to the client."""
+
+    def __init__(self, config):
+        self.rate = config["rate"]
+        self.stall_after = config["stall_after"]
+        self.sent = 0
+        self.started = time.monotonic()
+
+    def send(self, write, data):
+        if self.stall_after and self.sent + len(data) > self.stall_after:
+            write(data[:max(0, self.stall_after - self.sent)])
+            # hang until the client gives up
+            while True:
+                time.sleep(3600)
+        write(data)
+        self.sent += len(data)
+        if self.rate:
+            delay = self.started + self.sent / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _delay(self):
+        latency = self.server.config["latency"]
+        if latency:
+            time.sleep(latency)
+
+    def do_CONNECT(self):
+        self._delay()
+        host, _, port = self.path.rpartition(":")
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=30)
+        except (OSError, ValueError) as e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        relay = Relay(self.server.config)
+        client = self.connection
+        try:
+            while True:
+                readable, _, _ = select.select([client, upstream], [], [], 60)
+                if not readable:
+                    break
+                if client in readable:
+                    data = client.recv(BLOCK)
+                    if not data:
+                        break
+                    upstream.sendall(data)
+                if upstream in readable:
+                    data = upstream.recv(BLOCK)
+                    if not data:
+                        break
+                    relay.send(client.sendall, data)
+        except OSError:
+            pass
+        finally:
+            upstream.close()
+
+    def _forward(self):
+        self._delay()
+        url = urlsplit(self.path)
+        if url.scheme != "http" or not url.hostname:
+            self.send_error(400, "absolute http:// URL expected")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in _HOP_HEADERS}
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            conn.request(self.command, path, body=body, headers=headers)
+            resp = conn.getresponse()
+        except OSError as e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(resp.status, resp.reason)
+        for k, v in resp.getheaders():
+            if k.lower() not in _HOP_HEADERS:
+                self.send_header(k, v)
+        self.end_headers()
+        relay = Relay(self.server.config)
+        try:
+            while True:
+                data = resp.read(BLOCK)
+                if not data:
+                    break
+                relay.send(self.wfile.write, data)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    do_GET = do_HEAD = do_POST = _forward
+
+
+def start_proxy(port=0, latency=0.0, rate=0, stall_after=0):
+    """Start the proxy on a daemon thread. Returns the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), ProxyHandler)
+    server.daemon_threads = True
+    server.config = {"latency": latency, "rate": rate, "stall_after": stall_after}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forwarding HTTP proxy with injected latency, rate cap and stalls.")
+    parser.add_argument("--port", type=int, default=8881)
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds before each request is forwarded")
+    parser.add_argument("--rate", default="0", help="bytes per second per connection, 0 = unlimited")
+    parser.add_argument("--stall-after", default="0", help="stop forwarding after this many bytes of a response, 0 = never")
+    args = parser.parse_args(argv)
+    server = start_proxy(args.port, args.latency / 1000, parse_rate(args.rate), parse_rate(args.stall_after))
+    print(f"Proxy on 127.0.0.1:{server.server_address[1]}; Ctrl+C stops")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
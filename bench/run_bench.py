@@ -0,0 +1,360 @@
+"""
+Benchmarks for the download pipeline's hot paths, run against the
+fake_ytdlp.py stand-in (no network, no real yt-dlp):
+
+    parse     progress protocol + log-line parsing and JobQueue bookkeeping, lines/s
+    reader    a whole JobQueue run reading a 100k-line yt-dlp, lines/s end to end
+    log       LogStore memory over a 100k-line run (traced by tracemalloc)
+    ui        UiPump latency from a worker-thread push to the Tk-side apply (needs a display)
+    jobs      build_command cost and per-job process start overhead through the JobQueue
+    tuning    real yt-dlp against http_standin.py (HLS, injected latency): MB/s per
+              fragment concurrency, and what DownloadTuner settles on
+
+Every benchmark runs --repeat times and reports the median (and the best)
+run, with fixed inputs, so numbers are comparable between runs on the same
+machine. Save them with --json FILE and compare a later run with
+--compare FILE, e.g.
+
+    python bench/run_bench.py --json before.json
+    python bench/run_bench.py --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from yd_jobs import Job, JobQueue, FINISHED, FAILED, parse_output_details
+from yd_progress import parse_progress_line
+
+FAKE = os.path.join(HERE, "fake_ytdlp.py")
+
+
+# ---------------- Helpers ----------------
+def fake_command(outdir, url="https://www.youtube.com/watch?v=benchbench01", template=True):
+    """Command line for the stand-in in the shape build_command produces."""
+    cmd = [sys.executable, FAKE, "-o", os.path.join(outdir, "%(title)s.%(ext)s"), "--progress"]
+    if template:
+        cmd += ["--newline", "--progress-template", "download:x"]
+    return cmd + [url]
+
+
+def fake_env(**knobs):
+    env = dict(os.environ)
+    for key, value in knobs.items():
+        env[f"FAKE_YTDLP_{key.upper()}"] = str(value)
+    return env
+
+
+def fake_output(template=True, **knobs):
+    """The stand-in's complete stdout for the given knobs, as a list of lines."""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = subprocess.run(fake_command(tmp, template=template), env=fake_env(size=0, **knobs),
+                             capture_output=True, text=True, check=True).stdout
+    return out.splitlines()
+
+
+def run_jobs(commands, outdir, env, max_workers=1, timeout=600, queue=None, options=None):
+    """
+    Run commands as JobQueue jobs and wait for all of them. Returns (jobs, seconds, events).
+    options: one options snapshot per command, for queues with start hooks.
+    """
+    events = [0]
+    ended = []
+    done = threading.Event()
+    queue = queue or JobQueue(max_workers=max_workers)
+
+    def on_event(job, kind, data):
+        events[0] += 1
+        if kind == "state" and data in (FINISHED, FAILED):
+            ended.append(job)
+            if len(ended) == len(commands):
+                done.set()
+
+    queue.add_listener(on_event)
+    old_env = dict(os.environ)
+    os.environ.update(env)
+    try:
+        start = time.perf_counter()
+        jobs = [queue.submit(options[i]["url"], cmd, outdir, options=options[i]) if options else
+                queue.submit("bench", cmd, outdir) for i, cmd in enumerate(commands)]
+        done.wait(timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.environ.clear()
+        os.environ.update(old_env)
+    return jobs, elapsed, events[0]
+
+
+def repeat(fn, n):
+    """Run fn() n times; each run returns a dict of numbers. Returns {name: [values]}."""
+    results = {}
+    for _ in range(n):
+        for key, value in fn().items():
+            results.setdefault(key, []).append(value)
+    return results
+
+
+# ---------------- Benchmarks ----------------
+def bench_parse(lines, repeats):
+    """Parse throughput of the subprocess reader's per-line work, without the pipe."""
+    text = fake_output(lines=lines, fragments=200, merge=1, noise=1)
+    legacy = fake_output(template=False, lines=lines, fragments=200, merge=1, noise=1)
+    queue = JobQueue()
+
+    def run():
+        job = Job("bench", [], "")
+        counter = [0, None]
+        start = time.perf_counter()
+        for line in text:
+            event = parse_progress_line(line)
+            if event is not None:
+                queue._apply_progress(job, event, counter)
+            else:
+                parse_output_details(job, line)
+        protocol = len(text) / (time.perf_counter() - start)
+        # lines the protocol parser has to reject (human-readable output)
+        start = time.perf_counter()
+        for line in legacy:
+            if parse_progress_line(line) is None:
+                parse_output_details(job, line)
+        return {"protocol_lines_per_s": protocol, "log_lines_per_s": len(legacy) / (time.perf_counter() - start)}
+
+    return repeat(run, repeats)
+
+
+def bench_reader(lines, repeats):
+    """One job reading `lines` progress lines from a real pipe, start to finish."""
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs, elapsed, events = run_jobs([fake_command(tmp)], tmp, fake_env(lines=lines, size=0))
+        if jobs[0].state != FINISHED:
+            raise RuntimeError(f"reader job ended {jobs[0].state}")
+        return {"lines_per_s": lines / elapsed, "seconds": elapsed, "events": events}
+    return repeat(run, repeats)
+
+
+def bench_log(lines, repeats):
+    """Memory held by a LogStore after a `lines`-line job, and its append rate."""
+    from yd_log import LogStore
+
+    text = fake_output(lines=lines, noise=0)
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            tracemalloc.start()
+            store = LogStore(tmp)
+            job = Job("bench", [], "")
+            base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            for line in text:
+                store.on_job_event(job, "log", line)
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            store.close()
+        return {"retained_kib": (current - base) / 1024, "peak_kib": (peak - base) / 1024,
+                "lines_per_s": len(text) / elapsed}
+    return repeat(run, repeats)
+
+
+def bench_ui(events, repeats):
+    """Push-to-apply latency through UiPump on a real Tk root."""
+    import tkinter as tk
+    from yd_pump import UiPump
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {"skipped": str(e)}
+    root.withdraw()
+
+    def run():
+        latencies = []
+        pushed = {}
+        finished = threading.Event()
+
+        def apply_jobs(jobs, state_changed):
+            now = time.perf_counter()
+            for job in jobs:
+                latencies.append(now - pushed.pop(job.id))
+            if len(latencies) >= events:
+                finished.set()
+
+        pump = UiPump(root, lambda lines: None, apply_jobs, fps=20)
+        jobs = [Job("bench", [], "") for _ in range(events)]
+
+        def producer():
+            for job in jobs:
+                pushed[job.id] = time.perf_counter()
+                pump.push(job, "progress", 1.0)
+                time.sleep(0.0005)
+
+        pump.start()
+        threading.Thread(target=producer, daemon=True).start()
+        deadline = time.time() + 60
+        while not finished.is_set() and time.time() < deadline:
+            root.update()
+            time.sleep(0.001)
+        pump.stop()
+        latencies.sort()
+        return {"p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000}
+
+    try:
+        return repeat(run, repeats)
+    finally:
+        root.destroy()
+
+
+def bench_jobs(count, repeats):
+    """build_command per call, and wall time per short job (process start to FINISHED)."""
+    from yd_core import build_command
+
+    opts = {"url": "https://www.youtube.com/watch?v=benchbench01", "outdir": tempfile.gettempdir(), "format": "mp4",
+            "quality": "1080", "subtitles": "lang-en", "remux_mp4": True, "manifest": "m.tsv"}
+
+    def run():
+        n = 2000
+        start = time.perf_counter()
+        for _ in range(n):
+            build_command(opts)
+        build_us = (time.perf_counter() - start) / n * 1e6
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = [fake_command(tmp, url=f"https://www.youtube.com/watch?v=bench{i:06d}") for i in range(count)]
+            _, elapsed, _ = run_jobs(commands, tmp, fake_env(lines=1, size=0))
+        return {"build_command_us": build_us, "job_overhead_ms": elapsed / count * 1000}
+    return repeat(run, repeats)
+
+
+def bench_tuning(jobs, repeats):
+    """
+    Download an HLS stream from the local stand-in (200 ms per request, 2 MB/s
+    per connection) with real yt-dlp: once per fragment concurrency, then
+    `jobs` times with DownloadTuner choosing, starting from an empty profile.
+    """
+    import shutil
+    from yd_core import build_command
+    from yd_tuning import DownloadTuner, CONCURRENCY
+    from http_standin import start_server
+
+    if not shutil.which("yt-dlp"):
+        return {"skipped": "yt-dlp not found on PATH"}
+    server = start_server(latency=0.2, rate=2 * 1024 * 1024, segments=48, segment_size=256 * 1024)
+    url = f"http://127.0.0.1:{server.server_address[1]}/hls/index.m3u8"
+    megabytes = 48 * 256 / 1024
+
+    def options(outdir, tuning=None):
+        opts = {"url": url, "outdir": outdir, "format": "webm", "quality": "1080", "subtitles": "none"}
+        if tuning:
+            opts["tuning"] = tuning
+        return opts
+
+    def run():
+        result = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for n in CONCURRENCY:
+                outdir = os.path.join(tmp, f"fixed{n}")
+                opts = options(outdir, {"concurrency": n, "chunk": "", "downloader": ""})
+                _, elapsed, _ = run_jobs([build_command(opts)], outdir, {})
+                result[f"N={n}_mb_per_s"] = megabytes / elapsed
+            queue = JobQueue(max_workers=1, command_builder=build_command)
+            tuner = DownloadTuner(queue, os.path.join(tmp, "tuning.json"))
+            queue.add_start_hook(tuner.before_start)
+            queue.add_listener(tuner.on_job_event)
+            chosen = []
+            queue.add_listener(lambda job, kind, data: kind == "log" and data.startswith("[tune] ") and chosen.append(data))
+            for i in range(jobs):
+                outdir = os.path.join(tmp, f"tuned{i}")
+                opts = options(outdir)
+                _, elapsed, _ = run_jobs([build_command(opts)], outdir, {}, queue=queue, options=[opts])
+            result["tuned_last_mb_per_s"] = megabytes / elapsed
+            trials = next(iter(tuner.profiles.values()), {}).get("trials", {})
+            if trials:
+                result["tuner_best"] = max(trials, key=lambda k: trials[k]["bps"])
+            result["tuner_choices"] = [line[7:] for line in chosen if "MB/s over" not in line]
+        return result
+
+    try:
+        return repeat(run, repeats)
+    finally:
+        server.shutdown()
+
+
+BENCHES = {
+    "parse": (bench_parse, 100000),
+    "reader": (bench_reader, 100000),
+    "log": (bench_log, 100000),
+    "ui": (bench_ui, 5000),
+    "jobs": (bench_jobs, 20),
+    "tuning": (bench_tuning, 8),
+}
+
+
+# ---------------- Reporting ----------------
+def summarize(results):
+    out = {}
+    for name, values in results.items():
+        if isinstance(values, list) and values and isinstance(values[0], (int, float)):
+            out[name] = {"median": statistics.median(values), "best": (min if name.endswith(("_ms", "_us", "_kib", "seconds")) else max)(values)}
+        else:
+            out[name] = values
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the download pipeline against a fake yt-dlp.")
+    parser.add_argument("benches", nargs="*", help=f"benchmarks to run: {', '.join(BENCHES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (default: 5)")
+    parser.add_argument("--quick", action="store_true", help="a tenth of the usual sizes, for a smoke run")
+    parser.add_argument("--json", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="show the change against results saved with --json")
+    args = parser.parse_args(argv)
+    unknown = [b for b in args.benches if b not in BENCHES]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    report = {"python": platform.python_version(), "platform": platform.platform(), "repeat": args.repeat,
+              "quick": args.quick, "results": {}}
+    for name in args.benches or list(BENCHES):
+        fn, size = BENCHES[name]
+        if args.quick:
+            size = max(1, size // 10)
+        summary = summarize(fn(size, args.repeat))
+        report["results"][name] = dict(summary, n=size)
+        old_results = baseline.get(name, {})
+        if old_results and old_results.get("n") != size:
+            print(f"{name}: baseline ran with n={old_results.get('n')}, not compared")
+            old_results = {}
+        print(f"{name} (n={size}):")
+        for key, value in summary.items():
+            if not isinstance(value, dict):
+                print(f"  {key}: {value}")
+                continue
+            line = f"  {key:<22} median {value['median']:>14,.2f}   best {value['best']:>14,.2f}"
+            old = old_results.get(key)
+            if isinstance(old, dict) and old.get("median"):
+                line += f"   {(value['median'] / old['median'] - 1) * 100:+.1f}% vs baseline"
+            print(line)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
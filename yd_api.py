@@ -0,0 +1,469 @@
+"""
+Local HTTP/JSON API.
+Lets scripts feed downloads into a running instance (GUI or yd_cli.py
+--serve), so they share its queue, bandwidth budget, archive and disk.
+Listens on 127.0.0.1 only; with api_token set every request needs an
+"Authorization: Bearer <token>" header (or ?token= for EventSource).
+
+    GET    /status                  queue counts, stages, admission backlog
+    GET    /jobs                    all jobs of this session
+    GET    /jobs/<id>               one job
+    POST   /jobs                    {"url": ...} or {"urls": [...]} plus the
+                                    options of the GUI: format, quality,
+                                    subtitles, outdir, proxy, remux_mp4,
+                                    recode_mp4, no_playlist, force, priority
+    POST   /jobs/<id>/cancel|pause|resume
+    DELETE /jobs/<id>               same as cancel
+    GET    /submissions/<id>        what became of a submission
+    GET    /events?since=N&timeout=S    long poll for job events
+    GET    /events/stream?since=N       the same as server-sent events
+    GET    /metrics                 download history and live queue
+                                    gauges, Prometheus text format
+
+Submissions are admitted through a bounded backlog: POST /jobs answers 202
+with submission ids at once, or 429 (with Retry-After) while the backlog
+is full. One admission thread queues them, and holds back while the job
+queue already has max_queued jobs waiting, so a flood of requests turns
+into backpressure on the clients instead of memory growth here.
+
+    curl -H "Content-Type: application/json" -d '{"url": "https://youtu.be/...", "format": "mp3"}' \\
+        http://127.0.0.1:8765/jobs
+    curl -N http://127.0.0.1:8765/events/stream
+"""
+import os
+import json
+import time
+import itertools
+import threading
+from collections import deque, OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from yd_jobs import Job, QUEUED, DONE_STATES
+
+
+FORMATS = ("mp4", "mp3", "wav", "webm", "mov")
+# submissions waiting for the admission thread, and how many are remembered
+BACKLOG = 1000
+SUBMISSIONS_KEPT = 10000
+# the admission thread waits while this many jobs are queued
+MAX_QUEUED = 5000
+# events kept for long polls / reconnecting streams, and progress events per job and second
+EVENTS_KEPT = 10000
+PROGRESS_INTERVAL = 0.5
+MAX_POLL = 60.0
+KEEPALIVE = 15.0
+MAX_STREAMS = 16
+MAX_BODY = 1024 * 1024
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def job_info(job):
+    """The JSON view of a job."""
+    return {
+        "id": job.id,
+        "uid": job.uid,
+        "url": job.url,
+        "label": job.label,
+        "format": job.fmt,
+        "state": job.state,
+        "stage": job.stage,
+        "progress": round(job.progress, 1),
+        "eta": job.eta,
+        "speed": job.speed,
+        "downloaded_bytes": job.downloaded_bytes,
+        "total_bytes": job.total_bytes,
+        "transferred": job.transferred,
+        "elapsed": round(job.elapsed(), 1),
+        "playlist": job.group,
+        "error": job.error,
+    }
+
+
+def _bool(body, key):
+    value = body.get(key, False)
+    if not isinstance(value, bool):
+        raise ApiError(400, f"{key} must be true or false")
+    return value
+
+
+def submission_options(core, body):
+    """
+    [(opts, force)] for a POST /jobs body, built like the GUI builds them
+    (core.options). Raises ApiError(400) for anything invalid.
+    """
+    if not isinstance(body, dict):
+        raise ApiError(400, "expected a JSON object")
+    urls = body.get("urls") if "urls" in body else [body.get("url")]
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u.strip() for u in urls):
+        raise ApiError(400, "url (a string) or urls (a list of strings) is required")
+    if len(urls) > BACKLOG:
+        raise ApiError(400, f"at most {BACKLOG} urls per request")
+    fmt = body.get("format", "mp4")
+    if fmt not in FORMATS:
+        raise ApiError(400, f"format must be one of {', '.join(FORMATS)}")
+    quality = str(body.get("quality", "1080"))
+    if not quality.isdigit():
+        raise ApiError(400, "quality must be a video height like 1080")
+    subtitles = body.get("subtitles", "none")
+    if not isinstance(subtitles, str) or not subtitles:
+        raise ApiError(400, "subtitles must be 'none', 'auto-all' or a language code")
+    if subtitles not in ("none", "auto-all") and not subtitles.startswith("lang-"):
+        subtitles = f"lang-{subtitles}"
+    outdir = body.get("outdir") or core.settings["default_output"]
+    if not isinstance(outdir, str):
+        raise ApiError(400, "outdir must be a path")
+    outdir = os.path.abspath(os.path.expanduser(outdir))
+    overrides = {key: _bool(body, key) for key in ("remux_mp4", "recode_mp4", "no_playlist") if key in body}
+    if "proxy" in body:
+        from yd_proxy import parse_proxies
+        try:
+            proxies = parse_proxies(body["proxy"]) if body["proxy"] else [""]
+        except (TypeError, ValueError) as e:
+            raise ApiError(400, f"proxy: {e}")
+        if len(proxies) != 1:
+            raise ApiError(400, "proxy: one proxy per submission")
+        overrides["proxy"] = proxies[0]
+    if "priority" in body:
+        if isinstance(body["priority"], bool) or not isinstance(body["priority"], int):
+            raise ApiError(400, "priority must be an integer")
+        overrides["priority"] = body["priority"]
+    force = _bool(body, "force")
+    return [(dict(core.options(u.strip(), outdir, fmt, quality, subtitles), **overrides), force) for u in urls]
+
+
+class EventLog:
+    """
+    Numbered job events for long polls and event streams. Register
+    on_job_event as a JobQueue listener. Keeps the last EVENTS_KEPT events;
+    progress events are limited to one per job every PROGRESS_INTERVAL.
+    """
+
+    def __init__(self, size=EVENTS_KEPT):
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._last_progress = {}
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def on_job_event(self, job, kind, data):
+        if kind not in ("state", "stage", "progress"):
+            return
+        now = time.monotonic()
+        if kind == "progress":
+            if data is not None and data < 100 and now - self._last_progress.get(job.id, 0) < PROGRESS_INTERVAL:
+                return
+            self._last_progress[job.id] = now
+        elif kind == "state" and data in DONE_STATES:
+            self._last_progress.pop(job.id, None)
+        info = job_info(job)
+        if kind == "state":
+            # the event's state, not whatever the job moved on to meanwhile
+            info["state"] = data
+        with self._cond:
+            self._seq += 1
+            self._events.append({"seq": self._seq, "kind": kind, "time": time.time(), "job": info})
+            self._cond.notify_all()
+
+    def since(self, seq, timeout=0):
+        """
+        (events after seq, missed) waiting up to timeout seconds for the
+        first one; missed is True when events after seq were dropped already.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= seq:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return [], False
+                self._cond.wait(left)
+            events = [e for e in self._events if e["seq"] > seq]
+        return events, bool(events) and events[0]["seq"] > seq + 1
+
+
+class ApiServer:
+    """
+    The HTTP server and its admission thread for one DownloadCore.
+    start() returns self; close() stops accepting requests.
+    """
+
+    def __init__(self, core, port=8765, token="", backlog=BACKLOG, max_queued=MAX_QUEUED):
+        self.core = core
+        self.port = port
+        self.token = token
+        self.backlog = backlog
+        self.max_queued = max_queued
+        self.events = EventLog()
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._submissions = OrderedDict()
+        self._ids = itertools.count(1)
+        self._streams = 0
+        self._closed = False
+        self._server = None
+
+    def start(self):
+        """Bind 127.0.0.1:port and serve on daemon threads. Raises OSError if the port is taken."""
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), ApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.port = self._server.server_address[1]
+        self.core.add_listener(self.events.on_job_event)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._admit_loop, daemon=True).start()
+        return self
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self.core.job_queue.remove_listener(self.events.on_job_event)
+            self._server.shutdown()
+            self._server.server_close()
+
+    # ----- admission -----
+    def submit(self, body):
+        """Put the downloads of a POST /jobs body into the backlog. Returns their submission records."""
+        entries = submission_options(self.core, body)
+        with self._cond:
+            if self._closed:
+                raise ApiError(503, "shutting down")
+            if len(self._pending) + len(entries) > self.backlog:
+                raise ApiError(429, f"backlog full ({len(self._pending)} submissions waiting)", {"Retry-After": "5"})
+            records = []
+            for opts, force in entries:
+                record = {"id": next(self._ids), "url": opts["url"], "status": "waiting", "job": None, "playlist": None,
+                          "error": ""}
+                self._submissions[record["id"]] = record
+                self._pending.append((record, opts, force))
+                records.append(dict(record))
+            while len(self._submissions) > SUBMISSIONS_KEPT:
+                self._submissions.popitem(last=False)
+            self._cond.notify_all()
+        return records
+
+    def submission(self, sid):
+        with self._cond:
+            record = self._submissions.get(sid)
+            return dict(record) if record else None
+
+    def backlog_size(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _admit_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                record, opts, force = self._pending[0]
+            # backpressure: let the queue drain before adding more
+            while self.core.job_queue.counts().get(QUEUED, 0) >= self.max_queued and not self._closed:
+                time.sleep(0.5)
+            with self._cond:
+                self._pending.popleft()
+            status, job_id, playlist, error = "failed", None, None, ""
+            try:
+                result = self.core.add(opts, confirm=(lambda have: True) if force else None)
+                if result is None:
+                    status = "skipped"
+                elif isinstance(result, Job):
+                    status, job_id = "queued", result.id
+                else:
+                    status, playlist = "playlist", result.uid
+            except Exception as e:
+                error = str(e)
+            with self._cond:
+                record.update(status=status, job=job_id, playlist=playlist, error=error)
+
+    # ----- requests -----
+    def authorized(self, handler, query):
+        if not self.token:
+            return True
+        header = handler.headers.get("Authorization", "")
+        return header == f"Bearer {self.token}" or query.get("token", [""])[0] == self.token
+
+    def status(self):
+        return {
+            "jobs": self.core.job_queue.counts(),
+            "stages": self.core.stage_meter.report(),
+            "backlog": self.backlog_size(),
+            "backlog_limit": self.backlog,
+            "last_event": self.events.last_seq,
+        }
+
+    def job(self, job_id):
+        job = self.core.job_queue.get(job_id)
+        if job is None:
+            raise ApiError(404, f"no job {job_id}")
+        return job
+
+    def action(self, job_id, name):
+        job = self.job(job_id)
+        queue = self.core.job_queue
+        done = {"cancel": queue.cancel, "pause": queue.pause, "resume": queue.resume}[name](job.id)
+        if not done:
+            raise ApiError(409, f"cannot {name} a job that is {job.state}")
+        return job_info(job)
+
+    def metrics_text(self):
+        lines = [self.core.metrics.prometheus_text().rstrip("\n"),
+                 "# HELP yd_queue_jobs Jobs of this session by state.", "# TYPE yd_queue_jobs gauge"]
+        lines += [f'yd_queue_jobs{{state="{state}"}} {n}' for state, n in sorted(self.core.job_queue.counts().items())]
+        lines += ["# HELP yd_api_backlog Submissions waiting for admission.", "# TYPE yd_api_backlog gauge",
+                  f"yd_api_backlog {self.backlog_size()}"]
+        return "\n".join(lines) + "\n"
+
+    def open_stream(self):
+        with self._cond:
+            if self._streams >= MAX_STREAMS:
+                raise ApiError(503, f"too many event streams (at most {MAX_STREAMS})")
+            self._streams += 1
+
+    def close_stream(self):
+        with self._cond:
+            self._streams -= 1
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be a number")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+    server_version = "YD-API/1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = (json.dumps(body) if content_type == "application/json" else body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        api = self.server.api
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        try:
+            # pages of other sites may reach localhost too: only plain local
+            # host names, and JSON bodies (which browsers cannot send cross-site
+            # without a preflight this server never answers)
+            host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+            if host not in ("127.0.0.1", "localhost"):
+                raise ApiError(403, "requests must be addressed to 127.0.0.1 or localhost")
+            if not api.authorized(self, query):
+                raise ApiError(401, "missing or wrong token")
+            if method == "GET":
+                self._get(api, parts, query)
+            elif method == "POST":
+                self._post(api, parts)
+            elif method == "DELETE" and len(parts) == 2 and parts[0] == "jobs":
+                self._send(200, api.action(_int(parts[1], "job id"), "cancel"))
+            else:
+                raise ApiError(404, "not found")
+        except ApiError as e:
+            self._send(e.status, {"error": str(e)}, headers=e.headers)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print("API error:", e)
+            self._send(500, {"error": str(e)})
+
+    def _get(self, api, parts, query):
+        if parts == ["status"]:
+            self._send(200, api.status())
+        elif parts == ["jobs"]:
+            self._send(200, {"jobs": [job_info(j) for j in list(api.core.job_queue.jobs.values())]})
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self._send(200, job_info(api.job(_int(parts[1], "job id"))))
+        elif len(parts) == 2 and parts[0] == "submissions":
+            record = api.submission(_int(parts[1], "submission id"))
+            if record is None:
+                raise ApiError(404, f"no submission {parts[1]}")
+            self._send(200, record)
+        elif parts == ["events"]:
+            since = _int(query.get("since", [api.events.last_seq])[0], "since")
+            timeout = min(MAX_POLL, max(0.0, float(_int(query.get("timeout", [30])[0], "timeout"))))
+            events, missed = api.events.since(since, timeout)
+            self._send(200, {"events": events, "next": events[-1]["seq"] if events else max(since, 0), "missed": missed})
+        elif parts == ["events", "stream"]:
+            self._stream(api, query)
+        elif parts == ["metrics"]:
+            self._send(200, api.metrics_text(), content_type="text/plain; version=0.0.4")
+        else:
+            raise ApiError(404, "not found")
+
+    def _post(self, api, parts):
+        if parts == ["jobs"]:
+            if not (self.headers.get("Content-Type") or "").startswith("application/json"):
+                raise ApiError(415, "Content-Type must be application/json")
+            length = _int(self.headers.get("Content-Length") or 0, "Content-Length")
+            if length > MAX_BODY:
+                raise ApiError(413, "request body too large")
+            try:
+                body = json.loads(self.rfile.read(length) or b"null")
+            except ValueError as e:
+                raise ApiError(400, f"invalid JSON: {e}")
+            records = api.submit(body)
+            self._send(202, {"submissions": records, "backlog": api.backlog_size()})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] in ("cancel", "pause", "resume"):
+            self._send(200, api.action(_int(parts[1], "job id"), parts[2]))
+        else:
+            raise ApiError(404, "not found")
+
+    def _stream(self, api, query):
+        last = query.get("since", [self.headers.get("Last-Event-ID") or api.events.last_seq])[0]
+        seq = _int(last, "since")
+        api.open_stream()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            while not api.closed:
+                events, missed = api.events.since(seq, KEEPALIVE)
+                if missed:
+                    self.wfile.write(b"event: missed\ndata: {}\n\n")
+                chunks = []
+                for e in events:
+                    chunks.append(f"id: {e['seq']}\nevent: {e['kind']}\ndata: {json.dumps(e)}\n\n")
+                    seq = e["seq"]
+                self.wfile.write(("".join(chunks) or ": keepalive\n\n").encode("utf-8"))
+                self.wfile.flush()
+        finally:
+            api.close_stream()
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
@@ -0,0 +1,321 @@
+"""
+Completed-downloads index.
+Remembers every finished download keyed by video key ("youtube:<id>") plus
+output variant (format and quality), with the output path, byte size, mtime
+and a quick content fingerprint. "Already have it?" is one primary-key
+lookup and a stat(), so it is answered before any network work, and it
+stays fast with hundreds of thousands of rows. A file that is gone from
+its recorded path is looked for (same size and fingerprint) in the output
+folders, so a download the user moved or renamed there is not fetched again.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from yd_jobs import FINISHED
+
+
+FINGERPRINT_CHUNK = 64 * 1024
+# seconds a listing of the search folders is reused for looking up moved files
+SEARCH_TTL = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    video_key TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    fingerprint TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (video_key, variant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS downloads_size ON downloads(size);
+CREATE INDEX IF NOT EXISTS downloads_variant ON downloads(variant);
+"""
+
+
+def variant_for(opts):
+    """Output variant of a download: "mp3", "wav" or e.g. "mp4-1080"."""
+    fmt = opts.get("format", "")
+    if fmt in ("mp3", "wav"):
+        return fmt
+    return f"{fmt}-{opts.get('quality', '')}"
+
+
+def fingerprint(path, size=None):
+    """
+    Fast content fingerprint: blake2b over the size, the first and the last
+    64 KiB. Cheap even for multi-GB files and good enough to tell files apart.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(FINGERPRINT_CHUNK))
+        if size > 2 * FINGERPRINT_CHUNK:
+            f.seek(size - FINGERPRINT_CHUNK)
+            h.update(f.read(FINGERPRINT_CHUNK))
+    return h.hexdigest()
+
+
+def size_index(folders):
+    """{size: [paths]} of every file under folders (recursively)."""
+    by_size = {}
+    for folder in folders:
+        for dirpath, _, names in os.walk(folder):
+            for name in names:
+                p = os.path.join(dirpath, name)
+                try:
+                    by_size.setdefault(os.path.getsize(p), []).append(p)
+                except OSError:
+                    pass
+    return by_size
+
+
+class DownloadArchive:
+    """
+    SQLite index of completed downloads (Necessary/archive.sqlite).
+    Use on_job_event as a JobQueue listener; it records the files listed in
+    the job's manifest (written by yt-dlp's --print-to-file after_move).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # folders (e.g. the output folders) a file that left its recorded
+        # path is looked for in; their listing is reused for SEARCH_TTL seconds
+        self.search_folders = []
+        self._search_lock = threading.Lock()
+        self._listing = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    # ----- queries -----
+    def has(self, video_key, variant, verify=True):
+        """
+        Return the archive row as a dict if video_key/variant was downloaded
+        and (with verify) the file is still where we left it, else None.
+        A file that vanished is looked for in search_folders (and its own
+        folder) and its new path recorded; if it is not found it is dropped
+        from the index. A file whose mtime changed is re-fingerprinted
+        before it counts.
+        """
+        if not video_key:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size, mtime, fingerprint FROM downloads WHERE video_key = ? AND variant = ?",
+                (video_key, variant),
+            ).fetchone()
+        if not row:
+            return None
+        entry = {"video_key": video_key, "variant": variant, "path": row[0], "size": row[1], "mtime": row[2], "fingerprint": row[3]}
+        if verify and not self._verify(entry):
+            return None
+        return entry
+
+    def keys(self, variant, batch=5000):
+        """Iterate the video keys known for variant, read in batches (e.g. to build an index)."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT video_key FROM downloads WHERE variant = ? AND video_key > ? ORDER BY video_key LIMIT ?",
+                    (variant, last, batch),
+                ).fetchall()
+            for (video_key,) in rows:
+                yield video_key
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def _verify(self, entry):
+        try:
+            st = os.stat(entry["path"])
+        except OSError:
+            moved = self._find_moved(entry)
+            if moved is None:
+                self.forget(entry["video_key"], entry["variant"])
+                return False
+            self._set_path(entry["video_key"], entry["variant"], moved)
+            entry["path"] = os.path.abspath(moved)
+            return True
+        if st.st_size != entry["size"]:
+            self.forget(entry["video_key"], entry["variant"])
+            return False
+        if abs(st.st_mtime - entry["mtime"]) > 1:
+            if fingerprint(entry["path"], st.st_size) != entry["fingerprint"]:
+                self.forget(entry["video_key"], entry["variant"])
+                return False
+            with self._lock:
+                self._db.execute(
+                    "UPDATE downloads SET mtime = ? WHERE video_key = ? AND variant = ?",
+                    (st.st_mtime, entry["video_key"], entry["variant"]),
+                )
+                self._db.commit()
+        return True
+
+    def _find_moved(self, entry):
+        # a file of the entry's size and fingerprint in the search folders, or None
+        folders = list(dict.fromkeys(self.search_folders + [os.path.dirname(entry["path"])]))
+        folders = [os.path.abspath(f) for f in folders if f and os.path.isdir(f)]
+        if not folders:
+            return None
+        with self._search_lock:
+            # one walk serves all the lookups of a playlist or an import
+            listing = self._listing
+            if listing is None or listing[0] != folders or time.monotonic() - listing[1] > SEARCH_TTL:
+                listing = self._listing = (folders, time.monotonic(), size_index(folders))
+        for candidate in listing[2].get(entry["size"], []):
+            try:
+                if fingerprint(candidate, entry["size"]) == entry["fingerprint"]:
+                    return candidate
+            except OSError:
+                pass
+        return None
+
+    def _set_path(self, video_key, variant, path):
+        with self._lock:
+            self._db.execute(
+                "UPDATE downloads SET path = ?, mtime = ? WHERE video_key = ? AND variant = ?",
+                (os.path.abspath(path), os.path.getmtime(path), video_key, variant),
+            )
+            self._db.commit()
+
+    # ----- updates -----
+    def record(self, video_key, variant, path):
+        """Add or replace the entry for a finished file."""
+        st = os.stat(path)
+        fp = fingerprint(path, st.st_size)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (video_key, variant, os.path.abspath(path), st.st_size, st.st_mtime, fp, time.time()),
+            )
+            self._db.commit()
+
+    def forget(self, video_key, variant):
+        with self._lock:
+            self._db.execute("DELETE FROM downloads WHERE video_key = ? AND variant = ?", (video_key, variant))
+            self._db.commit()
+
+    def record_manifest(self, manifest_path, variant):
+        """
+        Record every file listed in a yt-dlp after_move manifest
+        (see yd_engine.MANIFEST_TEMPLATE).
+        Returns the number of entries recorded.
+        """
+        n = 0
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 2)
+                    if len(parts) != 3 or not os.path.exists(parts[2]):
+                        continue
+                    self.record(f"{parts[0].lower()}:{parts[1]}", variant, parts[2])
+                    n += 1
+        except OSError:
+            pass
+        return n
+
+    def on_job_event(self, job, kind, data):
+        if kind != "state" or data != FINISHED:
+            return
+        manifest = job.options.get("manifest")
+        if manifest:
+            self.record_manifest(manifest, variant_for(job.options))
+
+    # ----- yt-dlp integration -----
+    def write_ytdlp_archive(self, variant, path):
+        """
+        Write the ids known for variant in yt-dlp's --download-archive format
+        ("<extractor> <id>" per line), so yt-dlp skips those playlist entries
+        before extracting them. Rows are streamed, not loaded at once.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            cur = self._db.execute("SELECT video_key FROM downloads WHERE variant = ?", (variant,))
+            with open(path, "w", encoding="utf-8") as f:
+                for (video_key,) in cur:
+                    extractor, _, vid = video_key.partition(":")
+                    f.write(f"{extractor} {vid}\n")
+        return path
+
+    # ----- maintenance -----
+    def prune_missing(self, batch=1000):
+        """
+        Stat every indexed file in batches and drop the ones that are gone.
+        Returns the number of removed rows.
+        """
+        removed = 0
+        last = ("", "")
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT video_key, variant, path, size FROM downloads WHERE (video_key, variant) > (?, ?) "
+                    "ORDER BY video_key, variant LIMIT ?",
+                    (last[0], last[1], batch),
+                ).fetchall()
+            if not rows:
+                return removed
+            gone = []
+            for video_key, variant, path, size in rows:
+                try:
+                    if os.path.getsize(path) != size:
+                        gone.append((video_key, variant))
+                except OSError:
+                    gone.append((video_key, variant))
+            if gone:
+                with self._lock:
+                    self._db.executemany("DELETE FROM downloads WHERE video_key = ? AND variant = ?", gone)
+                    self._db.commit()
+                removed += len(gone)
+            last = (rows[-1][0], rows[-1][1])
+
+    def check(self, folders=None):
+        """
+        Bulk check of the whole index: relocate() the moved files (in folders,
+        default search_folders), then prune_missing() the ones that are gone.
+        Returns (relocated, removed).
+        """
+        folders = [f for f in (folders or self.search_folders) if f and os.path.isdir(f)]
+        moved = self.relocate(folders) if folders else 0
+        return moved, self.prune_missing()
+
+    def relocate(self, folders):
+        """
+        Find files that were moved: for every entry whose path no longer
+        exists, look for a file of the same size and fingerprint in folders
+        (recursively) and update the path. Returns the number relocated.
+        """
+        by_size = size_index(folders)
+        moved = 0
+        with self._lock:
+            rows = self._db.execute("SELECT video_key, variant, path, size, fingerprint FROM downloads").fetchall()
+        for video_key, variant, path, size, fp in rows:
+            if os.path.exists(path) or size not in by_size:
+                continue
+            for candidate in by_size[size]:
+                try:
+                    if fingerprint(candidate, size) == fp:
+                        self._set_path(video_key, variant, candidate)
+                        moved += 1
+                        break
+                except OSError:
+                    pass
+        return moved
@@ -0,0 +1,235 @@
+"""
+Global bandwidth budget shared by all active downloads.
+The budget (optionally different per time of day) is split between the
+running jobs with max-min fairness: jobs that cannot use their equal share
+keep what they measurably use and the rest goes to the others. Shares are
+applied through --limit-rate for yt-dlp.exe jobs (restarting the process
+when a share changes a lot; yt-dlp resumes the .part file) and through a
+token bucket in the progress hook for in-process jobs.
+"""
+import re
+import time
+import threading
+
+from yd_jobs import QUEUED, RUNNING, DONE_STATES
+from yd_engine import ENGINE_INPROCESS
+from yd_units import parse_rate, format_rate
+
+
+MIN_SHARE = 32 * 1024
+# a job using less than this fraction of its share is not limited by it
+SATURATION = 0.85
+HEADROOM = 1.25
+# yt-dlp.exe jobs are only restarted for big changes, and not too often
+RESTART_CHANGE = 0.3
+RESTART_INTERVAL = 20.0
+TICK = 2.0
+
+def parse_profiles(text):
+    """
+    Parse time-of-day profiles like "08:00-18:00=2M, 18:00-23:00=10M".
+    Ranges may wrap past midnight. Returns a list of (start_min, end_min, bps).
+    """
+    profiles = []
+    for part in (text or "").replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        m = re.fullmatch(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\S+)", part)
+        if not m:
+            raise ValueError(f"invalid profile: {part!r}")
+        h1, m1, h2, m2, rate = m.groups()
+        profiles.append((int(h1) * 60 + int(m1), int(h2) * 60 + int(m2), parse_rate(rate)))
+    return profiles
+
+
+class TokenBucket:
+    """
+    Blocking token bucket. consume(n) sleeps until n bytes fit into the
+    current rate; rate can be changed at any time (0 = unlimited).
+    """
+
+    def __init__(self, rate, burst_seconds=1.0):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n, should_stop=None):
+        with self._lock:
+            rate = self.rate
+            now = time.monotonic()
+            if not rate:
+                self._last = now
+                return
+            self._tokens = min(rate * self.burst_seconds, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / rate if self._tokens < 0 else 0
+        # sleep in small steps so pause/cancel stays responsive
+        end = time.monotonic() + wait
+        while wait > 0:
+            if should_stop and should_stop():
+                return
+            time.sleep(min(wait, 0.2))
+            wait = end - time.monotonic()
+
+
+class BandwidthScheduler:
+    """
+    Divides the budget between running jobs of a JobQueue.
+    Register on_job_event as a listener and before_start as a start hook;
+    a background thread re-measures and rebalances every TICK seconds.
+    """
+
+    def __init__(self, job_queue, budget=0, profiles=None):
+        self.job_queue = job_queue
+        self.budget = budget
+        self.profiles = list(profiles or [])
+        self.shares = {}
+        # rates: measured bytes/s per job id (EWMA over TICK windows)
+        self.rates = {}
+        self._samples = {}
+        self._active = {}
+        self._last_restart = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def configure(self, budget, profiles=None):
+        with self._lock:
+            self.budget = budget
+            self.profiles = list(profiles or [])
+        self.rebalance()
+
+    def current_budget(self, now=None):
+        """Budget in bytes/s for the current time of day (0 = unlimited)."""
+        t = time.localtime(now)
+        minute = t.tm_hour * 60 + t.tm_min
+        for start, end, bps in self.profiles:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return bps
+        return self.budget
+
+    def measured_total(self):
+        """Measured aggregate throughput of all running jobs (bytes/s)."""
+        return sum(self.rate_of(j) for j in list(self._active.values()))
+
+    def rate_of(self, job):
+        # own measurement from transferred bytes; yt-dlp's speed for yt-dlp.exe jobs
+        rate = self.rates.get(job.id)
+        return rate if rate is not None else (job.speed or 0)
+
+    def _measure(self):
+        now = time.monotonic()
+        for job in list(self._active.values()):
+            last = self._samples.get(job.id)
+            self._samples[job.id] = (now, job.transferred)
+            if last is None or not job.transferred:
+                continue
+            dt = now - last[0]
+            if dt <= 0:
+                continue
+            rate = (job.transferred - last[1]) / dt
+            old = self.rates.get(job.id)
+            self.rates[job.id] = rate if old is None else 0.5 * old + 0.5 * rate
+
+    # ----- hooks -----
+    def before_start(self, job):
+        # give a starting job its share before the process is spawned
+        with self._lock:
+            self._active[job.id] = job
+        shares = self.rebalance(apply=False)
+        self._apply(job, shares.get(job.id, 0), starting=True)
+
+    def on_job_event(self, job, kind, data):
+        if kind != "state":
+            return
+        if data == RUNNING:
+            with self._lock:
+                self._active[job.id] = job
+            return
+        if data == QUEUED and (job.stop_requested or job.state != QUEUED):
+            # a restart (stop_requested is still set from the stopped run, or
+            # it already runs again): its share stays reserved until it runs,
+            # or the other shares would jump and every other yt-dlp.exe job
+            # would be restarted too
+            return
+        with self._lock:
+            if data in DONE_STATES:
+                self._last_restart.pop(job.id, None)
+            if self._active.pop(job.id, None) is None:
+                return
+            self.shares.pop(job.id, None)
+            self.rates.pop(job.id, None)
+            self._samples.pop(job.id, None)
+        self.rebalance()
+
+    # ----- allocation -----
+    def _allocate(self, budget, jobs):
+        # max-min fair split (water filling) using measured demand
+        if not budget or not jobs:
+            return {j.id: 0 for j in jobs}
+        shares = {}
+        remaining = budget
+        open_jobs = list(jobs)
+        while open_jobs:
+            fair = remaining / len(open_jobs)
+            capped = []
+            for j in open_jobs:
+                old = self.shares.get(j.id)
+                speed = self.rate_of(j)
+                # a measured job well below its old share does not need more
+                if old and speed and speed < old * SATURATION and speed * HEADROOM < fair:
+                    capped.append((j, speed * HEADROOM))
+            if not capped:
+                for j in open_jobs:
+                    shares[j.id] = fair
+                break
+            for j, want in capped:
+                shares[j.id] = want
+                remaining -= want
+                open_jobs.remove(j)
+        return {k: max(MIN_SHARE, int(v)) for k, v in shares.items()}
+
+    def rebalance(self, apply=True):
+        with self._lock:
+            jobs = list(self._active.values())
+            shares = self._allocate(self.current_budget(), jobs)
+        if apply:
+            for job in jobs:
+                self._apply(job, shares.get(job.id, 0))
+        return shares
+
+    def _apply(self, job, share, starting=False):
+        self.shares[job.id] = share
+        if job.engine == ENGINE_INPROCESS:
+            if job.throttle is None:
+                job.throttle = TokenBucket(share)
+            job.throttle.rate = share
+            return
+        if starting:
+            job.options["rate_limit"] = share
+            return
+        # yt-dlp.exe only reads --limit-rate at start: restart on big changes
+        current = job.options.get("rate_limit") or 0
+        if current == share:
+            return
+        changed = (not current or not share) or abs(share - current) / current > RESTART_CHANGE
+        recently = time.time() - self._last_restart.get(job.id, 0) < RESTART_INTERVAL
+        busy_tail = job.progress >= 99.0
+        if changed and not recently and not busy_tail and job.state == RUNNING:
+            self._last_restart[job.id] = time.time()
+            job.options["rate_limit"] = share
+            self.job_queue.restart(job.id, f"Bandwidth share changed to {format_rate(share) if share else 'unlimited'}, restarting")
+
+    def _loop(self):
+        while True:
+            time.sleep(TICK)
+            try:
+                self._measure()
+                self.rebalance()
+            except Exception as e:
+                print("Bandwidth scheduler error:", e)
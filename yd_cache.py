@@ -0,0 +1,272 @@
+"""
+Persistent video-metadata cache.
+A small SQLite database (Necessary/metadata.sqlite) keyed by extractor and
+video id. It stores title, duration and a trimmed format list so size
+estimates and format decisions come back without starting yt-dlp. Entries
+expire after a per-entry TTL and the least recently used ones are evicted
+once the stored data grows past max_bytes.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import subprocess
+
+from yd_urls import video_key, info_key
+from yd_jobs import popen_kwargs
+
+
+DEFAULT_TTL = 7 * 24 * 3600
+LIVE_TTL = 60
+MAX_BYTES = 64 * 1024 * 1024
+BATCH_SIZE = 50
+
+# only these format fields are kept; the full yt-dlp format dicts are huge
+FORMAT_FIELDS = (
+    "format_id", "ext", "vcodec", "acodec", "height", "width", "fps",
+    "tbr", "abr", "vbr", "filesize", "filesize_approx", "protocol", "container",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    key TEXT PRIMARY KEY,
+    title TEXT,
+    duration REAL,
+    formats TEXT,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    nbytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_last_access ON videos(last_access);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+"""
+
+
+def trim_info(info):
+    """Reduce a yt-dlp info dict to what the cache stores."""
+    formats = [
+        {k: f[k] for k in FORMAT_FIELDS if f.get(k) is not None}
+        for f in info.get("formats") or []
+    ]
+    return {
+        "key": info_key(info),
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "formats": formats,
+        "is_live": bool(info.get("is_live")),
+        "webpage_url": info.get("webpage_url") or info.get("url"),
+    }
+
+
+# ---------------- Size estimate ----------------
+def _size(fmt, duration):
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    rate = fmt.get("tbr") or fmt.get("abr")
+    if not size and rate and duration:
+        # tbr / abr are in KBit/s
+        size = rate * 1000 / 8 * duration
+    return size or 0
+
+
+def _is_video_only(f):
+    return f.get("vcodec") not in (None, "none") and f.get("acodec") == "none"
+
+
+def _is_audio_only(f):
+    return f.get("acodec") not in (None, "none") and f.get("vcodec") == "none"
+
+
+def _best(formats, key):
+    return max(formats, key=key) if formats else None
+
+
+def pick_formats(info, format_choice, quality_choice):
+    """
+    Approximate yt-dlp's choice for format_selector(format_choice, quality)
+    from a cached format list. Returns a list of the picked format dicts.
+    """
+    formats = info.get("formats") or []
+    try:
+        q = int(quality_choice)
+    except (TypeError, ValueError):
+        q = 100000
+    audio_ext = "webm" if format_choice == "webm" else "m4a"
+    audio = [f for f in formats if _is_audio_only(f)]
+    best_audio = _best(audio, lambda f: (f.get("abr") or f.get("tbr") or 0))
+    if format_choice in ("mp3", "wav"):
+        return [best_audio] if best_audio else []
+    video = [f for f in formats if _is_video_only(f) and (f.get("height") or 0) <= q]
+    best_video = _best(video, lambda f: (f.get("height") or 0, f.get("fps") or 0, f.get("tbr") or 0))
+    best_audio_ext = _best([f for f in audio if f.get("ext") == audio_ext], lambda f: (f.get("abr") or f.get("tbr") or 0))
+    if best_video and best_audio_ext:
+        return [best_video, best_audio_ext]
+    # "/best": best single file with both audio and video
+    muxed = [f for f in formats if f.get("vcodec") not in (None, "none") and f.get("acodec") not in (None, "none")]
+    best = _best(muxed, lambda f: (f.get("height") or 0, f.get("tbr") or 0))
+    return [best] if best else []
+
+
+def estimate_size(info, format_choice, quality_choice):
+    """Estimated download size in bytes for a cached entry (0 if unknown)."""
+    duration = info.get("duration")
+    return int(sum(_size(f, duration) for f in pick_formats(info, format_choice, quality_choice)))
+
+
+# ---------------- Cache ----------------
+class MetadataCache:
+    """
+    SQLite-backed metadata cache. Safe to share between threads.
+    Lookups by URL work without network through the urls table (every URL
+    that was fetched) and yd_urls.video_key (YouTube URL parsing).
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ----- lookup -----
+    def _key_for(self, url):
+        key = video_key(url)
+        if key:
+            return key
+        row = self._db.execute("SELECT key FROM urls WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, url, touch=True):
+        """
+        Return the cached entry dict for url, or None if missing or expired.
+        touch=False skips the last-access update (and its commit) for lookups
+        that must stay cheap, like the ones made while the queue is locked.
+        """
+        now = time.time()
+        with self._lock:
+            key = self._key_for(url)
+            row = None
+            if key:
+                row = self._db.execute(
+                    "SELECT key, title, duration, formats FROM videos WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if touch:
+                self._db.execute("UPDATE videos SET last_access = ? WHERE key = ?", (now, key))
+                self._db.commit()
+        return {"key": row[0], "title": row[1], "duration": row[2], "formats": json.loads(row[3] or "[]")}
+
+    # ----- store -----
+    def put_many(self, infos, url=None, ttl=None):
+        """
+        Store yt-dlp info dicts in one transaction. If url is given (the
+        single-video URL that was fetched) it is mapped to the first entry.
+        """
+        now = time.time()
+        rows = []
+        url_rows = []
+        for info in infos:
+            entry = trim_info(info)
+            formats = json.dumps(entry["formats"], separators=(",", ":"))
+            entry_ttl = LIVE_TTL if entry["is_live"] else (ttl or self.ttl)
+            rows.append((entry["key"], entry["title"], entry["duration"], formats,
+                         now, now + entry_ttl, now, len(formats)))
+            if entry["webpage_url"]:
+                url_rows.append((entry["webpage_url"], entry["key"]))
+        if not rows:
+            return
+        if url:
+            url_rows.append((url, rows[0][0]))
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?)", url_rows)
+            self._db.commit()
+            self._evict()
+
+    def put(self, info, url=None, ttl=None):
+        self.put_many([info], url=url, ttl=ttl)
+
+    def _evict(self):
+        # drop expired rows, then least recently used rows until under max_bytes (lock held)
+        self._db.execute("DELETE FROM videos WHERE expires_at <= ?", (time.time(),))
+        total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM videos").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            cur = self._db.execute("SELECT key, nbytes FROM videos ORDER BY last_access")
+            victims = []
+            for key, nbytes in cur:
+                victims.append((key,))
+                excess -= nbytes
+                if excess <= 0:
+                    break
+            self._db.executemany("DELETE FROM videos WHERE key = ?", victims)
+        self._db.execute("DELETE FROM urls WHERE key NOT IN (SELECT key FROM videos)")
+        self._db.commit()
+
+    # ----- fetching -----
+    def fetch(self, url, yt_dlp_path, timeout=None, on_entry=None, extra_args=None):
+        """
+        Run one `yt-dlp --dump-json` pass over url and cache every entry.
+        For a playlist this fills the cache for all entries with a single
+        process instead of one process per video. Entries are committed in
+        batches of BATCH_SIZE while yt-dlp is still running; on_entry(entry)
+        is called for each. Returns the list of cached entries.
+        """
+        cmd = [yt_dlp_path, "--dump-json", "--no-warnings", "--ignore-errors"]
+        cmd.extend(extra_args or [])
+        cmd.append(url)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, encoding="utf-8", errors="replace", **popen_kwargs())
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, proc.kill)
+            timer.start()
+        entries = []
+        batch = []
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line.startswith("{"):
+                    continue
+                try:
+                    info = json.loads(line)
+                except ValueError:
+                    continue
+                batch.append(info)
+                entry = trim_info(info)
+                entries.append(entry)
+                if on_entry:
+                    on_entry(entry)
+                if len(batch) >= BATCH_SIZE:
+                    self.put_many(batch)
+                    batch = []
+            proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            # an error above leaves yt-dlp blocked on a full stdout pipe
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+        # a single result means url points at that video; remember the mapping
+        self.put_many(batch, url=url if len(entries) == 1 else None)
+        return entries
@@ -0,0 +1,421 @@
+"""
+Command line / batch front end.
+Downloads every URL given on the command line or in a URL file with the
+same queue, archive, playlist expansion and bandwidth budget as the GUI,
+without importing Tk, e.g.
+
+    python yd_cli.py -a urls.txt -j 4 -f mp3
+    python yd_cli.py --startup-time
+    python yd_cli.py --stats --export-stats stats.prom
+    python yd_cli.py --check-archive -o /mnt/media
+    python yd_cli.py --serve 8765
+    python yd_cli.py --shared-queue /mnt/share/queue.sqlite -a urls.txt
+    python yd_cli.py --shared-queue /mnt/share/queue.sqlite --worker
+    python yd_cli.py --subscribe "https://www.youtube.com/@channel/videos" --interval 30
+    python yd_cli.py --sync
+    python yd_cli.py --policy sjf -a urls.txt
+    python yd_cli.py --compare-policies
+    python yd_cli.py --import export.csv -f mp3
+
+--serve keeps running after the queue drains and takes downloads over the
+local HTTP API (yd_api) until Ctrl+C. With --shared-queue the URLs go into
+a queue shared by several hosts instead (yd_distributed); --worker runs
+downloads from it until Ctrl+C, --coordinator serves a queue file to
+workers over TCP and --queue-status shows what is going on. --sync
+checks every subscription (yd_subscriptions) once and downloads what is
+new; --serve also keeps checking them on their schedule. --policy picks
+the order queued downloads start in (yd_scheduling), --priority ranks the
+URLs of this call and --compare-policies reports the time to completion
+per policy from the history. --import streams a big text / CSV list
+(yd_import): duplicates of queued or downloaded videos are skipped and
+the rest is queued in batches. Exit code is 0 when every job
+finished, 1 when any job failed and 130 when interrupted (not for --serve).
+Interrupted jobs stay in the journal; --resume (or the next GUI start)
+continues them from their partial files.
+"""
+import time
+
+T0 = time.perf_counter()
+
+import os
+import sys
+import signal
+import argparse
+import threading
+
+from yd_settings import load_settings
+from yd_jobs import RUNNING, FINISHED, FAILED, CANCELLED, QUEUED, POSTPROCESSING
+from yd_engine import ENGINES
+from yd_scheduling import POLICIES
+
+
+def read_url_file(path):
+    """
+    URLs from a batch file (one per line, '#' and ';' start comments, the
+    same rules as yt-dlp's --batch-file). "-" reads from stdin.
+    """
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        urls = []
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(("#", ";", "]")):
+                urls.append(line)
+        return urls
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def subtitle_choice(value):
+    """--subtitles value as the settings spell it ('en' -> 'lang-en')."""
+    if value not in ("none", "auto-all") and not value.startswith("lang-"):
+        return f"lang-{value}"
+    return value
+
+
+def shared_queue_main(args, urls, queue, token):
+    """
+    --shared-queue: queue the URLs there, print --queue-status and run
+    the --coordinator. Returns an exit code.
+    """
+    from yd_distributed import request_for, status_text, QueueServer
+    try:
+        if urls:
+            outdir = os.path.abspath(args.output) if args.output else ""
+            ids = queue.put([request_for(url, outdir, args.format, args.quality, subtitle_choice(args.subtitles))
+                             for url in urls])
+            print(f"queued {len(ids)} download(s) in {args.shared_queue} (#{ids[0]}-#{ids[-1]})", flush=True)
+        if args.queue_status:
+            print(status_text(queue), flush=True)
+    except (OSError, RuntimeError) as e:
+        print(f"error: shared queue: {e}", file=sys.stderr)
+        return 2
+    if args.coordinator is not None:
+        host, _, port = args.coordinator.rpartition(":")
+        try:
+            server = QueueServer(queue, host or "127.0.0.1", int(port), token)
+        except (OSError, ValueError) as e:
+            print(f"error: coordinator: {e}", file=sys.stderr)
+            return 2
+        print(f"coordinator for {args.shared_queue} on tcp://{host or '127.0.0.1'}:{server.server_address[1]} "
+              f"(Ctrl+C stops)", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+    elif not urls and not args.queue_status and not args.worker:
+        print("error: nothing to do (pass URLs, --worker, --coordinator or --queue-status)", file=sys.stderr)
+        return 2
+    return 0
+
+
+def manage_subscriptions(core, args):
+    """--subscribe / --unsubscribe / --subscriptions. Returns an exit code."""
+    from yd_subscriptions import subscriptions_text
+    subs = core.subscriptions
+    interval = (args.interval or core.settings.get("subscription_interval", 60)) * 60
+    outdir = os.path.abspath(args.output) if args.output else ""
+    for url in args.subscribe:
+        try:
+            sub_id = subs.add(url, outdir, args.format, args.quality, subtitle_choice(args.subtitles), interval,
+                              backfill=not args.no_backfill)
+        except ValueError as e:
+            print(f"error: {url}: {e}", file=sys.stderr)
+            return 2
+        print(f"subscribed #{sub_id}: {url}", flush=True)
+    for ref in args.unsubscribe:
+        if not subs.remove(ref):
+            print(f"error: no subscription {ref}", file=sys.stderr)
+            return 2
+        print(f"unsubscribed {ref}", flush=True)
+    if args.subscriptions:
+        print(subscriptions_text(subs), flush=True)
+    return 0
+
+
+def _interrupt(signum, frame):
+    # SIGTERM (service stop) shuts a worker down like Ctrl+C
+    raise KeyboardInterrupt
+
+
+def print_stats(core):
+    from yd_metrics import summary_table
+    print(summary_table(core.metrics.summary()), flush=True)
+
+
+def compare_policies(core):
+    from yd_scheduling import report_text
+    print(report_text(core.metrics.rows(), core.job_queue.max_workers, core.metrics.policy), flush=True)
+
+
+def export_stats(core, path):
+    """Write the metrics aggregates to path (format by extension). Returns an exit code."""
+    if not path:
+        return 0
+    try:
+        if path.endswith((".prom", ".txt")):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(core.metrics.prometheus_text())
+        else:
+            core.metrics.export_json(path)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download videos with the YouTube Downloader core (no GUI).")
+    parser.add_argument("urls", nargs="*", help="video or playlist URLs")
+    parser.add_argument("-a", "--batch-file", action="append", default=[], help="file with one URL per line ('-' for stdin)")
+    parser.add_argument("--import", dest="import_files", action="append", default=[], metavar="FILE",
+                        help="import a large URL list (text, .csv or .tsv; '-' for stdin), skipping duplicates and known downloads")
+    parser.add_argument("-j", "--parallel", type=int, help="number of parallel downloads (default: settings)")
+    parser.add_argument("-o", "--output", help="output folder (default: settings)")
+    parser.add_argument("-f", "--format", default="mp4", choices=["mp4", "mp3", "wav", "webm", "mov"])
+    parser.add_argument("-q", "--quality", default="1080", help="maximum video height (default: 1080)")
+    parser.add_argument("--subtitles", default="none", help="'none', 'auto-all' or a language code like 'en'")
+    parser.add_argument("--engine", choices=ENGINES, help="download engine (default: settings)")
+    parser.add_argument("--proxy", help="proxy or comma-separated proxy list to use (default: settings)")
+    parser.add_argument("--limit-rate", help="total bandwidth budget like 5M (default: settings)")
+    parser.add_argument("--policy", choices=POLICIES, help="order queued downloads start in (default: settings)")
+    parser.add_argument("--priority", type=int, default=0, help="priority of these URLs; higher starts first under the priority, sjf and fair policies")
+    parser.add_argument("--no-skip", action="store_true", help="download again even if the archive has it")
+    parser.add_argument("--resume", action="store_true", help="also continue the unfinished downloads of the last (crashed or closed) session")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the yt-dlp output of every job")
+    parser.add_argument("--startup-time", action="store_true", help="print how long startup took (exits if no URLs)")
+    parser.add_argument("--stats", action="store_true", help="print per-format timing percentiles from the download history (exits if no URLs)")
+    parser.add_argument("--check-archive", action="store_true", help="find moved files (in the output folders and -o) and drop deleted ones from the download archive (exits if no URLs)")
+    parser.add_argument("--serve", nargs="?", const=0, type=int, metavar="PORT", help="keep running and take downloads over the local HTTP API (port default: settings)")
+    parser.add_argument("--subscribe", action="append", default=[], metavar="URL", help="subscribe to a channel or playlist with -f/-q/-o/--subtitles (new videos are queued on every sync)")
+    parser.add_argument("--interval", type=float, metavar="MIN", help="minutes between syncs of --subscribe (default: settings)")
+    parser.add_argument("--no-backfill", action="store_true", help="with --subscribe: only download videos published after subscribing")
+    parser.add_argument("--unsubscribe", action="append", default=[], metavar="ID|URL", help="remove a subscription (its downloads stay)")
+    parser.add_argument("--subscriptions", action="store_true", help="list the subscriptions")
+    parser.add_argument("--sync", action="store_true", help="check every subscription now and download what is new")
+    parser.add_argument("--shared-queue", metavar="SPEC", help="queue shared by several hosts: a SQLite file on shared storage or tcp://HOST:PORT of a coordinator; URLs are queued there")
+    parser.add_argument("--worker", action="store_true", help="run downloads from --shared-queue until Ctrl+C")
+    parser.add_argument("--worker-name", help="name this worker reports to the shared queue (default: HOST-PID)")
+    parser.add_argument("--coordinator", metavar="[HOST:]PORT", help="serve the --shared-queue file to workers over TCP (HOST default 127.0.0.1; other hosts need shared_queue_token)")
+    parser.add_argument("--data-dir", metavar="DIR", help="databases, journal and logs of this session (default: Necessary); one per worker on a machine")
+    parser.add_argument("--queue-status", action="store_true", help="print the jobs and workers of --shared-queue")
+    parser.add_argument("--compare-policies", action="store_true", help="print mean / p95 time to completion per scheduling policy, measured and replayed from the history (exits if no URLs)")
+    parser.add_argument("--export-stats", metavar="FILE", help="write the history aggregates to FILE when done: JSON, or Prometheus text for *.prom / *.txt")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    urls = list(args.urls)
+    sources = []
+    try:
+        for path in args.batch_file:
+            urls.extend(read_url_file(path))
+        if args.import_files:
+            from yd_import import open_source
+            for path in args.import_files:
+                sources.append((path, *open_source(path)))
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    settings = load_settings()
+    if args.parallel:
+        settings["max_parallel"] = max(1, args.parallel)
+    if args.engine:
+        settings["engine"] = args.engine
+    if args.policy:
+        settings["scheduling_policy"] = args.policy
+    if args.limit_rate is not None:
+        settings["bandwidth_limit"] = args.limit_rate
+    if args.proxy:
+        from yd_proxy import parse_proxies
+        try:
+            parse_proxies(args.proxy)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        settings["use_proxy"] = True
+        settings["proxy"] = args.proxy
+    if args.no_skip:
+        settings["skip_downloaded"] = False
+
+    queue = None
+    if sources and args.shared_queue:
+        print("error: --import works on the local queue; use -a with --shared-queue", file=sys.stderr)
+        return 2
+    if (args.worker or args.coordinator is not None or args.queue_status) and not args.shared_queue:
+        print("error: --worker, --coordinator and --queue-status need --shared-queue", file=sys.stderr)
+        return 2
+    if args.shared_queue:
+        import sqlite3
+        from yd_distributed import open_queue
+        token = settings.get("shared_queue_token", "")
+        try:
+            queue = open_queue(args.shared_queue, token)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"error: shared queue: {e}", file=sys.stderr)
+            return 2
+        code = shared_queue_main(args, urls, queue, token)
+        if code or not args.worker:
+            return code
+        # queued in the shared queue, which this worker now works on
+        urls = []
+
+    t_imports = time.perf_counter()
+    from yd_core import DownloadCore
+    core = DownloadCore(settings, args.data_dir)
+    t_ready = time.perf_counter()
+    if args.startup_time:
+        print(f"startup: {(t_ready - T0) * 1000:.0f} ms to ready "
+              f"({(t_imports - T0) * 1000:.0f} ms entry imports, {(t_ready - t_imports) * 1000:.0f} ms core)", file=sys.stderr)
+        if not urls:
+            core.close()
+            return 0
+    serving = args.serve is not None or args.worker
+    if args.check_archive:
+        folders = core.download_archive.search_folders + ([os.path.abspath(args.output)] if args.output else [])
+        moved, removed = core.download_archive.check(folders)
+        print(f"archive: {moved} moved file(s) found, {removed} missing file(s) removed")
+        if not urls and not sources and not args.resume and not args.sync and not serving:
+            core.close()
+            return 0
+    if (args.stats or args.export_stats or args.compare_policies) and not urls and not args.resume and not serving:
+        if args.stats:
+            print_stats(core)
+        if args.compare_policies:
+            compare_policies(core)
+        code = export_stats(core, args.export_stats)
+        core.close()
+        return code
+    if args.subscribe or args.unsubscribe or args.subscriptions:
+        code = manage_subscriptions(core, args)
+        if code or not (urls or args.resume or args.sync or serving):
+            core.close()
+            return code
+    if not urls and not sources and not args.resume and not args.sync and not serving:
+        print("error: no URLs given (pass URLs, -a FILE, --import FILE, --resume, --sync or --serve)", file=sys.stderr)
+        core.close()
+        return 2
+    missing = core.missing_tools()
+    if missing:
+        print(f"error: not found: {', '.join(missing)} (put them in 'Necessary' or on the PATH)", file=sys.stderr)
+        core.close()
+        return 2
+
+    print_lock = threading.Lock()
+
+    def on_job_event(job, kind, data):
+        if kind == "state" and data in (RUNNING, POSTPROCESSING, FINISHED, FAILED, CANCELLED):
+            detail = f" ({job.error})" if data == FAILED and job.error else ""
+            with print_lock:
+                print(f"[#{job.id}] {data}: {job.label}{detail}", flush=True)
+        elif kind == "log" and args.verbose:
+            with print_lock:
+                print(f"[#{job.id}] {data}", flush=True)
+
+    core.add_listener(on_job_event)
+    api = None
+    if args.serve is not None:
+        from yd_api import ApiServer
+        try:
+            api = ApiServer(core, args.serve or settings["api_port"], settings.get("api_token", ""),
+                            backlog=int(settings.get("api_backlog", 1000))).start()
+        except (OSError, ValueError) as e:
+            print(f"error: local API: {e}", file=sys.stderr)
+            core.close()
+            return 2
+        print(f"local API on http://127.0.0.1:{api.port} (Ctrl+C stops)", flush=True)
+    worker = None
+    if args.worker:
+        from yd_distributed import QueueWorker
+
+        def on_worker_log(line):
+            with print_lock:
+                print(line, flush=True)
+
+        worker = QueueWorker(core, queue, args.worker_name, os.path.abspath(args.output) if args.output else None,
+                             on_log=on_worker_log).start()
+        signal.signal(signal.SIGTERM, _interrupt)
+        print(f"worker {worker.name} on {args.shared_queue} (Ctrl+C stops)", flush=True)
+    if args.resume:
+        print(f"resumed {core.restore()} unfinished download(s)", flush=True)
+    if args.serve is not None:
+        core.subscriptions.start()
+    if args.sync:
+        subs = core.subscriptions.subscriptions()
+        for sub in subs:
+            queued = core.subscriptions.sync(sub["id"])
+            result = f"{queued} new download(s)" if queued is not None else f"failed ({core.subscriptions.get(sub['id'])['error']})"
+            print(f"synced {sub['url']}: {result}", flush=True)
+        if not subs:
+            print("no subscriptions to sync (add one with --subscribe)", flush=True)
+    subtitles = subtitle_choice(args.subtitles)
+    outdir = os.path.abspath(args.output or settings["default_output"])
+    for url in urls:
+        opts = core.options(url, outdir, args.format, str(args.quality), subtitles)
+        if args.priority:
+            opts["priority"] = args.priority
+        if core.add(opts) is None:
+            print(f"skipped (already downloaded): {url}", flush=True)
+    imports = []
+    for path, lines, kind in sources:
+        opts = core.options("", outdir, args.format, str(args.quality), subtitles)
+        if args.priority:
+            opts["priority"] = args.priority
+        imports.append(core.start_import(lines, opts, kind, name=path))
+
+    interrupted = False
+    last_status = 0
+    try:
+        while core.busy() or serving:
+            time.sleep(0.25)
+            if time.monotonic() - last_status >= 10 and core.busy():
+                last_status = time.monotonic()
+                counts = core.job_queue.counts()
+                with print_lock:
+                    print(f"-- {counts.get(RUNNING, 0)} running, {counts.get(QUEUED, 0)} queued, "
+                          f"{counts.get(POSTPROCESSING, 0)} converting, {counts.get(FINISHED, 0)} finished, "
+                          f"{counts.get(FAILED, 0)} failed | {core.stage_meter.report()}", flush=True)
+                    status = core.playlist_status_text()
+                    if status:
+                        print(status, flush=True)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("interrupted, stopping downloads...", file=sys.stderr)
+    if api is not None:
+        api.close()
+    if worker is not None:
+        print(f"gave {worker.stop()} unfinished job(s) back to the shared queue", flush=True)
+
+    counts = core.job_queue.counts()
+    export_stats(core, args.export_stats)
+    if args.stats:
+        print_stats(core)
+    if args.compare_policies:
+        compare_policies(core)
+    for imp in imports:
+        print(imp.summary())
+    local = [j for j in core.job_queue.jobs.values() if j.state == FINISHED and j.options.get("source_stream")]
+    if local:
+        from yd_units import format_size
+        saved = sum(j.options["source_stream"].get("saves", 0) for j in local)
+        print(f"{len(local)} job(s) made from stored streams, {format_size(saved)} not downloaded")
+    if len(core.proxy_pool.proxies) > 1:
+        from yd_proxy import stats_text
+        print(stats_text(core.proxy_pool.stats()))
+    if not interrupted:
+        # the exit code reports failures; only interrupted work stays in the journal
+        core.remove_finished()
+    core.close()
+    print(f"done: {counts.get(FINISHED, 0)} finished, {counts.get(FAILED, 0)} failed, "
+          f"logs in {core.log_store.session_dir}")
+    if interrupted and not serving:
+        return 130
+    return 1 if counts.get(FAILED, 0) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
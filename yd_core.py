@@ -0,0 +1,546 @@
+"""
+Headless download core.
+Everything a download session needs without any UI: options snapshots,
+yt-dlp command building, the job queue with its metadata cache, download
+archive, spooled logs and bandwidth scheduler, and playlist expansion.
+The GUI (YD.py) and the command line (yd_cli.py) are thin front ends on top
+of DownloadCore; nothing here imports Tk.
+"""
+import os
+import time
+import uuid
+
+from yd_settings import DEFAULT_SETTINGS, resource_path, tool_path, load_settings
+from yd_jobs import Job, JobQueue, QUEUED, RUNNING, PAUSED, FAILED, POSTPROCESSING
+from yd_engine import MANIFEST_TEMPLATE, format_selector, subtitle_langs, resolve_engine
+from yd_log import LogStore
+from yd_cache import MetadataCache, estimate_size
+from yd_urls import is_playlist_url, video_key
+from yd_archive import DownloadArchive, variant_for
+from yd_playlist import PlaylistExpander
+from yd_bandwidth import BandwidthScheduler, parse_profiles
+from yd_journal import JobJournal, partial_bytes
+from yd_units import parse_rate, parse_size, format_size
+from yd_pipeline import PostProcessPool, StageMeter, post_step
+from yd_planner import FormatPlanner
+from yd_progress import template_args
+from yd_metrics import JobMetrics
+from yd_tuning import DownloadTuner, tuning_args
+from yd_proxy import ProxyPool, PROBE_URL, parse_proxies
+from yd_streamstore import StreamStore
+from yd_supervisor import StallWatchdog
+from yd_diskspace import DiskSpaceGuard
+from yd_subscriptions import SubscriptionManager
+from yd_import import BulkImport
+from yd_scheduling import WorkEstimator, RATE_HISTORY, make_policy, typical_rate
+
+
+# ---------------- Command builder ----------------
+def build_command(opts):
+    """
+    Build yt-dlp command from an options snapshot (see DownloadCore.options).
+    Includes ffmpeg location, output template, proxy and format choices.
+    The in-process engine maps the same snapshot in yd_engine.build_ydl_opts.
+    """
+    yt_dlp_path = tool_path("yt-dlp")
+    ffmpeg_path = tool_path("ffmpeg")
+    if opts.get("temp_dir"):
+        # partial files and merges on the scratch volume, moved to outdir when done
+        output = ["-P", f"home:{opts['outdir']}", "-P", f"temp:{opts['temp_dir']}", "-o", "%(title)s.%(ext)s"]
+    else:
+        output = ["-o", os.path.join(opts["outdir"], "%(title)s.%(ext)s")]
+    cmd = [yt_dlp_path, "--ffmpeg-location", ffmpeg_path, *output, "--progress"]
+    # one JSON progress line per update (yd_progress) instead of the progress bar text
+    cmd.extend(template_args())
+
+    if opts.get("proxy"):
+        cmd.extend(["--proxy", opts["proxy"]])
+
+    # record finished files for the download archive
+    if opts.get("manifest"):
+        cmd.extend(["--print-to-file", f"after_move:{MANIFEST_TEMPLATE}", opts["manifest"]])
+    # playlist entries we already have are skipped by yt-dlp before extraction
+    if opts.get("download_archive"):
+        cmd.extend(["--download-archive", opts["download_archive"]])
+    # share of the global bandwidth budget (set by the bandwidth scheduler)
+    if opts.get("rate_limit"):
+        cmd.extend(["--limit-rate", str(int(opts["rate_limit"]))])
+    # fragment concurrency, chunk size and downloader picked by the tuner
+    if opts.get("tuning"):
+        cmd.extend(tuning_args(opts["tuning"]))
+    # playlist entries are queued one by one (see DownloadCore.start_playlist)
+    if opts.get("no_playlist"):
+        cmd.append("--no-playlist")
+
+    fmt = opts["format"]
+    q = opts["quality"]
+    # a resumed job keeps the formats its partial files belong to
+    plan = opts.get("format_plan")
+    selector = opts.get("format_pin") or (plan and plan["selector"]) or format_selector(fmt, q)
+    action = plan["action"] if plan and fmt not in ("mp3", "wav") else None
+
+    # Build format selection and post-processing options
+    if opts.get("post_step"):
+        # only download (and merge); the conversion runs in the post-processing pool
+        cmd.extend(["-f", selector])
+    elif action in ("copy", "remux"):
+        # planned streams fit the container: merge / remux are stream copies
+        cmd.extend(["-f", selector, "--merge-output-format", fmt, "--remux-video", fmt])
+    elif action == "audio":
+        # planned video stream fits the container: copy it, re-encode the audio
+        cmd.extend(["-f", selector, "--recode-video", fmt, "--postprocessor-args", "VideoConvertor:-c:v copy -c:a aac"])
+    elif fmt == "mp4":
+        if opts.get("remux_mp4"):
+            # Fast: remux to mp4 without re-encoding when possible
+            cmd.extend(["-f", selector, "--remux-video", "mp4"])
+        elif opts.get("recode_mp4"):
+            # Slow: re-encode to mp4
+            cmd.extend(["-f", selector, "--recode-video", "mp4"])
+        else:
+            cmd.extend(["-f", selector])
+    elif fmt in ("mp3", "wav"):
+        cmd.extend(["-f", selector, "--extract-audio", "--audio-format", fmt])
+    elif fmt == "webm":
+        cmd.extend(["-f", selector])
+    elif fmt == "mov":
+        cmd.extend(["-f", selector, "--recode-video", "mov"])
+
+    # Add subtitle options if selected
+    langs = subtitle_langs(opts.get("subtitles"))
+    if langs:
+        if langs == ["all"]:
+            # Download all available subtitles, including auto-generated ones
+            cmd.extend(["--all-subs", "--write-auto-sub"])
+        else:
+            cmd.extend(["--write-sub", "--write-auto-sub", "--sub-lang", langs[0]])
+        cmd.extend(["--sub-format", "srt/best", "--convert-subs", "srt"])
+
+        # Embed subtitles into the resulting video container when supported
+        if fmt in ("mp4", "webm", "mov"):
+            cmd.append("--embed-subs")
+
+    cmd.append(opts["url"])
+    return cmd
+
+
+def subtitle_command(opts, langs, base):
+    """
+    yt-dlp command that fetches only the subtitles langs of opts["url"],
+    as <base>.<lang>.srt (a video made from a stored stream, see yd_streamstore).
+    """
+    cmd = [tool_path("yt-dlp"), "--ffmpeg-location", tool_path("ffmpeg"), "--skip-download", "--no-playlist",
+           "-o", base + ".%(ext)s"]
+    if opts.get("proxy"):
+        cmd.extend(["--proxy", opts["proxy"]])
+    if langs == ["all"]:
+        cmd.extend(["--all-subs", "--write-auto-sub"])
+    else:
+        cmd.extend(["--write-sub", "--write-auto-sub", "--sub-lang", ",".join(langs)])
+    cmd.extend(["--sub-format", "srt/best", "--convert-subs", "srt", opts["url"]])
+    return cmd
+
+
+# ---------------- Core ----------------
+class DownloadCore:
+    """
+    One download session. Front ends subscribe with add_listener(fn), where
+    fn(job, kind, data) is called from worker threads (see JobQueue), build
+    an options snapshot with options() and queue it with add().
+    data_dir holds the databases, journal and logs (default: Necessary);
+    several sessions on one machine (shared queue workers) need their own.
+    """
+
+    def __init__(self, settings=None, data_dir=None):
+        self.settings = settings if settings is not None else load_settings()
+        self.data_dir = os.path.abspath(data_dir) if data_dir else resource_path("")
+        os.makedirs(self.data_dir, exist_ok=True)
+        # metadata_cache: title/duration/format list per video for instant size estimates
+        # download_archive: finished downloads per video and variant, to skip known items
+        # log_store: combined and per-job logs of this session, spooled to disk
+        self.metadata_cache = MetadataCache(self.data_path("metadata.sqlite"))
+        self.download_archive = DownloadArchive(self.data_path("archive.sqlite"))
+        self.log_store = LogStore(self.data_path("logs"))
+        self.job_queue = JobQueue(
+            max_workers=self.settings.get("max_parallel", DEFAULT_SETTINGS["max_parallel"]),
+            ffmpeg_path=tool_path("ffmpeg"),
+            command_builder=build_command,
+        )
+        # bandwidth_scheduler: splits settings["bandwidth_limit"] between running jobs
+        self.bandwidth_scheduler = BandwidthScheduler(self.job_queue)
+        # post_pool: ffmpeg conversions, overlapping with the next downloads
+        # stage_meter: how busy the download and convert stages are
+        self.post_pool = PostProcessPool(self.job_queue, tool_path("ffmpeg"), self.settings.get("postprocess_workers", 0))
+        self.job_queue.post_processor = self.post_pool
+        self.stage_meter = StageMeter({
+            "download": lambda: (self.job_queue.running_count(), self.job_queue.max_workers, self.job_queue.pending_count()),
+            "convert": lambda: (self.post_pool.busy(), self.post_pool.workers, self.post_pool.waiting()),
+        })
+        # proxy_pool: assigns the proxies of settings["proxy"] by measured latency, throughput and load
+        self.proxy_pool = ProxyPool(self.job_queue)
+        # format_planner: picks streams that avoid re-encoding, right before a job starts
+        self.format_planner = FormatPlanner(self.job_queue, self.metadata_cache, tool_path("yt-dlp"), post_step)
+        # tuner: per-host fragment concurrency / chunk size, learned from measured throughput
+        self.tuner = DownloadTuner(self.job_queue, self.data_path("tuning.json"))
+        # playlist_expanders: playlists listed this session (entries become separate jobs)
+        # imports: URL lists imported this session (see start_import)
+        self.playlist_expanders = []
+        self.imports = []
+        # journal: open jobs on disk, so a crash or restart does not lose the queue
+        self.journal = JobJournal(self.data_path("journal.jsonl"))
+        # metrics: phase timings and throughput per job, kept as a history for stats
+        self.metrics = JobMetrics(self.data_path("metrics.sqlite"))
+        # disk_guard: holds queued jobs back until their estimated size fits on disk
+        self.disk_guard = DiskSpaceGuard(self.job_queue, self.metadata_cache)
+        self.job_queue.admission = self.disk_guard.admit
+        # watchdog: restarts downloads that stopped making progress, with backoff
+        self.watchdog = StallWatchdog(self.job_queue)
+        # stream_store: downloaded source streams, so other formats of a video are made locally
+        self.stream_store = StreamStore(self.data_path("streams"), self.data_path("streams.sqlite"),
+                                        formats_for=lambda url: (self.metadata_cache.get(url) or {}).get("formats"))
+        # subscriptions: channels / playlists synced on a schedule (front ends call subscriptions.start())
+        self.subscriptions = SubscriptionManager(self, self.data_path("subscriptions.sqlite"))
+        # work_estimator: seconds of download left per queued job, for the "sjf" scheduling policy
+        # scheduling_policy: order queued jobs start in (settings["scheduling_policy"])
+        self.work_estimator = WorkEstimator(self.metadata_cache, typical_rate(self.metrics.rows(since=time.time() - RATE_HISTORY)))
+        self.scheduling_policy = make_policy("fifo")
+        try:
+            self.apply_settings()
+        except ValueError as e:
+            print("Invalid settings:", e)
+        self.job_queue.add_start_hook(self.bandwidth_scheduler.before_start)
+        self.job_queue.add_start_hook(self.proxy_pool.before_start)
+        self.job_queue.add_start_hook(self.format_planner.before_start)
+        self.job_queue.add_start_hook(self.tuner.before_start)
+        self.job_queue.add_listener(self.bandwidth_scheduler.on_job_event)
+        self.job_queue.add_listener(self.log_store.on_job_event)
+        self.job_queue.add_listener(self.download_archive.on_job_event)
+        self.job_queue.add_listener(self.journal.on_job_event)
+        self.job_queue.add_listener(self.metrics.on_job_event)
+        self.job_queue.add_listener(self.tuner.on_job_event)
+        self.job_queue.add_listener(self.proxy_pool.on_job_event)
+        self.job_queue.add_listener(self.stream_store.on_job_event)
+        self.job_queue.add_listener(self.watchdog.on_job_event)
+        self.job_queue.add_listener(self.disk_guard.on_job_event)
+        self.job_queue.add_listener(self.work_estimator.on_job_event)
+        self.job_queue.add_listener(lambda job, kind, data: self.scheduling_policy.on_job_event(job, kind, data))
+
+    def data_path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def add_listener(self, fn):
+        self.job_queue.add_listener(fn)
+
+    def apply_settings(self):
+        """
+        Apply changed settings to the running session.
+        Raises ValueError for an invalid bandwidth limit, profile, proxy,
+        stream store size, disk reserve or scheduling policy.
+        """
+        budget = parse_rate(self.settings.get("bandwidth_limit", ""))
+        profiles = parse_profiles(self.settings.get("bandwidth_profiles", ""))
+        proxies = parse_proxies(self.settings.get("proxy", "")) if self.settings.get("use_proxy") else []
+        policy = make_policy(self.settings.get("scheduling_policy") or "fifo", self.work_estimator)
+        self.proxy_pool.configure(proxies, self.settings.get("proxy_probe_url") or PROBE_URL)
+        self.job_queue.set_max_workers(self.settings.get("max_parallel", DEFAULT_SETTINGS["max_parallel"]))
+        self.post_pool.set_workers(self.settings.get("postprocess_workers", 0))
+        self.format_planner.enabled = bool(self.settings.get("plan_formats", True))
+        self.stream_store.enabled = bool(self.settings.get("stream_store", True))
+        self.stream_store.limit = parse_size(self.settings.get("stream_store_limit", ""))
+        self.tuner.enabled = bool(self.settings.get("adaptive_tuning", True))
+        self.disk_guard.enabled = bool(self.settings.get("disk_check", True))
+        self.disk_guard.reserve = parse_size(self.settings.get("disk_reserve", ""))
+        self.disk_guard.overflow_dir = self.settings.get("overflow_output", "")
+        # a finished file the user moved within these is found again instead of downloaded
+        self.download_archive.search_folders = [f for f in (self.settings.get("default_output"),
+                                                            self.settings.get("overflow_output")) if f]
+        self.watchdog.configure(self.settings.get("stall_timeout", 0), self.settings.get("stall_retries"))
+        self.subscriptions.enabled = bool(self.settings.get("subscription_sync", True))
+        self.scheduling_policy = policy
+        self.job_queue.policy = None if policy.name == "fifo" else policy
+        self.metrics.policy = policy.name
+        downloader = self.settings.get("external_downloader", "")
+        self.tuner.external_downloader = downloader if downloader and os.path.isfile(tool_path(downloader)) else None
+        self.bandwidth_scheduler.configure(budget, profiles)
+
+    def missing_tools(self):
+        """Names of the external tools that could not be found."""
+        return [name for name in ("yt-dlp", "ffmpeg") if not os.path.isfile(tool_path(name))]
+
+    def close(self, wait=10.0):
+        """
+        Stop all running processes, then close the databases and log files.
+        The journal is closed first, so the stopped jobs stay open in it and
+        continue from their partial files on the next start. Processes are
+        stopped in the background; at the end close waits up to `wait`
+        seconds until they and their children are gone.
+        """
+        self.subscriptions.close()
+        self.journal.close()
+        self.job_queue.pause_all()
+        for exp in self.playlist_expanders:
+            exp.cancel()
+        for imp in self.imports:
+            imp.cancel()
+        self.log_store.close()
+        self.metadata_cache.close()
+        self.download_archive.close()
+        self.metrics.close()
+        self.stream_store.close()
+        self.tuner.save(force=True)
+        self.job_queue.reaper.wait(wait)
+
+    # ----- options -----
+    def options(self, url, outdir=None, fmt="mp4", quality="1080", subtitles="none"):
+        """
+        Snapshot the choices for one download as a plain dict.
+        Proxy and conversion choices come from the settings. Jobs keep this
+        snapshot, so worker threads never read UI state.
+        """
+        s = self.settings
+        return {
+            "url": url,
+            "outdir": outdir or s["default_output"],
+            "format": fmt,
+            "quality": quality,
+            "subtitles": subtitles,
+            # the first proxy of the list; the proxy pool picks one when the job starts
+            "proxy": (s.get("proxy", "").replace(",", " ").split() or [""])[0] if s.get("use_proxy") else "",
+            "remux_mp4": bool(s.get("remux_mp4")),
+            "recode_mp4": bool(s.get("recode_mp4")),
+            # scratch folder for partial downloads (kept with the job so a resume finds them)
+            "temp_dir": s.get("scratch_dir", ""),
+        }
+
+    def new_manifest_path(self):
+        # per-job file yt-dlp appends finished paths to (lives with the session logs)
+        return os.path.join(self.log_store.session_dir, f"manifest-{uuid.uuid4().hex}.tsv")
+
+    # ----- queueing -----
+    def add(self, opts, confirm=None, label=None):
+        """
+        Queue a download for an options snapshot.
+        A playlist is expanded into one job per entry when expand_playlists
+        is on; the PlaylistExpander is returned. With skip_downloaded, a single
+        video that is already in the archive is only queued again when
+        confirm(archive_row) returns True, else it is skipped and None is
+        returned. Otherwise returns the new Job.
+        """
+        url = opts["url"]
+        os.makedirs(opts["outdir"], exist_ok=True)
+        if is_playlist_url(url) and self.settings.get("expand_playlists", True):
+            return self.start_playlist(url, opts)
+
+        opts = dict(opts, manifest=self.new_manifest_path())
+        if self.settings.get("skip_downloaded", True):
+            variant = variant_for(opts)
+            if is_playlist_url(url):
+                # let yt-dlp skip known entries using an export of the archive
+                opts["download_archive"] = self.download_archive.write_ytdlp_archive(
+                    variant, os.path.join(self.log_store.session_dir, f"archive-{variant}.txt"))
+            else:
+                cached = self.metadata_cache.get(url)
+                key = video_key(url) or (cached and cached["key"])
+                have = self.download_archive.has(key, variant)
+                if have and not (confirm and confirm(have)):
+                    self.log_store.combined.append(f"Skipped {url}: already downloaded as {variant} ({have['path']})")
+                    return None
+        return self.queue_options(opts, label=label)
+
+    def queue_options(self, opts, label=None, group=None, retries=0):
+        """
+        Build the command for an options snapshot and submit it as a job.
+        A video whose stored source stream can be converted locally becomes
+        a local job (see yd_streamstore) instead of a download.
+        """
+        if not opts.get("source_stream"):
+            opts = self._derive(opts) or opts
+        return self.job_queue.add(self._new_job(opts, label, group, retries))
+
+    def queue_batch(self, opts_list):
+        """
+        Queue single videos (options snapshots) as one batch, without the
+        archive check of add (the caller did it). Returns the new Jobs.
+        """
+        for outdir in {opts["outdir"] for opts in opts_list}:
+            os.makedirs(outdir, exist_ok=True)
+        jobs = []
+        for opts in opts_list:
+            opts = dict(opts, manifest=self.new_manifest_path())
+            jobs.append(self._new_job(self._derive(opts) or opts))
+        return self.job_queue.add_many(jobs)
+
+    def start_import(self, lines, opts, kind="text", name="", on_done=None):
+        """
+        Import a URL list on a background thread: lines is an iterable of
+        text lines (a file object is closed at the end), kind "text", "csv"
+        or "tsv", opts the options snapshot for every URL. Duplicates of
+        queued or downloaded videos are skipped. Returns the BulkImport,
+        whose counters report the result.
+        """
+        imp = BulkImport(self, lines, opts, kind, name, on_done)
+        self.imports.append(imp)
+        imp.start()
+        return imp
+
+    def _derive(self, opts):
+        if not self.stream_store.enabled:
+            return None
+        if "post_step" not in opts and self.settings.get("overlap_postprocessing", True):
+            # kept for the download a local job falls back to
+            opts = dict(opts, post_step=post_step(opts))
+        cached = self.metadata_cache.get(opts["url"])
+        key = video_key(opts["url"]) or (cached and cached["key"])
+        size = estimate_size(cached, opts["format"], opts["quality"]) if cached else 0
+        derived = self.stream_store.derive(opts, key, size)
+        if derived:
+            source = derived["source_stream"]
+            subtitles = source.get("subtitles")
+            if subtitles:
+                subtitles["command"] = subtitle_command(opts, subtitles["langs"], subtitles["base"])
+            self.log_store.combined.append(f"{opts['url']}: made from the stored stream {source['format_id']} "
+                                           f"instead of downloading ({format_size(source['saves'])})")
+        return derived
+
+    def _new_job(self, opts, label=None, group=None, retries=0, uid=None):
+        if "post_step" not in opts and self.settings.get("overlap_postprocessing", True):
+            opts = dict(opts, post_step=post_step(opts))
+        fmt = opts["format"]
+        fmt_label = fmt if fmt in ("mp3", "wav") else f"{fmt} {opts['quality']}p"
+        return Job(
+            opts["url"], build_command(opts), opts["outdir"], label=label, fmt=fmt_label,
+            options=opts, engine=resolve_engine(self.settings.get("engine", "auto")),
+            group=group, retries=retries, uid=uid,
+        )
+
+    def start_playlist(self, url, opts, uid=None, skip_first=0):
+        """
+        List the playlist on a background thread and queue every entry as its own
+        job as soon as yt-dlp prints it. Entries already in the download archive
+        are skipped without any network request. skip_first passes over entries
+        an interrupted listing already handled (see restore).
+        """
+        variant = variant_for(opts)
+        skip_known = self.settings.get("skip_downloaded", True)
+        retries = int(self.settings.get("entry_retries", DEFAULT_SETTINGS["entry_retries"]))
+
+        def on_entry(entry):
+            if expander.listed > skip_first:
+                if skip_known and self.download_archive.has(entry["key"], variant):
+                    expander.skipped += 1
+                else:
+                    entry_opts = dict(opts, url=entry["url"], no_playlist=True, manifest=self.new_manifest_path(),
+                                      duration=entry["duration"])
+                    self.queue_options(entry_opts, label=f"{entry['index']}. {entry['title']}", group=expander.uid, retries=retries)
+                    expander.queued += 1
+            self.journal.record_playlist(expander.uid, url, opts, listed=expander.listed)
+
+        def on_done(exp):
+            self.journal.record_playlist(exp.uid, url, opts, listed=exp.listed, done=True)
+
+        def on_log(line):
+            self.log_store.combined.append(f"[playlist {expander.id}] {line}")
+
+        expander = PlaylistExpander(url, tool_path("yt-dlp"), on_entry, on_done=on_done, on_log=on_log, uid=uid)
+        self.playlist_expanders.append(expander)
+        self.journal.record_playlist(expander.uid, url, opts, listed=skip_first)
+        return expander.start()
+
+    def restore(self):
+        """
+        Re-create the open jobs of the journal, left over from a crash or from
+        closing the app. Jobs that were queued or running are queued again and
+        yt-dlp continues their .part files; the formats they picked are pinned
+        so a changed format list cannot orphan the partial data. Paused and
+        failed jobs come back paused / failed. Interrupted playlist listings
+        start over and skip the entries they had already handled.
+        Returns the number of restored jobs.
+        """
+        restored = 0
+        for rec in self.journal.pending():
+            if rec.get("type") == "playlist":
+                self.start_playlist(rec["url"], rec["options"], uid=rec["uid"], skip_first=rec.get("listed", 0))
+                continue
+            opts = dict(rec["options"])
+            # the old session folder may be gone; manifest and archive export go to this one
+            opts["manifest"] = self.new_manifest_path()
+            if opts.get("download_archive"):
+                variant = variant_for(opts)
+                opts["download_archive"] = self.download_archive.write_ytdlp_archive(
+                    variant, os.path.join(self.log_store.session_dir, f"archive-{variant}.txt"))
+            on_disk, nfiles = partial_bytes(rec)
+            if nfiles and rec.get("format_ids"):
+                opts["format_pin"] = rec["format_ids"]
+            state = rec["state"] if rec["state"] in (PAUSED, FAILED) else QUEUED
+            job = self._new_job(opts, label=rec.get("label"), group=rec.get("group"),
+                                retries=rec.get("retries_left", 0), uid=rec["uid"])
+            job.files = list(rec.get("files") or [])
+            job.format_ids = rec.get("format_ids") or ""
+            job.fragments = tuple(rec["fragments"]) if rec.get("fragments") else None
+            job.progress = rec.get("progress") or 0.0
+            job.elapsed_before = rec.get("elapsed") or 0.0
+            self.job_queue.add(job, state)
+            if nfiles:
+                frags = f", fragment {job.fragments[0]}/{job.fragments[1]}" if job.fragments else ""
+                self.job_queue.log(job, f"Restored from journal: {format_size(on_disk)} already on disk in {nfiles} file(s){frags}")
+            else:
+                self.job_queue.log(job, "Restored from journal")
+            restored += 1
+        return restored
+
+    def remove_finished(self):
+        """Drop finished / failed / cancelled jobs from the queue and the journal. Returns their ids."""
+        uids = {job.id: job.uid for job in list(self.job_queue.jobs.values())}
+        removed = self.job_queue.remove_finished()
+        for job_id in removed:
+            self.journal.remove(uids[job_id])
+            self.log_store.drop(job_id)
+        return removed
+
+    # ----- status -----
+    def busy(self):
+        """True while jobs are queued or running or a playlist is still being listed or a list imported."""
+        counts = self.job_queue.counts()
+        if counts.get(QUEUED, 0) or counts.get(RUNNING, 0) or counts.get(POSTPROCESSING, 0):
+            return True
+        return any(not exp.finished for exp in self.playlist_expanders) or any(not imp.finished for imp in self.imports)
+
+    def playlist_status_text(self, last=3):
+        # one line per playlist that is still listing or listed this session, then per running import
+        rows = []
+        for exp in self.playlist_expanders[-last:]:
+            state = "cancelled" if exp.cancelled else ("listed" if exp.finished else "listing...")
+            rows.append(f"Playlist {exp.id}: {exp.listed} entries {state}, {exp.queued} queued, {exp.skipped} already downloaded")
+        rows.extend(imp.summary() for imp in self.imports[-last:] if not imp.finished)
+        return "\n".join(rows)
+
+    def size_estimate(self, url, format_choice, quality_choice):
+        """
+        Return an estimated filesize for url as display text.
+        Answers from metadata_cache when possible (milliseconds, no yt-dlp start);
+        otherwise one `yt-dlp --dump-json` pass fills the cache first. For a
+        playlist that single pass caches every entry and the sizes are summed.
+        """
+        entries = []
+        if not is_playlist_url(url):
+            info = self.metadata_cache.get(url)
+            if info:
+                entries = [info]
+
+        if not entries:
+            yt_dlp_path = tool_path("yt-dlp")
+            if not os.path.exists(yt_dlp_path):
+                return "yt-dlp not found"
+            try:
+                entries = self.metadata_cache.fetch(url, yt_dlp_path, timeout=None if is_playlist_url(url) else 15)
+            except Exception as e:
+                return f"Error getting info: {e}"
+            if not entries:
+                return "Size not available"
+
+        size_bytes = sum(estimate_size(e, format_choice, quality_choice) for e in entries)
+        if not size_bytes:
+            return "Size not available"
+        size_mb = size_bytes / (1024 * 1024)
+        if len(entries) > 1:
+            return f"Estimated size: {size_mb:.2f} MB for {len(entries)} videos"
+        return f"Estimated size: {size_mb:.2f} MB"
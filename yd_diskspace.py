@@ -0,0 +1,274 @@
+"""
+Disk space admission.
+Before a queued job starts, DiskSpaceGuard works out the space it needs
+from the cached format list (the same filesize / filesize_approx data the
+size estimate uses) and checks it against the free space of the volumes
+involved, minus what the jobs already running still need:
+
+    download volume     the downloaded streams, plus a second copy while
+                        yt-dlp merges video and audio or extracts audio
+                        (the scratch folder when one is set, else outdir)
+    output volume       the finished file, plus the source while the
+                        post-processing pool converts it
+
+A job that does not fit stays queued (later, smaller jobs may start) and
+is started once enough space is free; with an overflow folder set it is
+sent there instead. Jobs with an unknown size only need the reserve. A
+running job whose current file turns out not to fit is put back into the
+queue before the disk fills up; its partial file is kept.
+"""
+import os
+import time
+import shutil
+import threading
+
+from yd_jobs import QUEUED, RUNNING, POSTPROCESSING
+from yd_cache import estimate_size
+from yd_units import format_size
+
+
+CHECK_INTERVAL = 10.0
+# seconds before a job with an unknown size is looked up again
+RECHECK = 30.0
+# estimates are rough: ask for a bit more
+SAFETY = 1.1
+# bytes per second of the converted audio (320 kbit/s MP3, 16 bit / 44.1 kHz stereo WAV)
+AUDIO_RATE = {"mp3": 40000, "wav": 176400}
+
+
+def existing_dir(path):
+    """path or its nearest existing parent (outdir may not exist yet)."""
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def space_needed(size, duration, opts):
+    """
+    {folder: bytes} a download of size estimated bytes (and duration seconds,
+    if known) needs at its peak, by the folder the bytes land in; {} when
+    the size is unknown.
+    """
+    if not size:
+        return {}
+    fmt = opts["format"]
+    if fmt in AUDIO_RATE:
+        final = duration * AUDIO_RATE[fmt] if duration else size
+    else:
+        final = size
+    download_dir = opts.get("temp_dir") or opts["outdir"]
+    if opts.get("post_step"):
+        # yt-dlp only downloads (and merges); the pool converts next to the source
+        needs = {download_dir: 2 * size if fmt not in AUDIO_RATE else size}
+        out = final + size
+    else:
+        needs = {download_dir: size + final}
+        out = final
+    if download_dir == opts["outdir"]:
+        # the download copies are gone by the time the output is complete
+        needs[download_dir] = max(needs[download_dir], out)
+    else:
+        needs[opts["outdir"]] = out
+    return {path: int(n * SAFETY) for path, n in needs.items()}
+
+
+class DiskSpaceGuard:
+    """
+    JobQueue admission check (job_queue.admission = guard.admit) and
+    listener (on_job_event). A background thread retries held-back jobs
+    and watches the space of running ones.
+    """
+
+    def __init__(self, job_queue, metadata_cache):
+        self.job_queue = job_queue
+        self.metadata_cache = metadata_cache
+        self.enabled = True
+        # reserve: bytes always left free; overflow_dir: where jobs go when outdir is full
+        self.reserve = 0
+        self.overflow_dir = ""
+        self._lock = threading.Lock()
+        # job id -> {folder: bytes} of admitted jobs (running or converting)
+        self._admitted = {}
+        # job id -> {folder: bytes} learned from a run that ran out of space
+        self._learned = {}
+        # job id -> folder a held-back job is waiting for space on
+        self._waiting = {}
+        # job id -> (estimated bytes, duration, looked up at); admit() runs for
+        # every queued job on each scheduling pass, the cache lookup once per job
+        self._sizes = {}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _size(self, job, opts):
+        now = time.monotonic()
+        entry = self._sizes.get(job.id)
+        if entry is None or (not entry[0] and now - entry[2] >= RECHECK):
+            info = self.metadata_cache.get(opts["url"], touch=False)
+            size = estimate_size(info, opts["format"], opts["quality"]) if info else 0
+            entry = self._sizes[job.id] = (size, (info or {}).get("duration"), now)
+        return entry[0], entry[1]
+
+    def _needs(self, job, opts):
+        learned = self._learned.get(job.id)
+        if learned:
+            return learned
+        return space_needed(*self._size(job, opts), opts)
+
+    def _volume(self, path, scan):
+        # (existing folder, device) of path, looked up once per scheduling pass
+        volumes = scan.setdefault("volumes", {})
+        if path not in volumes:
+            folder = existing_dir(path)
+            volumes[path] = (folder, os.stat(folder).st_dev)
+        return volumes[path]
+
+    def _free(self, folder, dev, scan):
+        # free bytes of a device, measured once per scheduling pass
+        free = scan.setdefault("free", {})
+        if dev not in free:
+            free[dev] = shutil.disk_usage(folder).free
+        return free[dev]
+
+    def _outstanding(self, scan):
+        """
+        {device: {job id: bytes}} admitted jobs still need (what they received
+        is on disk), built once per pass and extended by the jobs it admits.
+        """
+        table = scan.get("outstanding")
+        if table is None:
+            table = scan["outstanding"] = {}
+            with self._lock:
+                admitted = list(self._admitted.items())
+            for job_id, needs in admitted:
+                job = self.job_queue.jobs.get(job_id)
+                if job is not None:
+                    self._claim(table, job, needs, scan)
+        return table
+
+    def _claim(self, table, job, needs, scan):
+        by_dev = {}
+        for path, n in needs.items():
+            dev = self._volume(path, scan)[1]
+            by_dev[dev] = by_dev.get(dev, 0) + n
+        for dev, n in by_dev.items():
+            table.setdefault(dev, {})[job.id] = max(0, n - job.transferred)
+
+    def _shortfall(self, job, needs, scan):
+        """(folder, needed, free) of the first volume needs do not fit on, else None."""
+        by_volume = {}
+        # an unknown size still has to leave the reserve free
+        for path, n in (needs or {job.options["outdir"]: 0}).items():
+            folder, dev = self._volume(path, scan)
+            by_volume.setdefault(dev, [folder, 0])[1] += n
+        outstanding = self._outstanding(scan)
+        full = scan.setdefault("full", {})
+        for dev, (folder, n) in by_volume.items():
+            others = sum(b for job_id, b in outstanding.get(dev, {}).items() if job_id != job.id)
+            # what is on disk already (a resumed .part file) needs no new space
+            needed = max(0, n - job.transferred) + others + self.reserve
+            if dev in full:
+                # nothing fits on this volume any more in this pass
+                return folder, needed, full[dev]
+            free = self._free(folder, dev, scan)
+            if free < needed:
+                if free <= others + self.reserve:
+                    full[dev] = free
+                return folder, needed, free
+        return None
+
+    def _log(self, job, line, scan):
+        if scan is None:
+            self.job_queue.log(job, line)
+        else:
+            scan.setdefault("log", []).append((job, line))
+
+    def admit(self, job, scan=None):
+        """
+        JobQueue admission check. scan caches the volume lookups, free space
+        and outstanding claims of one scheduling pass; log lines are left in
+        scan["log"] for the queue to emit outside its lock.
+        """
+        opts = job.options
+        if not self.enabled or not opts or opts.get("source_stream"):
+            return True
+        if scan is None:
+            scan = {}
+        needs = self._needs(job, opts)
+        short = self._shortfall(job, needs, scan)
+        overflow = self.overflow_dir and os.path.abspath(self.overflow_dir)
+        # partial files stay where they are
+        if short and overflow and overflow != os.path.abspath(opts["outdir"]) and not job.files:
+            alt = dict(opts, outdir=overflow)
+            alt_needs = self._needs(job, alt) if job.id not in self._learned else needs
+            if not self._shortfall(job, alt_needs, scan):
+                opts["outdir"] = job.outdir = overflow
+                self._log(job, f"[disk] {short[0]}: {format_size(short[2])} free, "
+                               f"{format_size(short[1])} needed; saving to {overflow} instead", scan)
+                needs, short = alt_needs, None
+        if short:
+            with self._lock:
+                first = job.id not in self._waiting
+                self._waiting[job.id] = short[0]
+            if first:
+                self._log(job, f"[disk] waiting for space on {short[0]}: {format_size(short[2])} free, "
+                               f"{format_size(short[1])} needed (including running downloads)", scan)
+            return False
+        with self._lock:
+            waited = self._waiting.pop(job.id, None)
+            self._admitted[job.id] = needs
+        self._claim(self._outstanding(scan), job, needs, scan)
+        if waited:
+            self._log(job, "[disk] enough space now, starting", scan)
+        return True
+
+    def waiting(self):
+        """Number of queued jobs held back for lack of space."""
+        with self._lock:
+            return len(self._waiting)
+
+    def on_job_event(self, job, kind, data):
+        if kind != "state":
+            return
+        with self._lock:
+            # the QUEUED event of a job can arrive after admit() let it start;
+            # a restarted job keeps its claim until it is admitted again
+            if data not in (QUEUED, RUNNING, POSTPROCESSING):
+                self._admitted.pop(job.id, None)
+            if data != QUEUED:
+                self._waiting.pop(job.id, None)
+            if data not in (QUEUED, RUNNING):
+                self._learned.pop(job.id, None)
+                self._sizes.pop(job.id, None)
+
+    # ----- background -----
+    def _check_running(self):
+        for job in list(self.job_queue.jobs.values()):
+            if job.state != RUNNING or job.restart_pending or not job.total_bytes or not job.options:
+                continue
+            remaining = job.total_bytes - (job.downloaded_bytes or 0)
+            if remaining <= 0:
+                continue
+            folder = existing_dir(job.options.get("temp_dir") or job.options["outdir"])
+            free = shutil.disk_usage(folder).free
+            if free >= remaining:
+                continue
+            with self._lock:
+                self._learned[job.id] = {folder: job.transferred + remaining}
+            self.job_queue.restart(job.id, f"[disk] {format_size(free)} free on {folder} but {format_size(remaining)} "
+                                           f"still to download; waiting for space")
+
+    def _loop(self):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            if not self.enabled:
+                continue
+            try:
+                self._check_running()
+                if self.waiting():
+                    self.job_queue.reschedule()
+            except Exception as e:
+                print("Disk space check error:", e)
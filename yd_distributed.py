@@ -0,0 +1,584 @@
+"""
+Work distribution over a shared job queue.
+Several machines (or several processes on one machine) work through one
+queue of downloads. A worker (python yd_cli.py --worker --shared-queue
+SPEC) is a headless DownloadCore that claims downloads from the shared
+queue whenever it has a free slot, so commands are built, tuned, checked
+against the archive and converted exactly like local downloads.
+
+A claim is a lease. The worker renews it with every progress report
+(every HEARTBEAT seconds); when a worker crashes, is killed or loses the
+network, its lease runs out after LEASE seconds and the next worker that
+asks for work takes the job over (continuing the .part file when outdir
+is on shared storage). A job whose lease ran out MAX_ATTEMPTS times is
+failed. Playlists are listed by the worker that claims them; every entry
+goes back into the shared queue as its own job, at most once per video,
+format and quality, so a listing that is taken over and run again does
+not queue its entries twice.
+
+Backends have put / claim / heartbeat / finish / release / cancel /
+counts / workers / jobs (see SQLiteQueue); open_queue picks one:
+
+    path/to/queue.sqlite    a SQLite file, on shared storage (NFS, SMB)
+                            for several hosts; a claim is one
+                            BEGIN IMMEDIATE transaction
+    tcp://host:port         a coordinator (yd_cli.py --coordinator) that
+                            serves such a file to hosts without shared storage
+
+Leases use each host's clock; keep the clocks in sync (NTP).
+"""
+import os
+import json
+import hmac
+import ipaddress
+import time
+import socket
+import sqlite3
+import threading
+import socketserver
+
+from yd_settings import tool_path
+from yd_jobs import QUEUED, RUNNING, PAUSED, FINISHED, FAILED, CANCELLED, DONE_STATES
+from yd_urls import is_playlist_url, canonical_url
+from yd_playlist import PlaylistExpander
+from yd_pipeline import manifest_files
+
+
+# seconds a claim lasts without a heartbeat / between heartbeats
+LEASE = 60.0
+HEARTBEAT = 10.0
+# seconds between looking for work while the worker is idle
+POLL = 2.0
+MAX_ATTEMPTS = 3
+# playlist entries per put; a listing also puts what it has every PUT_EVERY seconds
+PUT_BATCH = 200
+PUT_EVERY = 2.0
+# shared state of a job the archive already had
+SKIPPED = "skipped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    request TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    transferred INTEGER NOT NULL DEFAULT 0,
+    detail TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    dedup TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id);
+"""
+
+# backend methods a coordinator serves
+OPS = ("put", "claim", "heartbeat", "finish", "release", "cancel", "counts", "workers", "jobs")
+
+
+def request_for(url, outdir="", fmt="mp4", quality="1080", subtitles="none"):
+    """
+    What the shared queue stores for a download: only the user's choices.
+    Proxy, archive, tuning and scratch folder are the worker's own settings.
+    """
+    return {"url": url, "outdir": outdir, "format": fmt, "quality": str(quality), "subtitles": subtitles}
+
+
+def dedup_key(req):
+    """Video, format and quality of a request ("" for a URL that is not one)."""
+    canon = canonical_url(req["url"])
+    if canon is None:
+        return ""
+    return f"{canon[0]} {req.get('format', '')} {req.get('quality', '')}"
+
+
+def open_queue(spec, token=""):
+    """Backend for a --shared-queue spec: tcp://host:port or a SQLite file path."""
+    if spec.startswith("tcp://"):
+        return RemoteQueue(spec[len("tcp://"):], token)
+    return SQLiteQueue(spec)
+
+
+# ---------------- SQLite backend ----------------
+class SQLiteQueue:
+    """
+    Shared queue in a SQLite file. Every call is one short transaction, so
+    any number of processes on any host that sees the file can use it.
+    Jobs are returned as plain dicts.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE takes the write lock first)
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        # no WAL: it needs shared memory, which network file systems do not have
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.executescript(SCHEMA)
+        # queue files made before playlist entries were de-duplicated
+        if "dedup" not in {r[1] for r in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN dedup TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup ON jobs(dedup)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _write(self, fn):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def put(self, requests, unique=False):
+        """
+        Queue requests (see request_for) in one transaction. Returns their ids.
+        unique: skip requests whose dedup_key was queued before (their id is
+        None), for playlist entries that may be listed more than once.
+        """
+        def put(db):
+            now = time.time()
+            ids = []
+            for r in requests:
+                cur = db.execute("INSERT OR IGNORE INTO jobs (request, state, created, updated, dedup) VALUES (?, ?, ?, ?, ?)",
+                                 (json.dumps(r), QUEUED, now, now, (dedup_key(r) or None) if unique else None))
+                ids.append(cur.lastrowid if cur.rowcount == 1 else None)
+            return ids
+        return self._write(put)
+
+    def claim(self, worker, lease=LEASE):
+        """
+        Lease the oldest queued job (or one whose lease ran out) to worker.
+        Returns {"id", "request", "attempt", "previous"} or None.
+        """
+        def claim(db):
+            now = time.time()
+            db.execute("UPDATE jobs SET state=?, worker=NULL, lease_until=NULL, error=?, updated=? "
+                       "WHERE state=? AND lease_until<? AND attempts>=?",
+                       (FAILED, f"worker lost {MAX_ATTEMPTS} times", now, RUNNING, now, MAX_ATTEMPTS))
+            row = db.execute("SELECT id, request, attempts, worker FROM jobs "
+                             "WHERE state=? OR (state=? AND lease_until<?) ORDER BY id LIMIT 1",
+                             (QUEUED, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET state=?, worker=?, lease_until=?, attempts=attempts+1, updated=? WHERE id=?",
+                       (RUNNING, worker, now + lease, now, row[0]))
+            return {"id": row[0], "request": json.loads(row[1]), "attempt": row[2] + 1, "previous": row[3]}
+        return self._write(claim)
+
+    def heartbeat(self, job_id, worker, lease=LEASE, progress=0.0, transferred=0, detail=""):
+        """
+        Renew worker's lease and store its progress. False when the job is
+        not worker's any more (cancelled, or taken over after the lease ran out).
+        """
+        def beat(db):
+            now = time.time()
+            return db.execute("UPDATE jobs SET lease_until=?, progress=?, transferred=?, detail=?, updated=? "
+                              "WHERE id=? AND worker=? AND state=?",
+                              (now + lease, progress, transferred, detail, now, job_id, worker, RUNNING)).rowcount == 1
+        return self._write(beat)
+
+    def finish(self, job_id, worker, state, error="", result=None):
+        """Record the outcome of worker's job. False when it was not worker's any more."""
+        def finish(db):
+            return db.execute("UPDATE jobs SET state=?, lease_until=NULL, error=?, result=?, updated=? "
+                              "WHERE id=? AND worker=? AND state=?",
+                              (state, error or "", json.dumps(result) if result is not None else None,
+                               time.time(), job_id, worker, RUNNING)).rowcount == 1
+        return self._write(finish)
+
+    def release(self, job_id, worker):
+        """Give worker's job back to the queue (the worker is shutting down)."""
+        def release(db):
+            # handed back, not lost: the attempt does not count
+            return db.execute("UPDATE jobs SET state=?, worker=NULL, lease_until=NULL, attempts=MAX(attempts-1, 0), "
+                              "updated=? WHERE id=? AND worker=? AND state=?",
+                              (QUEUED, time.time(), job_id, worker, RUNNING)).rowcount == 1
+        return self._write(release)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; its worker stops it at the next heartbeat."""
+        def cancel(db):
+            return db.execute("UPDATE jobs SET state=?, lease_until=NULL, updated=? WHERE id=? AND state IN (?, ?)",
+                              (CANCELLED, time.time(), job_id, QUEUED, RUNNING)).rowcount == 1
+        return self._write(cancel)
+
+    def counts(self):
+        """{state: number of jobs}"""
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def workers(self):
+        """[{"worker", "jobs", "transferred", "seen"}] of the workers holding leases."""
+        with self._lock:
+            rows = self._db.execute("SELECT worker, COUNT(*), SUM(transferred), MAX(updated) FROM jobs "
+                                    "WHERE state=? GROUP BY worker ORDER BY worker", (RUNNING,)).fetchall()
+        return [{"worker": w, "jobs": n, "transferred": b or 0, "seen": seen} for w, n, b, seen in rows]
+
+    def jobs(self, states=None, limit=100):
+        """Most recent jobs (optionally only those in states) as dicts."""
+        sql = "SELECT id, request, state, worker, attempts, progress, transferred, detail, error, result, updated FROM jobs"
+        args = []
+        if states:
+            sql += f" WHERE state IN ({', '.join('?' * len(states))})"
+            args.extend(states)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        keys = ("id", "request", "state", "worker", "attempts", "progress", "transferred", "detail", "error", "result", "updated")
+        out = []
+        for row in rows:
+            job = dict(zip(keys, row))
+            job["request"] = json.loads(job["request"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            out.append(job)
+        return out
+
+
+# ---------------- TCP coordinator ----------------
+# longest request line the coordinator reads (RemoteQueue.put sends big lists in parts)
+MAX_REQUEST = 4 * 1024 * 1024
+# requests per put call of RemoteQueue
+PUT_CHUNK = 2000
+
+
+def is_loopback(host):
+    """True if host only reaches this machine (127.x, ::1, localhost)."""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class _QueueHandler(socketserver.StreamRequestHandler):
+    # one JSON request per line: {"op", "args", "token"} -> {"ok": result} or {"error": message}
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST:
+                # the rest of the line cannot be skipped safely: drop the connection
+                self.wfile.write((json.dumps({"error": f"request longer than {MAX_REQUEST} bytes"}) + "\n").encode("utf-8"))
+                return
+            try:
+                req = json.loads(line)
+                if self.server.token and not hmac.compare_digest(str(req.get("token", "")), self.server.token):
+                    raise PermissionError("wrong token")
+                if req.get("op") not in OPS:
+                    raise ValueError(f"unknown operation {req.get('op')!r}")
+                reply = {"ok": getattr(self.server.backend, req["op"])(*req.get("args", []))}
+            except Exception as e:
+                reply = {"error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    """
+    Coordinator: serves a backend (normally a SQLiteQueue on local disk)
+    to RemoteQueue clients. serve_forever() runs it. Clients can queue any
+    URL and output folder, so listening beyond this machine needs a token
+    (ValueError otherwise).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, backend, host="127.0.0.1", port=8766, token=""):
+        if not token and not is_loopback(host):
+            raise ValueError(f"listening on {host or 'all interfaces'} needs a shared_queue_token")
+        self.backend = backend
+        self.token = token
+        super().__init__((host, port), _QueueHandler)
+
+
+class RemoteQueue:
+    """Backend that forwards every call to a QueueServer at "host:port"."""
+
+    def __init__(self, address, token="", timeout=30):
+        host, _, port = address.rpartition(":")
+        self.address = (host or "127.0.0.1", int(port))
+        self.token = token
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def _call(self, op, *args):
+        msg = (json.dumps({"op": op, "args": args, "token": self.token}) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection(self.address, timeout=self.timeout)
+                    self._file = self._sock.makefile("rb")
+                self._sock.sendall(msg)
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError("coordinator closed the connection")
+            except OSError:
+                # reconnect on the next call; a claim whose reply was lost comes back when its lease ends
+                self._disconnect()
+                raise
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"coordinator: {reply['error']}")
+        return reply["ok"]
+
+    def put(self, requests, unique=False):
+        requests = list(requests)
+        ids = []
+        for i in range(0, len(requests), PUT_CHUNK):
+            ids.extend(self._call("put", requests[i:i + PUT_CHUNK], unique))
+        return ids
+
+    def claim(self, worker, lease=LEASE):
+        return self._call("claim", worker, lease)
+
+    def heartbeat(self, job_id, worker, lease=LEASE, progress=0.0, transferred=0, detail=""):
+        return self._call("heartbeat", job_id, worker, lease, progress, transferred, detail)
+
+    def finish(self, job_id, worker, state, error="", result=None):
+        return self._call("finish", job_id, worker, state, error, result)
+
+    def release(self, job_id, worker):
+        return self._call("release", job_id, worker)
+
+    def cancel(self, job_id):
+        return self._call("cancel", job_id)
+
+    def counts(self):
+        return self._call("counts")
+
+    def workers(self):
+        return self._call("workers")
+
+    def jobs(self, states=None, limit=100):
+        return self._call("jobs", states, limit)
+
+
+# ---------------- Worker ----------------
+class QueueWorker:
+    """
+    Runs downloads claimed from a shared queue on a local DownloadCore.
+    Claims while the core has a free download slot, renews the leases with
+    the progress of its jobs and reports every result. stop() hands the
+    unfinished jobs back to the queue.
+    """
+
+    def __init__(self, core, queue, name=None, outdir=None, lease=LEASE, on_log=None):
+        self.core = core
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        # outdir: used instead of the request's folder (e.g. this host's mount of the shared storage)
+        self.outdir = outdir
+        self.lease = lease
+        self.on_log = on_log or (lambda line: None)
+        self._lock = threading.Lock()
+        # local job id -> shared job id
+        self._claims = {}
+        # shared job id -> PlaylistExpander listing it
+        self._listings = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.claimed = 0
+
+    def start(self):
+        self.core.add_listener(self.on_job_event)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop claiming and give every unfinished job back to the shared queue."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.core.job_queue.remove_listener(self.on_job_event)
+        with self._lock:
+            claims, self._claims = self._claims, {}
+            listings, self._listings = self._listings, {}
+        for exp in listings.values():
+            exp.cancel()
+        for job_id, shared in list(claims.items()) + [(None, s) for s in listings]:
+            if job_id is not None:
+                # cancelled, not paused: the local journal must not resume it on the next start
+                self.core.job_queue.cancel(job_id)
+            try:
+                self.queue.release(shared, self.name)
+            except Exception as e:
+                print("Shared queue release error:", e)
+        return len(claims) + len(listings)
+
+    def active(self):
+        with self._lock:
+            return len(self._claims) + len(self._listings)
+
+    # ----- claiming -----
+    def _loop(self):
+        last_beat = time.monotonic()
+        while not self._stop.is_set():
+            idle = True
+            try:
+                idle = not self._claim()
+                if time.monotonic() - last_beat >= HEARTBEAT:
+                    last_beat = time.monotonic()
+                    self._heartbeat()
+            except Exception as e:
+                print("Shared queue error:", e)
+            self._stop.wait(POLL if idle else 0.2)
+
+    def _claim(self):
+        # one claim per pass, so several workers started together share the queue
+        q = self.core.job_queue
+        if q.running_count() + q.pending_count() >= q.max_workers:
+            return False
+        claim = self.queue.claim(self.name, self.lease)
+        if claim is None:
+            return False
+        self.claimed += 1
+        req = claim["request"]
+        if claim["previous"]:
+            self.on_log(f"[shared #{claim['id']}] taking over from {claim['previous']} (attempt {claim['attempt']})")
+        try:
+            self._start(claim["id"], req)
+        except Exception as e:
+            self.queue.finish(claim["id"], self.name, FAILED, f"could not start: {e}")
+        return True
+
+    def _start(self, shared, req):
+        outdir = self.outdir or req.get("outdir") or self.core.settings["default_output"]
+        if is_playlist_url(req["url"]) and self.core.settings.get("expand_playlists", True):
+            self._list(shared, req)
+            return
+        opts = self.core.options(req["url"], outdir, req.get("format", "mp4"), str(req.get("quality", "1080")),
+                                 req.get("subtitles", "none"))
+        job = self.core.add(opts)
+        if job is None:
+            self.queue.finish(shared, self.name, SKIPPED, result={"reason": "already downloaded"})
+            return
+        with self._lock:
+            self._claims[job.id] = shared
+        self.on_log(f"[shared #{shared}] local job #{job.id}: {req['url']}")
+
+    def _list(self, shared, req):
+        # entries go back into the shared queue, so every worker gets some of them
+        batch = []
+        # queued: entries that were new to the shared queue
+        state = {"last": time.monotonic(), "queued": 0}
+
+        def put():
+            if batch:
+                ids = self.queue.put(batch, unique=True)
+                state["queued"] += sum(1 for i in ids if i is not None)
+                batch.clear()
+            state["last"] = time.monotonic()
+
+        def on_entry(entry):
+            batch.append(dict(req, url=entry["url"]))
+            if len(batch) >= PUT_BATCH or time.monotonic() - state["last"] >= PUT_EVERY:
+                put()
+
+        def on_done(exp):
+            with self._lock:
+                if self._listings.pop(shared, None) is None:
+                    return
+            try:
+                put()
+            except Exception as e:
+                # not finished: the lease runs out and the next claimer lists it again
+                print("Shared queue put error:", e)
+                return
+            if exp.error and not exp.listed:
+                self.queue.finish(shared, self.name, FAILED, exp.error)
+            else:
+                self.queue.finish(shared, self.name, FINISHED, result={"entries": exp.listed})
+            self.on_log(f"[shared #{shared}] playlist listed: {exp.listed} entries, {state['queued']} queued")
+
+        exp = PlaylistExpander(req["url"], tool_path("yt-dlp"), on_entry, on_done=on_done,
+                               on_log=lambda line: self.on_log(f"[shared #{shared}] {line}"))
+        with self._lock:
+            self._listings[shared] = exp
+        exp.start()
+
+    def _heartbeat(self):
+        with self._lock:
+            claims = list(self._claims.items())
+            listings = list(self._listings.items())
+        for job_id, shared in claims:
+            job = self.core.job_queue.jobs.get(job_id)
+            if job is None:
+                continue
+            detail = f"{job.state}, ETA {job.eta}" if job.eta else job.state
+            if not self.queue.heartbeat(shared, self.name, self.lease, job.progress, job.transferred, detail):
+                # cancelled in the shared queue, or another worker took it over
+                with self._lock:
+                    self._claims.pop(job_id, None)
+                self.core.job_queue.cancel(job_id)
+                self.on_log(f"[shared #{shared}] no longer ours, stopped local job #{job_id}")
+        for shared, exp in listings:
+            if not self.queue.heartbeat(shared, self.name, self.lease, detail=f"listing, {exp.listed} entries"):
+                with self._lock:
+                    self._listings.pop(shared, None)
+                exp.cancel()
+
+    # ----- results -----
+    def on_job_event(self, job, kind, data):
+        if kind != "state" or data not in DONE_STATES + (PAUSED,):
+            return
+        with self._lock:
+            shared = self._claims.pop(job.id, None)
+        if shared is None:
+            return
+        try:
+            if data == FINISHED:
+                files = manifest_files(job.options.get("manifest", "")) or job.files
+                result = {"files": files, "bytes": job.transferred, "seconds": round(job.elapsed(), 1)}
+                self.queue.finish(shared, self.name, FINISHED, result=result)
+            elif data == PAUSED:
+                # nothing pauses a worker's job but a give-up (e.g. the stall watchdog)
+                self.queue.finish(shared, self.name, FAILED, job.error or "paused")
+                self.core.job_queue.cancel(job.id)
+            else:
+                self.queue.finish(shared, self.name, data, job.error)
+            self.on_log(f"[shared #{shared}] {data}")
+        except Exception as e:
+            print("Shared queue report error:", e)
+
+
+def status_text(queue):
+    """Job counts and the workers holding leases, for --queue-status."""
+    from yd_units import format_size
+    counts = queue.counts()
+    order = [QUEUED, RUNNING, FINISHED, SKIPPED, FAILED, CANCELLED]
+    lines = ["shared queue: " + (", ".join(f"{counts[s]} {s}" for s in order if counts.get(s)) or "empty")]
+    now = time.time()
+    for w in queue.workers():
+        lines.append(f"  {w['worker']}: {w['jobs']} job(s), {format_size(w['transferred'])}, "
+                     f"last report {max(0, now - w['seen']):.0f}s ago")
+    for job in queue.jobs([FAILED], limit=10):
+        lines.append(f"  failed #{job['id']} {job['request']['url']}: {job['error']}")
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+"""
+In-process download engine.
+Drives the yt_dlp Python package on the job's worker thread instead of
+spawning yt-dlp.exe, so there is no per-download interpreter startup and
+progress arrives as structured dicts through progress_hooks instead of
+scraped text. yt_dlp is optional: when it is not installed the queue falls
+back to the subprocess path.
+"""
+import os
+import importlib.util
+
+
+ENGINE_AUTO = "auto"
+ENGINE_SUBPROCESS = "subprocess"
+ENGINE_INPROCESS = "yt_dlp"
+ENGINES = (ENGINE_AUTO, ENGINE_SUBPROCESS, ENGINE_INPROCESS)
+
+# line appended to opts["manifest"] for every finished file:
+# extractor<TAB>id<TAB>final path
+MANIFEST_TEMPLATE = "%(extractor_key)s\t%(id)s\t%(filepath)s"
+
+
+class Cancelled(Exception):
+    """Raised out of run_download when the job was paused or cancelled."""
+
+
+def available():
+    """True if the yt_dlp package can be imported (checked without importing it)."""
+    return importlib.util.find_spec("yt_dlp") is not None
+
+
+def resolve_engine(choice):
+    """
+    Map the "engine" setting to the engine a job will actually use.
+    "auto" and "yt_dlp" fall back to the subprocess path when yt_dlp is missing.
+    """
+    if choice in (ENGINE_AUTO, ENGINE_INPROCESS) and available():
+        return ENGINE_INPROCESS
+    return ENGINE_SUBPROCESS
+
+
+# ---------------- Shared option mapping ----------------
+def format_selector(fmt, q):
+    """yt-dlp format string for an output format and quality cap."""
+    if fmt in ("mp4", "mov"):
+        return f"bestvideo[height<={q}]+bestaudio[ext=m4a]/best"
+    if fmt in ("mp3", "wav"):
+        return "bestaudio"
+    if fmt == "webm":
+        return f"bestvideo[height<={q}]+bestaudio[ext=webm]/best"
+    return "best"
+
+
+def subtitle_langs(choice):
+    """
+    Languages for a subtitles choice: None for "none", ["all"] for "auto-all",
+    otherwise the code from values like "lang-en (English)" (default English).
+    """
+    if not choice or choice == "none":
+        return None
+    if choice == "auto-all":
+        return ["all"]
+    if choice.startswith("lang-"):
+        return [choice[5:].split(" ", 1)[0]]
+    return ["en"]
+
+
+def build_ydl_opts(opts, ffmpeg_path):
+    """
+    Translate a download options snapshot (the same choices build_command
+    turns into command line flags) into a YoutubeDL params dict.
+    Hooks are added by run_download.
+    """
+    fmt = opts["format"]
+    q = opts["quality"]
+    plan = opts.get("format_plan")
+    action = plan["action"] if plan and fmt not in ("mp3", "wav") else None
+    params = {
+        "outtmpl": {"default": os.path.join(opts["outdir"], "%(title)s.%(ext)s")},
+        "ffmpeg_location": ffmpeg_path,
+        "format": opts.get("format_pin") or (plan and plan["selector"]) or format_selector(fmt, q),
+        "continuedl": True,
+        # messages go to the logger; progress comes through the hooks
+        "quiet": False,
+        "noprogress": True,
+    }
+    if opts.get("temp_dir"):
+        params["outtmpl"] = {"default": "%(title)s.%(ext)s"}
+        params["paths"] = {"home": opts["outdir"], "temp": opts["temp_dir"]}
+    if opts.get("proxy"):
+        params["proxy"] = opts["proxy"]
+    if opts.get("manifest"):
+        params["print_to_file"] = {"after_move": [(MANIFEST_TEMPLATE, opts["manifest"])]}
+    if opts.get("download_archive"):
+        params["download_archive"] = opts["download_archive"]
+    if opts.get("no_playlist"):
+        params["noplaylist"] = True
+    if opts.get("tuning"):
+        from yd_tuning import tuning_params
+        params.update(tuning_params(opts["tuning"]))
+
+    postprocessors = []
+    langs = subtitle_langs(opts.get("subtitles"))
+    if langs:
+        params["writesubtitles"] = True
+        params["writeautomaticsub"] = True
+        params["subtitleslangs"] = langs
+        params["subtitlesformat"] = "srt/best"
+        postprocessors.append({"key": "FFmpegSubtitlesConvertor", "format": "srt", "when": "before_dl"})
+
+    if opts.get("post_step"):
+        # converted later by the post-processing pool (yd_pipeline)
+        pass
+    elif action in ("copy", "remux"):
+        params["merge_output_format"] = fmt
+        postprocessors.append({"key": "FFmpegVideoRemuxer", "preferedformat": fmt})
+    elif action == "audio":
+        postprocessors.append({"key": "FFmpegVideoConvertor", "preferedformat": fmt})
+        params["postprocessor_args"] = {"videoconvertor": ["-c:v", "copy", "-c:a", "aac"]}
+    elif fmt == "mp4":
+        if opts.get("remux_mp4"):
+            postprocessors.append({"key": "FFmpegVideoRemuxer", "preferedformat": "mp4"})
+        elif opts.get("recode_mp4"):
+            postprocessors.append({"key": "FFmpegVideoConvertor", "preferedformat": "mp4"})
+    elif fmt in ("mp3", "wav"):
+        postprocessors.append({"key": "FFmpegExtractAudio", "preferredcodec": fmt})
+    elif fmt == "mov":
+        postprocessors.append({"key": "FFmpegVideoConvertor", "preferedformat": "mov"})
+
+    # Embed subtitles into the resulting video container when supported
+    if langs and fmt in ("mp4", "webm", "mov"):
+        postprocessors.append({"key": "FFmpegEmbedSubtitle", "already_have_subtitle": False})
+
+    params["postprocessors"] = postprocessors
+    return params
+
+
+# ---------------- Running ----------------
+class _Logger:
+    # yt_dlp logger that forwards everything into the job log
+    def __init__(self, on_log):
+        self.on_log = on_log
+
+    def debug(self, msg):
+        # yt_dlp sends info-level messages through debug() as well
+        if not msg.startswith("[debug] "):
+            self.on_log(msg)
+
+    def info(self, msg):
+        self.on_log(msg)
+
+    def warning(self, msg):
+        self.on_log(f"WARNING: {msg}")
+
+    def error(self, msg):
+        self.on_log(msg)
+
+
+def run_download(opts, ffmpeg_path, on_log, on_progress, should_stop):
+    """
+    Download opts["url"] with yt_dlp in the calling thread.
+    on_progress receives yt_dlp's progress hook dicts (downloaded_bytes,
+    total_bytes, speed, eta, ...) and its postprocessor hook dicts (status,
+    postprocessor); yd_progress.from_hook turns both into ProgressEvents.
+    should_stop() is polled from the hooks; when it returns True the download
+    is aborted and Cancelled is raised. Returns yt_dlp's exit code.
+    """
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+
+    def progress_hook(d):
+        if should_stop():
+            raise DownloadCancelled()
+        on_progress(d)
+
+    def postprocessor_hook(d):
+        if should_stop():
+            raise DownloadCancelled()
+        on_progress(d)
+
+    params = build_ydl_opts(opts, ffmpeg_path)
+    params["logger"] = _Logger(on_log)
+    params["progress_hooks"] = [progress_hook]
+    params["postprocessor_hooks"] = [postprocessor_hook]
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            return ydl.download([opts["url"]])
+    except DownloadCancelled:
+        raise Cancelled()
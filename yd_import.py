@@ -0,0 +1,191 @@
+"""
+Bulk import of URL lists: text files, CSV/TSV exports and pasted lists
+with hundreds of thousands of lines.
+The input is read as a stream on a background thread. Every URL is reduced
+to a canonical key offline (yd_urls.canonical_url), so youtu.be/x,
+watch?v=x&t=30 and watch?v=x&list=... are one video, and checked against a
+hash index of the videos already queued, already downloaded (the download
+archive, for the chosen format and quality) and seen earlier in the input.
+New ones are queued BATCH at a time; while MAX_PENDING jobs are waiting the
+import waits for the queue instead of holding the whole list in memory.
+"""
+import os
+import csv
+import sys
+import time
+import hashlib
+import itertools
+import threading
+
+from yd_urls import canonical_url, is_playlist_url
+from yd_archive import variant_for
+from yd_jobs import DONE_STATES
+
+
+# jobs queued per batch (one lock and one scheduling pass each)
+BATCH = 500
+# queued jobs at which the import waits for the queue to drain
+MAX_PENDING = 2000
+# seconds between checks while waiting
+WAIT = 0.5
+# lines starting with these are comments (the rules of yt-dlp's --batch-file)
+COMMENTS = ("#", ";", "]")
+
+
+def key_hash(key):
+    """64-bit hash of a canonical key: the index keeps these instead of the strings."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def read_items(lines, kind="text"):
+    """
+    Yield the URL-like items of an input.
+    text: one item per line, or every word with "://" of a line with
+    several words ("url1 url2"); empty and comment lines are skipped.
+    csv / tsv: the first field of a row that contains "://" (else the first
+    field); a first row without a URL is taken as the header.
+    """
+    if kind == "text":
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith(COMMENTS):
+                continue
+            words = [w.strip("<>\"',") for w in line.split()]
+            urls = [w for w in words if "://" in w] if len(words) > 1 else words
+            # a line of words without a URL is one invalid item
+            yield from urls or [line]
+        return
+    rows = csv.reader(lines, delimiter="\t" if kind == "tsv" else ",")
+    for n, row in enumerate(rows, 1):
+        fields = [f.strip() for f in row if f.strip()]
+        if not fields or fields[0].startswith(COMMENTS):
+            continue
+        url = next((f for f in fields if "://" in f), None)
+        if url is None and n == 1:
+            continue
+        yield url or fields[0]
+
+
+def open_source(path):
+    """(line iterator, kind) for an import file; "-" reads stdin. Raises OSError."""
+    ext = os.path.splitext(path)[1].lower()
+    kind = {".csv": "csv", ".tsv": "tsv"}.get(ext, "text")
+    if path == "-":
+        return sys.stdin, kind
+    # newline="" lets the csv module handle quoted line breaks
+    return open(path, "r", encoding="utf-8-sig", errors="replace", newline=""), kind
+
+
+class BulkImport:
+    """
+    One import on a background thread (see DownloadCore.start_import).
+    opts is the options snapshot every imported URL gets. Counters:
+    read (items), accepted (queued), duplicates (of which `downloaded`
+    were in the download archive) and invalid (not a URL).
+    on_done(imp) runs on the import thread at the end.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, core, lines, opts, kind="text", name="", on_done=None):
+        self.id = next(BulkImport._ids)
+        self.core = core
+        self.lines = lines
+        self.opts = opts
+        self.kind = kind
+        self.name = name or "pasted list"
+        self.on_done = on_done
+        self.read = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.downloaded = 0
+        self.invalid = 0
+        self.finished = False
+        self.cancelled = False
+        self.error = ""
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        # stops after the current item; what was queued stays queued
+        self.cancelled = True
+
+    def summary(self):
+        state = "cancelled" if self.cancelled else ("done" if self.finished else "importing...")
+        text = (f"Import {self.id} ({self.name}) {state}: {self.read} read, {self.accepted} queued, "
+                f"{self.duplicates} duplicates ({self.downloaded} already downloaded), {self.invalid} invalid")
+        return text + (f", error: {self.error}" if self.error else "")
+
+    def _index(self, variant):
+        # hashes of the videos queued for variant, and of the archived ones
+        queued = set()
+        for job in list(self.core.job_queue.jobs.values()):
+            if job.state not in DONE_STATES and variant_for(job.options) == variant:
+                canon = canonical_url(job.url)
+                if canon:
+                    queued.add(key_hash(canon[0]))
+        archived = set()
+        if self.core.settings.get("skip_downloaded", True):
+            archived = {key_hash(key) for key in self.core.download_archive.keys(variant)}
+        return queued, archived
+
+    def _run(self):
+        try:
+            variant = variant_for(self.opts)
+            seen, archived = self._index(variant)
+            batch = []
+            for text in read_items(self.lines, self.kind):
+                if self.cancelled:
+                    break
+                self.read += 1
+                canon = canonical_url(text)
+                if canon is None:
+                    self.invalid += 1
+                    continue
+                key, url = canon
+                h = key_hash(key)
+                if h in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(h)
+                # the archive index only says "maybe": has() checks the file is still there
+                if h in archived and self.core.download_archive.has(key, variant):
+                    self.duplicates += 1
+                    self.downloaded += 1
+                    continue
+                batch.append(url)
+                if len(batch) >= BATCH:
+                    self._queue(batch)
+                    batch = []
+            if batch and not self.cancelled:
+                self._queue(batch)
+        except Exception as e:
+            self.error = str(e)
+            print("Import error:", e)
+        finally:
+            if self.lines is not sys.stdin and hasattr(self.lines, "close"):
+                self.lines.close()
+            self.finished = True
+            self.core.log_store.combined.append(self.summary())
+            if self.on_done:
+                self.on_done(self)
+
+    def _queue(self, urls):
+        queue = self.core.job_queue
+        while queue.pending_count() >= MAX_PENDING and not self.cancelled:
+            time.sleep(WAIT)
+        if self.cancelled:
+            return
+        videos = []
+        for url in urls:
+            opts = dict(self.opts, url=url)
+            if is_playlist_url(url):
+                # listed and expanded like a pasted playlist
+                self.core.add(opts)
+            else:
+                videos.append(opts)
+        self.core.queue_batch(videos)
+        self.accepted += len(urls)
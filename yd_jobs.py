@@ -0,0 +1,734 @@
+import os
+import re
+import glob
+import uuid
+import shutil
+import threading
+import subprocess
+import itertools
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from yd_engine import ENGINE_SUBPROCESS, ENGINE_INPROCESS
+from yd_progress import DOWNLOAD, POSTPROCESS, parse_progress_line, from_hook
+from yd_supervisor import ProcessReaper
+
+
+# ---------------- Job states ----------------
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# downloaded; the conversion runs in the post-processing pool (no download slot)
+POSTPROCESSING = "postprocessing"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+DONE_STATES = (FINISHED, FAILED, CANCELLED)
+
+
+def job_source(job):
+    """Where a job came from: its subscription, the playlist it was listed from, else the site."""
+    return (job.options or {}).get("source") or job.group or (urlsplit(job.url).hostname or "")
+
+
+def popen_kwargs(group=False):
+    """
+    Extra Popen arguments so no console window flashes up on Windows.
+    group=True starts the process in a process group of its own, so it can
+    be stopped together with its children (see yd_supervisor).
+    """
+    if os.name != "nt":
+        return {"start_new_session": True} if group else {}
+    startupinfo = None
+    try:
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    except Exception:
+        startupinfo = None
+    return {
+        "startupinfo": startupinfo,
+        "creationflags": getattr(subprocess, "CREATE_NO_WINDOW", 0)
+                         | (getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0) if group else 0),
+    }
+
+
+_DESTINATION = re.compile(r"^\[download\] Destination: (.+)$")
+_FORMATS = re.compile(r"^\[info\] .*: Downloading \d+ format\(s\): (\S+)")
+
+
+def parse_output_details(job, line):
+    """
+    Note the file yt-dlp writes to and the format ids it picked from one log
+    line on the job (used by the journal to resume). Progress, fragments
+    included, comes through the progress protocol (yd_progress).
+    """
+    m = _DESTINATION.match(line)
+    if m:
+        if m.group(1) not in job.files:
+            job.files.append(m.group(1))
+        return
+    m = _FORMATS.match(line)
+    if m:
+        job.format_ids = m.group(1)
+
+
+# ---------------- Job ----------------
+class Job:
+    """
+    One download: the yt-dlp command plus its own process, reader thread,
+    progress and pause/cancel state.
+    State transitions are owned by JobQueue; everybody else only reads.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, url, command, outdir, label=None, fmt="", options=None, engine=ENGINE_SUBPROCESS, group=None, retries=0, uid=None):
+        self.id = next(Job._ids)
+        # uid: stable id across restarts (the journal key); id is per session
+        self.uid = uid or uuid.uuid4().hex
+        self.url = url
+        self.command = list(command)
+        self.outdir = outdir
+        self.label = label or url
+        self.fmt = fmt
+        # options: snapshot of the download choices, used by the in-process engine
+        self.options = dict(options or {})
+        self.engine = engine
+        # group: uid of the playlist this entry came from (None for single URLs)
+        self.group = group
+        # retries_left: automatic re-queues after a failed run
+        self.retries_left = retries
+        self.attempts = 0
+        # created: when the job was queued (scheduling policies age waiting jobs by it)
+        self.created = time.time()
+        self.state = QUEUED
+        self.progress = 0.0
+        self.eta = ""
+        # stage: what yt-dlp is doing in a run (yd_progress.DOWNLOAD or POSTPROCESS)
+        self.stage = DOWNLOAD
+        # byte-level progress of the current file (from ProgressEvents)
+        self.downloaded_bytes = None
+        self.total_bytes = None
+        self.speed = None
+        # post_progress: percent of the conversion while POSTPROCESSING
+        self.post_progress = None
+        # files: paths yt-dlp writes to (their .part files hold partial data),
+        # format_ids: the formats it picked ("137+140"), fragments: (done, total)
+        self.files = []
+        self.format_ids = ""
+        self.fragments = None
+        # transferred: bytes received over all files and runs (for throughput measurement)
+        self.transferred = 0
+        # throttle: TokenBucket used by the in-process engine (set by the bandwidth scheduler)
+        self.throttle = None
+        # restart_pending: stop the current run and queue the job again right away
+        self.restart_pending = False
+        # restart_delay: seconds the restarted job waits before it may run again
+        self.restart_delay = 0
+        self.process = None
+        self.thread = None
+        self.stop_requested = False
+        self.run_id = 0
+        self.returncode = None
+        self.error = ""
+        # elapsed time is accumulated over runs so pause/resume keeps it
+        self.run_started = None
+        self.elapsed_before = 0.0
+
+    def elapsed(self):
+        """Seconds spent running, including earlier runs before a pause."""
+        if self.run_started is None:
+            return self.elapsed_before
+        return self.elapsed_before + (time.time() - self.run_started)
+
+    def __repr__(self):
+        return f"<Job #{self.id} {self.state} {self.url}>"
+
+
+# ---------------- Queue ----------------
+class JobQueue:
+    """
+    Runs queued jobs on up to max_workers parallel slots.
+    Listeners are called as listener(job, kind, data) from worker threads with
+    kind one of "state", "progress", "eta", "stage" or "log"; GUI code has to marshal
+    them onto the Tk thread itself. Both engines report progress as
+    yd_progress.ProgressEvents, recorded on the job by _apply_progress; "log"
+    only carries the human-readable yt-dlp output.
+    """
+
+    def __init__(self, max_workers=2, ffmpeg_path=None, command_builder=None):
+        self.max_workers = max(1, int(max_workers))
+        self.ffmpeg_path = ffmpeg_path
+        # command_builder(options) rebuilds job.command after start hooks changed options
+        self.command_builder = command_builder
+        # post_processor: object with submit(job) / cancel(job) that converts
+        # finished downloads whose options carry a "post_step" (see yd_pipeline)
+        self.post_processor = None
+        # admission: admission(job, scan) -> bool, asked (under the queue lock)
+        # before a queued job starts; False keeps it queued and the next one is
+        # tried. scan is a dict shared by the calls of one scheduling pass (for
+        # measurements worth reusing); (job, line) pairs in scan["log"] are
+        # logged once the lock is released. A job refused in a pass is not
+        # asked again in the same pass.
+        self.admission = None
+        # policy: order(pending, running, now) -> pending jobs in start order
+        # (see yd_scheduling); None starts them first in, first out
+        self.policy = None
+        self._start_hooks = []
+        self.jobs = {}
+        self._pending = deque()
+        self._lock = threading.RLock()
+        self._listeners = []
+        # state changes are collected under _lock and emitted after it is
+        # released, so listeners may do I/O without stalling the queue
+        self._state_events = []
+        self._emit_lock = threading.RLock()
+        self._running = set()
+        # reaper: stops process groups off the caller's thread (pause/cancel never block)
+        self.reaper = ProcessReaper()
+
+    # ----- listeners -----
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def add_start_hook(self, fn):
+        """
+        fn(job) runs on the worker thread right before each run of a job and may
+        change job.options; the command is rebuilt afterwards.
+        """
+        self._start_hooks.append(fn)
+
+    def _emit(self, job, kind, data=None):
+        for fn in list(self._listeners):
+            try:
+                fn(job, kind, data)
+            except Exception as e:
+                print("Job listener error:", e)
+
+    def _set_state(self, job, state):
+        # caller holds _lock and calls _flush_states() after releasing it
+        job.state = state
+        if state == RUNNING:
+            self._running.add(job.id)
+        else:
+            self._running.discard(job.id)
+        self._state_events.append((job, state))
+
+    def _flush_states(self):
+        with self._emit_lock:
+            with self._lock:
+                events, self._state_events = self._state_events, []
+            for job, state in events:
+                self._emit(job, "state", state)
+
+    # ----- public API -----
+    def submit(self, url, command, outdir, label=None, fmt="", options=None, engine=ENGINE_SUBPROCESS, group=None, retries=0):
+        """
+        Create a job and queue it. Returns the Job.
+        command is used by the subprocess engine, options by the in-process one.
+        A failed job is re-queued at the back up to `retries` times.
+        """
+        return self.add(Job(url, command, outdir, label, fmt, options, engine, group, retries))
+
+    def add(self, job, state=QUEUED):
+        """
+        Add a Job created by the caller (e.g. restored from the journal).
+        state PAUSED or FAILED adds it without queueing it. Returns the Job.
+        """
+        with self._lock:
+            self.jobs[job.id] = job
+            if state == QUEUED:
+                self._pending.append(job)
+            job.state = state
+            self._state_events.append((job, state))
+        self._schedule()
+        return job
+
+    def add_many(self, jobs):
+        """Queue a batch of new Jobs under one lock and one scheduling pass (bulk import)."""
+        with self._lock:
+            for job in jobs:
+                self.jobs[job.id] = job
+                self._pending.append(job)
+                job.state = QUEUED
+                self._state_events.append((job, QUEUED))
+        self._schedule()
+        return jobs
+
+    def log(self, job, line):
+        """Add a line to a job's log (delivered to listeners like yt-dlp output)."""
+        self._emit(job, "log", line)
+
+    def notify(self, job, kind, data=None):
+        """Deliver an event for job to the listeners (used by the post-processor)."""
+        self._emit(job, kind, data)
+
+    def finish_post(self, job, error=None):
+        """Called by the post-processor when the conversion of a job has ended."""
+        with self._lock:
+            if job.state != POSTPROCESSING:
+                return
+            if error:
+                job.error = error
+                self._set_state(job, FAILED)
+            else:
+                self._set_state(job, FINISHED)
+        self._flush_states()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def set_max_workers(self, n):
+        with self._lock:
+            self.max_workers = max(1, int(n))
+        self._schedule()
+
+    def running_count(self):
+        return len(self._running)
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def counts(self):
+        """Return a dict state -> number of jobs in that state."""
+        with self._lock:
+            out = {}
+            for j in self.jobs.values():
+                out[j.state] = out.get(j.state, 0) + 1
+            return out
+
+    def pause(self, job_id):
+        """
+        Stop a queued or running job but keep it so it can be resumed.
+        yt-dlp continues from its .part file when the job is restarted.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job.state not in ACTIVE_STATES:
+                return False
+            if job in self._pending:
+                self._pending.remove(job)
+            proc = job.process
+            job.stop_requested = True
+            # a pending restart is void: the paused job starts fresh on resume
+            job.restart_pending = False
+            job.restart_delay = 0
+            self._stop_clock(job)
+            self._set_state(job, PAUSED)
+        self._flush_states()
+        if proc:
+            self._stop_process(proc, kill=False)
+        return True
+
+    def resume(self, job_id):
+        """Put a paused (or failed) job back into the queue."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job.state not in (PAUSED, FAILED):
+                return False
+            job.stop_requested = False
+            job.error = ""
+            self._pending.append(job)
+            self._set_state(job, QUEUED)
+        self._schedule()
+        return True
+
+    def cancel(self, job_id):
+        """Force-stop a job. Cancelled jobs cannot be resumed."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job.state in DONE_STATES:
+                return False
+            if job in self._pending:
+                self._pending.remove(job)
+            proc = job.process
+            converting = job.state == POSTPROCESSING
+            job.stop_requested = True
+            job.restart_pending = False
+            job.restart_delay = 0
+            self._stop_clock(job)
+            self._set_state(job, CANCELLED)
+        self._flush_states()
+        if proc:
+            self._stop_process(proc, kill=True)
+        if converting and self.post_processor is not None:
+            self.post_processor.cancel(job)
+        return True
+
+    def restart(self, job_id, reason="", delay=0):
+        """
+        Stop the current run of a running job and put it back at the front
+        of the queue once the old process has exited (yt-dlp resumes the .part
+        file). Used to apply changed options such as a new rate limit. With a
+        delay the job waits that many seconds as QUEUED before it is eligible
+        again.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job.state != RUNNING or job.restart_pending:
+                return False
+            job.restart_pending = True
+            job.restart_delay = delay
+            job.stop_requested = True
+            proc = job.process
+        if reason:
+            self._emit(job, "log", reason)
+        if proc:
+            self._stop_process(proc, kill=False)
+        return True
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def pause_all(self):
+        """Pause every queued or running job (used when the app closes)."""
+        for job_id in list(self.jobs):
+            self.pause(job_id)
+
+    def remove_finished(self):
+        """Forget all jobs that can no longer change. Returns their ids."""
+        with self._lock:
+            gone = [j.id for j in self.jobs.values() if j.state in DONE_STATES]
+            for job_id in gone:
+                del self.jobs[job_id]
+        return gone
+
+    def reschedule(self):
+        """Start queued jobs an admission check held back, if they fit now."""
+        self._schedule()
+
+    # ----- internals -----
+    def _admitted(self, job, scan):
+        if job.id in scan["refused"]:
+            return False
+        try:
+            if self.admission(job, scan):
+                return True
+        except Exception as e:
+            print("Admission check error:", e)
+            return True
+        scan["refused"].add(job.id)
+        return False
+
+    def _schedule(self):
+        # start queued jobs while there are free worker slots
+        scan = {"refused": set(), "log": []}
+        with self._lock:
+            while self._pending and self.running_count() < self.max_workers:
+                candidates = self._pending
+                if self.policy is not None:
+                    candidates = self._ordered()
+                if self.admission is None:
+                    job = candidates[0]
+                else:
+                    job = next((j for j in candidates if self._admitted(j, scan)), None)
+                    if job is None:
+                        break
+                self._pending.remove(job)
+                job.stop_requested = False
+                job.restart_pending = False
+                job.restart_delay = 0
+                job.process = None
+                job.run_id += 1
+                job.attempts += 1
+                job.run_started = time.time()
+                self._set_state(job, RUNNING)
+                job.thread = threading.Thread(target=self._run, args=(job, job.run_id), daemon=True)
+                job.thread.start()
+        self._flush_states()
+        for job, line in scan["log"]:
+            self.log(job, line)
+
+    def _ordered(self):
+        running = [self.jobs[i] for i in self._running if i in self.jobs]
+        try:
+            return self.policy.order(list(self._pending), running, time.time())
+        except Exception as e:
+            print("Scheduling policy error:", e)
+            return self._pending
+
+    def _stop_clock(self, job):
+        if job.run_started is not None:
+            job.elapsed_before += time.time() - job.run_started
+            job.run_started = None
+
+    def _stop_process(self, proc, kill=False):
+        # returns at once; the reaper stops the process and its children
+        self.reaper.stop(proc, kill=kill)
+
+    def _requeue(self, job, run_id):
+        # end of a delayed restart; pause/resume/cancel in between win
+        with self._lock:
+            if job.state != QUEUED or job.run_id != run_id or job in self._pending:
+                return
+            self._pending.appendleft(job)
+        self._schedule()
+
+    def _run(self, job, run_id):
+        """Worker thread: run the job's process and parse its output."""
+        job.stage = DOWNLOAD
+        if job.options and job.options.get("source_stream") and self._run_local(job, run_id):
+            return
+        try:
+            for hook in self._start_hooks:
+                hook(job)
+            if self._start_hooks and self.command_builder:
+                job.command = self.command_builder(job.options)
+        except Exception as e:
+            self._emit(job, "log", f"WARNING: start hook failed: {e}")
+        if job.engine == ENGINE_INPROCESS:
+            self._run_inprocess(job, run_id)
+            return
+        try:
+            proc = subprocess.Popen(
+                job.command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                universal_newlines=True,
+                **popen_kwargs(group=True)
+            )
+        except Exception as e:
+            job.error = f"Failed to start: {e}"
+            self._emit(job, "log", job.error)
+            self._finish(job, run_id, None)
+            return
+
+        with self._lock:
+            if job.run_id == run_id:
+                job.process = proc
+            stopped = job.stop_requested or job.run_id != run_id
+        if stopped:
+            # paused or cancelled while the process was starting up
+            self._stop_process(proc, kill=True)
+
+        counter = [0, None]
+        try:
+            for line in proc.stdout:
+                if job.stop_requested or job.run_id != run_id:
+                    break
+                line = line.rstrip()
+                if not line:
+                    continue
+                event = parse_progress_line(line)
+                if event is not None:
+                    self._apply_progress(job, event, counter)
+                    continue
+                self._emit(job, "log", line)
+                parse_output_details(job, line)
+        except Exception as e:
+            job.error = str(e)
+        try:
+            returncode = proc.wait()
+        except Exception:
+            returncode = None
+        # children yt-dlp left behind (e.g. an ffmpeg that outlived it) go too
+        self.reaper.stop(proc)
+        self._finish(job, run_id, returncode)
+
+    def _run_local(self, job, run_id):
+        """
+        Worker thread: take the job's file from a local source instead of the
+        network. options["source_stream"] = {"path", "dest", "manifest_line",
+        "post_step"} (see yd_streamstore): the source is linked (or copied)
+        to dest and listed in the manifest, and the job's post_step converts it.
+        With "subtitles" = {"command", "pattern"} the command fetches missing
+        subtitles first and the files matching pattern are muxed in by the
+        conversion. Returns False, with the job turned into a normal
+        download, when the source is gone.
+        """
+        source = job.options["source_stream"]
+        if not os.path.isfile(source["path"]):
+            job.options.pop("source_stream")
+            job.options["post_step"] = source.get("post_step")
+            self._emit(job, "log", "Stored stream is gone, downloading instead")
+            return False
+        if source.get("subtitles") and not self._fetch_subtitles(job, run_id, source["subtitles"]):
+            self._finish(job, run_id, None)
+            return True
+        dest = source["dest"]
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.exists(dest):
+                os.remove(dest)
+            try:
+                os.link(source["path"], dest)
+            except OSError:
+                shutil.copyfile(source["path"], dest)
+            if job.options.get("manifest"):
+                with open(job.options["manifest"], "a", encoding="utf-8") as f:
+                    f.write(source["manifest_line"] + "\n")
+            returncode = 0
+        except OSError as e:
+            job.error = f"Could not use the stored stream: {e}"
+            self._emit(job, "log", f"ERROR: {job.error}")
+            returncode = 1
+        if dest not in job.files:
+            job.files.append(dest)
+        job.progress = 100.0
+        self._emit(job, "progress", job.progress)
+        self._finish(job, run_id, returncode)
+        return True
+
+    def _fetch_subtitles(self, job, run_id, subtitles):
+        # run the subtitle-only yt-dlp command of a local job; False when the job was stopped
+        try:
+            proc = subprocess.Popen(subtitles["command"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, encoding="utf-8", errors="replace", **popen_kwargs(group=True))
+        except Exception as e:
+            proc = None
+            self._emit(job, "log", f"WARNING: could not fetch subtitles: {e}")
+        if proc:
+            with self._lock:
+                if job.run_id == run_id:
+                    job.process = proc
+                stopped = job.stop_requested or job.run_id != run_id
+            if stopped:
+                self._stop_process(proc, kill=True)
+            for line in proc.stdout:
+                if line.strip():
+                    self._emit(job, "log", line.rstrip())
+            proc.wait()
+            self.reaper.stop(proc)
+            with self._lock:
+                if job.process is proc:
+                    job.process = None
+        if job.stop_requested or job.run_id != run_id:
+            return False
+        files = sorted(glob.glob(subtitles["pattern"]))
+        if not files:
+            self._emit(job, "log", "WARNING: no subtitles found, the video is made without them")
+        job.options["post_step"] = dict(job.options["post_step"], subtitle_files=files)
+        return True
+
+    def _run_inprocess(self, job, run_id):
+        """Worker thread: download with the yt_dlp package in this thread."""
+        import yd_engine
+
+        def should_stop():
+            return job.stop_requested or job.run_id != run_id
+
+        def on_log(line):
+            self._emit(job, "log", line)
+
+        counter = [0, None]
+
+        def on_progress(d):
+            event = from_hook(d, (d.get("info_dict") or {}).get("format_id"))
+            delta = self._apply_progress(job, event, counter)
+            if delta and job.throttle is not None:
+                job.throttle.consume(delta, should_stop)
+
+        try:
+            returncode = yd_engine.run_download(job.options, self.ffmpeg_path, on_log, on_progress, should_stop)
+        except yd_engine.Cancelled:
+            returncode = None
+        except Exception as e:
+            job.error = str(e)
+            self._emit(job, "log", f"ERROR: {e}")
+            returncode = 1
+        self._finish(job, run_id, returncode)
+
+    def _apply_progress(self, job, event, counter):
+        """
+        Record a ProgressEvent on the job and notify listeners. counter holds
+        the highest byte count and the file of this run's previous events;
+        returns the bytes received since then.
+        """
+        if event.stage != job.stage:
+            job.stage = event.stage
+            self._emit(job, "stage", event.stage)
+        if event.stage == POSTPROCESS:
+            if event.status == "started":
+                self._emit(job, "log", f"[{event.postprocessor}] post-processing...")
+            return 0
+        if event.status == "finished":
+            job.progress = 100.0
+            self._emit(job, "progress", job.progress)
+            return 0
+        if event.status != "downloading":
+            return 0
+        done = event.downloaded_bytes or 0
+        # a new file restarts the counter; concurrent fragment downloads
+        # (-N) can report a lower count for the same file, which is no progress
+        if event.filename != counter[1]:
+            counter[:] = [0, event.filename]
+        delta = max(0, done - counter[0])
+        counter[0] = max(counter[0], done)
+        job.transferred += delta
+        if event.filename and event.filename not in job.files:
+            job.files.append(event.filename)
+        if event.fragment_count:
+            job.fragments = (event.fragment_index or 0, event.fragment_count)
+        # a merged download reports each requested format in turn
+        if event.format_id and event.format_id not in job.format_ids.split("+"):
+            job.format_ids = f"{job.format_ids}+{event.format_id}" if job.format_ids else event.format_id
+        job.downloaded_bytes = event.downloaded_bytes
+        job.total_bytes = event.total_bytes
+        job.speed = event.speed
+        if event.percent is not None:
+            job.progress = event.percent
+        self._emit(job, "progress", job.progress)
+        if event.eta is not None:
+            mins, secs = divmod(event.eta, 60)
+            job.eta = f"{mins:02d}:{secs:02d}"
+            self._emit(job, "eta", job.eta)
+        return delta
+
+    def _finish(self, job, run_id, returncode):
+        retry_note = None
+        hand_off = False
+        with self._lock:
+            if job.run_id != run_id:
+                # a newer run of this job (paused, then resumed) owns it now
+                return
+            job.returncode = returncode
+            job.process = None
+            self._stop_clock(job)
+            # pause/cancel already set the final state for stopped jobs
+            if job.state == RUNNING and job.restart_pending:
+                job.restart_pending = False
+                # the stopped run's error (e.g. a timeout) does not count
+                job.error = ""
+                delay, job.restart_delay = job.restart_delay, 0
+                if delay:
+                    timer = threading.Timer(delay, self._requeue, args=(job, run_id))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self._pending.appendleft(job)
+                self._set_state(job, QUEUED)
+            elif job.state == RUNNING:
+                if returncode == 0:
+                    job.progress = 100.0
+                    job.eta = ""
+                    if self.post_processor is not None and job.options.get("post_step"):
+                        # the slot is free now; the conversion runs in its own pool
+                        hand_off = True
+                        self._set_state(job, POSTPROCESSING)
+                    else:
+                        self._set_state(job, FINISHED)
+                elif job.retries_left > 0:
+                    # per-job retry: back of the queue so other entries go first
+                    job.retries_left -= 1
+                    retry_note = f"Failed with code {returncode}, retrying ({job.retries_left} retries left)"
+                    job.error = ""
+                    self._pending.append(job)
+                    self._set_state(job, QUEUED)
+                else:
+                    if not job.error:
+                        job.error = f"yt-dlp failed with code {returncode}"
+                    self._set_state(job, FAILED)
+        if retry_note:
+            self._emit(job, "log", retry_note)
+        self._schedule()
+        if hand_off:
+            self.post_processor.submit(job)
@@ -0,0 +1,178 @@
+"""
+Crash-safe job journal.
+An append-only JSON-lines file (Necessary/journal.jsonl) with a snapshot of
+every job whenever it changes state (fsynced once it starts) and at most every
+PROGRESS_INTERVAL seconds while it downloads: options, state, the files
+yt-dlp writes (their .part data), the picked format ids, completed bytes and
+fragments. A torn last line after a crash is ignored on load. Finished and
+cancelled jobs are dropped when the file is compacted, so it only ever holds
+the work that is still open.
+"""
+import os
+import json
+import time
+import threading
+
+from yd_jobs import QUEUED, FINISHED, CANCELLED
+
+
+PROGRESS_INTERVAL = 2.0
+# rewrite the file once it has this many more lines than open records
+COMPACT_SLACK = 2000
+
+# options that belong to one run and are set again when the job restarts
+_RUN_OPTIONS = ("rate_limit", "tuning", "proxy_avoid")
+
+
+def job_record(job):
+    """Journal snapshot of a Job."""
+    return {
+        "type": "job",
+        "uid": job.uid,
+        "url": job.url,
+        "outdir": job.outdir,
+        "label": job.label,
+        "fmt": job.fmt,
+        "options": {k: v for k, v in job.options.items() if k not in _RUN_OPTIONS},
+        "group": job.group,
+        "retries_left": job.retries_left,
+        "state": job.state,
+        "progress": job.progress,
+        "downloaded_bytes": job.downloaded_bytes,
+        "total_bytes": job.total_bytes,
+        "fragments": job.fragments,
+        "files": list(job.files),
+        "format_ids": job.format_ids,
+        "elapsed": round(job.elapsed(), 1),
+        "t": time.time(),
+    }
+
+
+def partial_bytes(record):
+    """
+    Bytes of a journaled job that are already on disk: its .part files plus
+    formats that finished before the interruption (e.g. the video stream of
+    a video+audio download). Returns (bytes, number of files).
+    """
+    total = 0
+    n = 0
+    for path in record.get("files") or []:
+        for candidate in (path + ".part", path):
+            try:
+                total += os.path.getsize(candidate)
+                n += 1
+                break
+            except OSError:
+                pass
+    return total, n
+
+
+class JobJournal:
+    """
+    Use on_job_event as a JobQueue listener. pending() returns the open
+    records of the previous run (jobs and unfinished playlist listings).
+    After close() nothing is written any more, so jobs stopped while the app
+    shuts down keep their last state and continue on the next start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        self._last_progress = {}
+        # what was last journaled about a job's files, to write new ones at once
+        self._known_files = {}
+        self._lines = 0
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._load()
+        self._pending = list(self._records.values())
+        self._compact()
+
+    def pending(self):
+        """Records that were still open when the journal was last written."""
+        return list(self._pending)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # torn write from a crash
+                        continue
+                    self._apply(rec)
+        except OSError:
+            pass
+
+    def _apply(self, rec):
+        uid = rec.get("uid")
+        if not uid:
+            return
+        if rec.get("removed") or rec.get("state") in (FINISHED, CANCELLED) or rec.get("done"):
+            self._records.pop(uid, None)
+        else:
+            self._records[uid] = rec
+
+    def _compact(self):
+        # rewrite only the open records; os.replace keeps the old file until the new one is complete
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self._records.values():
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._lines = len(self._records)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, rec, sync=False):
+        with self._lock:
+            if self._closed:
+                return
+            self._apply(rec)
+            self._file.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self._lines += 1
+            if self._lines > len(self._records) + COMPACT_SLACK:
+                self._file.close()
+                self._compact()
+
+    # ----- records -----
+    def on_job_event(self, job, kind, data):
+        if kind == "state":
+            self._last_progress[job.uid] = time.monotonic()
+            # queued lines are only flushed (that survives an app crash), so
+            # queueing a long playlist does not wait for the disk
+            self._write(job_record(job), sync=data != QUEUED)
+        elif kind == "progress":
+            now = time.monotonic()
+            files = (len(job.files), job.format_ids)
+            if files != self._known_files.get(job.uid) or now - self._last_progress.get(job.uid, 0) >= PROGRESS_INTERVAL:
+                self._last_progress[job.uid] = now
+                self._known_files[job.uid] = files
+                self._write(job_record(job))
+
+    def record_playlist(self, uid, url, options, listed=0, done=False):
+        """
+        Remember a playlist listing and how many entries it has handled, so an
+        interrupted listing can be restarted where it stopped.
+        """
+        rec = {"type": "playlist", "uid": uid, "url": url, "options": options, "listed": listed, "done": done, "t": time.time()}
+        self._write(rec, sync=done or not listed)
+
+    def remove(self, uid):
+        """Forget a job (e.g. a failed one the user cleared from the list)."""
+        self._last_progress.pop(uid, None)
+        self._known_files.pop(uid, None)
+        self._write({"uid": uid, "removed": True})
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._file.close()
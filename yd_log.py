@@ -0,0 +1,259 @@
+"""
+Bounded, disk-spooled download log.
+Every line is appended to a file on disk; memory only holds a ring of the
+most recent lines plus a sparse index of byte offsets (one entry every
+INDEX_STRIDE lines), so any line range can be paged back in with one seek
+and the whole file is never loaded.
+"""
+import os
+import re
+import time
+import shutil
+import threading
+from array import array
+from collections import deque
+
+from yd_jobs import RUNNING, POSTPROCESSING
+
+
+INDEX_STRIDE = 64
+RING_SIZE = 2000
+CHUNK_SIZE = 1 << 20
+KEEP_SESSIONS = 20
+
+
+class SpooledLog:
+    """
+    Append-only log file with random access by line number.
+    Thread-safe: worker threads append while the Tk thread reads.
+    The file handles are opened on first use and only kept while the log
+    is active (see set_active); an inactive log opens the file per access,
+    so thousands of finished job logs hold no file descriptors.
+    """
+
+    def __init__(self, path, ring_size=RING_SIZE, active=True):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ring = deque(maxlen=ring_size)
+        # _index[k] = byte offset of line k * INDEX_STRIDE
+        self._index = array("Q")
+        self._count = 0
+        self._size = 0
+        self._dirty = False
+        self._active = active
+        self._writer = None
+        self._reader = None
+
+    def __len__(self):
+        return self._count
+
+    def set_active(self, active):
+        """Inactive closes the file handles; they are opened again on the next access while active."""
+        with self._lock:
+            self._active = active
+            if not active:
+                self._close_handles()
+
+    def _close_handles(self):
+        # lock held
+        for f in (self._writer, self._reader):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+        self._writer = self._reader = None
+        self._dirty = False
+
+    def append(self, line):
+        self.append_lines([line])
+
+    def append_lines(self, lines):
+        """Append lines (without trailing newlines) to the ring and the file."""
+        with self._lock:
+            writer = self._writer or open(self.path, "ab")
+            try:
+                for line in lines:
+                    data = (line.replace("\n", " ") + "\n").encode("utf-8", "replace")
+                    if self._count % INDEX_STRIDE == 0:
+                        self._index.append(self._size)
+                    writer.write(data)
+                    self._size += len(data)
+                    self._count += 1
+                    self._ring.append(line)
+            finally:
+                if self._active:
+                    self._writer = writer
+                    self._dirty = True
+                else:
+                    writer.close()
+
+    def _flush(self):
+        # make buffered writes visible to the reader handle (lock held)
+        if self._dirty:
+            self._writer.flush()
+            self._dirty = False
+
+    def get_lines(self, start, count):
+        """
+        Return up to count lines starting at line number start.
+        Recent lines come from the ring, older ones are paged in from disk.
+        """
+        with self._lock:
+            start = max(0, start)
+            end = min(self._count, start + count)
+            if end <= start:
+                return []
+            ring_start = self._count - len(self._ring)
+            if start >= ring_start:
+                return [self._ring[i - ring_start] for i in range(start, end)]
+            self._flush()
+            reader = self._reader or open(self.path, "rb")
+            try:
+                block = start // INDEX_STRIDE
+                reader.seek(self._index[block])
+                # skip to start inside the indexed block, then read what we need
+                for _ in range(start - block * INDEX_STRIDE):
+                    reader.readline()
+                out = []
+                for _ in range(end - start):
+                    out.append(reader.readline().decode("utf-8", "replace").rstrip("\n"))
+            finally:
+                if self._active:
+                    self._reader = reader
+                else:
+                    reader.close()
+            return out
+
+    def get_line(self, n):
+        lines = self.get_lines(n, 1)
+        return lines[0] if lines else ""
+
+    def search(self, pattern, regex=False, ignore_case=True, limit=100000):
+        """
+        Stream the spooled file in CHUNK_SIZE blocks and return the line numbers
+        matching pattern (at most limit). Memory use is one block, not the file.
+        """
+        with self._lock:
+            self._flush()
+            size = self._size
+        if not size:
+            return array("L")
+        flags = re.IGNORECASE if ignore_case else 0
+        if not regex:
+            pattern = re.escape(pattern)
+        # blocks always end on a line boundary, so line numbers stay exact
+        rx = re.compile(pattern.encode("utf-8"), flags)
+        hits = array("L")
+        lineno = 0
+        read = 0
+        tail = b""
+        with open(self.path, "rb") as f:
+            while read < size and len(hits) < limit:
+                chunk = f.read(min(CHUNK_SIZE, size - read))
+                if not chunk:
+                    break
+                read += len(chunk)
+                block = tail + chunk
+                # only search complete lines; carry the rest over
+                cut = block.rfind(b"\n") + 1
+                if read >= size:
+                    cut = len(block)
+                block, tail = block[:cut], block[cut:]
+                pos = 0
+                last_hit_line = -1
+                for m in rx.finditer(block):
+                    lineno += block.count(b"\n", pos, m.start())
+                    pos = m.start()
+                    if lineno != last_hit_line:
+                        hits.append(lineno)
+                        last_hit_line = lineno
+                        if len(hits) >= limit:
+                            break
+                lineno += block.count(b"\n", pos)
+        return hits
+
+    def close(self):
+        self.set_active(False)
+
+
+class FilteredLog:
+    """Read-only view of a SpooledLog restricted to the given line numbers."""
+
+    def __init__(self, log, line_numbers):
+        self.log = log
+        self.line_numbers = line_numbers
+        self.path = log.path
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def get_lines(self, start, count):
+        return [self.log.get_line(n) for n in self.line_numbers[max(0, start):start + count]]
+
+    def get_line(self, n):
+        return self.log.get_line(self.line_numbers[n])
+
+
+class LogStore:
+    """
+    Spools job output for one app session: one file per job plus a combined
+    log, all in a per-session folder under base_dir. Old sessions beyond
+    KEEP_SESSIONS are removed on startup.
+    Use on_job_event as a JobQueue listener: a job's log keeps its file
+    open only while the job runs or converts.
+    """
+
+    def __init__(self, base_dir, ring_size=RING_SIZE):
+        self.base_dir = base_dir
+        self.ring_size = ring_size
+        os.makedirs(base_dir, exist_ok=True)
+        self._prune_sessions()
+        self.session_dir = os.path.join(base_dir, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.combined = SpooledLog(os.path.join(self.session_dir, "all.log"), ring_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune_sessions(self):
+        try:
+            sessions = sorted(d for d in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, d)))
+        except OSError:
+            return
+        for d in sessions[:max(0, len(sessions) - (KEEP_SESSIONS - 1))]:
+            shutil.rmtree(os.path.join(self.base_dir, d), ignore_errors=True)
+
+    def job_log(self, job_id):
+        """SpooledLog for one job (created on first use)."""
+        with self._lock:
+            log = self._jobs.get(job_id)
+            if log is None:
+                path = os.path.join(self.session_dir, f"job-{job_id}.log")
+                log = self._jobs[job_id] = SpooledLog(path, self.ring_size, active=False)
+            return log
+
+    def on_job_event(self, job, kind, data):
+        if kind == "state":
+            log = self._jobs.get(job.id)
+            if log is not None:
+                log.set_active(data in (RUNNING, POSTPROCESSING))
+            return
+        if kind != "log":
+            return
+        log = self.job_log(job.id)
+        log.set_active(job.state in (RUNNING, POSTPROCESSING))
+        log.append(data)
+        self.combined.append(f"[#{job.id}] {data}")
+
+    def drop(self, job_id):
+        """Forget the log of a removed job (the file stays in the session folder)."""
+        with self._lock:
+            log = self._jobs.pop(job_id, None)
+        if log is not None:
+            log.close()
+
+    def close(self):
+        self.combined.close()
+        with self._lock:
+            for log in self._jobs.values():
+                log.close()
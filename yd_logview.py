@@ -0,0 +1,166 @@
+import bisect
+import tkinter as tk
+from tkinter import ttk, font as tkfont
+
+from yd_log import FilteredLog
+
+
+class LogViewer(ttk.Frame):
+    """
+    Virtualized viewer for a SpooledLog (or FilteredLog).
+    The Text widget only ever holds the lines that fit on screen; scrolling
+    pages the right window in from the log's ring or file. While "Follow" is
+    on, refresh() keeps the view pinned to the newest lines.
+    """
+
+    def __init__(self, master, log, **kwargs):
+        super().__init__(master, **kwargs)
+        self.log = log
+        self.source = log
+        self.top = 0
+        self.rows = 12
+        self.follow = tk.IntVar(value=1)
+        self.search_var = tk.StringVar()
+        self._last_len = -1
+        self._query = ""
+
+        # search / filter toolbar
+        bar = ttk.Frame(self)
+        bar.pack(fill="x", pady=(0, 4))
+        entry = ttk.Entry(bar, textvariable=self.search_var, width=30)
+        entry.pack(side="left", padx=(0, 6), fill="x", expand=True)
+        entry.bind("<Return>", lambda e: self.find_next())
+        ttk.Button(bar, text="Find", bootstyle="info-outline", command=self.find_next).pack(side="left", padx=(0, 4))
+        ttk.Button(bar, text="Filter", bootstyle="info-outline", command=self.apply_filter).pack(side="left", padx=(0, 4))
+        ttk.Button(bar, text="Clear", bootstyle="light", command=self.clear_filter).pack(side="left", padx=(0, 8))
+        ttk.Checkbutton(bar, text="Follow", variable=self.follow, bootstyle="round-toggle", command=self._render).pack(side="left")
+        self.info_label = ttk.Label(bar, text="", font=("TkDefaultFont", 8))
+        self.info_label.pack(side="right")
+
+        body = ttk.Frame(self)
+        body.pack(fill="both", expand=True)
+        self.scrollbar = ttk.Scrollbar(body, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.font = tkfont.Font(family="Courier", size=8)
+        self.text = tk.Text(body, height=12, width=85, font=self.font, wrap="none")
+        self.text.pack(side="left", fill="both", expand=True)
+        self.text.tag_configure("hit", background="#fff3a0", foreground="black")
+        self.text.bind("<Configure>", self._on_resize)
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.text.bind(seq, self._on_wheel)
+        # the view is read-only but text stays selectable for copying
+        self.text.bind("<Key>", lambda e: None if (e.state & 4) else "break")
+
+    # ----- source switching -----
+    def set_log(self, log):
+        """Show another SpooledLog (e.g. one job's log instead of the combined one)."""
+        self.log = log
+        self.source = log
+        self._query = ""
+        self.follow.set(1)
+        self._last_len = -1
+        self.refresh()
+
+    def apply_filter(self):
+        """Show only the lines matching the search text (streamed from disk)."""
+        query = self.search_var.get().strip()
+        if not query:
+            self.clear_filter()
+            return
+        hits = self.log.search(query)
+        self.source = FilteredLog(self.log, hits)
+        self._query = query
+        self.follow.set(0)
+        self.top = 0
+        self._render()
+
+    def clear_filter(self):
+        self.source = self.log
+        self._query = ""
+        self.follow.set(1)
+        self.refresh()
+
+    def find_next(self):
+        """Jump to the next line below the top of the view that matches the search text."""
+        query = self.search_var.get().strip()
+        if not query:
+            return
+        self._query = query
+        hits = self.log.search(query)
+        if isinstance(self.source, FilteredLog):
+            # translate log line numbers into positions inside the filtered view
+            wanted = set(hits)
+            hits = [i for i, n in enumerate(self.source.line_numbers) if n in wanted]
+        if not hits:
+            self.info_label.configure(text="no match")
+            return
+        after = bisect.bisect_right(hits, self.top)
+        self.follow.set(0)
+        self.top = hits[after] if after < len(hits) else hits[0]
+        self._render()
+
+    # ----- scrolling -----
+    def _max_top(self):
+        return max(0, len(self.source) - self.rows)
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.source))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.rows if args[2] == "pages" else 1)
+            self.top += step
+        self.follow.set(1 if self.top >= self._max_top() and self.source is self.log else 0)
+        self._render()
+
+    def _on_wheel(self, event):
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            self.top -= 3
+        else:
+            self.top += 3
+        self.follow.set(1 if self.top >= self._max_top() and self.source is self.log else 0)
+        self._render()
+        return "break"
+
+    def _on_resize(self, event):
+        rows = max(1, event.height // max(1, self.font.metrics("linespace")))
+        if rows != self.rows:
+            self.rows = rows
+            self._render()
+
+    # ----- rendering -----
+    def refresh(self):
+        """Call after new lines were appended; re-renders only when needed."""
+        n = len(self.source)
+        if n == self._last_len:
+            return
+        self._last_len = n
+        self._render()
+
+    def _render(self):
+        total = len(self.source)
+        if self.follow.get() and self.source is self.log:
+            self.top = self._max_top()
+        self.top = max(0, min(self.top, self._max_top()))
+        lines = self.source.get_lines(self.top, self.rows)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        if self._query:
+            self._highlight(self._query)
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        shown = f"{self.top + 1:,}-{self.top + len(lines):,} of {total:,}" if lines else "empty"
+        if isinstance(self.source, FilteredLog):
+            shown += f" (filter: {len(self.source):,} of {len(self.log):,} lines)"
+        self.info_label.configure(text=shown)
+
+    def _highlight(self, query):
+        start = "1.0"
+        while True:
+            pos = self.text.search(query, start, stopindex=tk.END, nocase=True)
+            if not pos:
+                break
+            end = f"{pos}+{len(query)}c"
+            self.text.tag_add("hit", pos, end)
+            start = end
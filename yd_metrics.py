@@ -0,0 +1,337 @@
+"""
+Per-job performance metrics.
+A JobQueue listener times the phases of every job:
+
+    queue       waiting for a download slot
+    extract     yt-dlp start until it picked the formats (extraction, format selection)
+    ttfb        formats picked until the first byte arrived
+    download    first byte until the last byte
+    merge       yt-dlp's own post-processing (merge, remux, in-run conversions)
+    convert     the post-processing pool (yd_pipeline)
+
+plus bytes, average and peak throughput, retries and exit codes, summed
+over all runs of the job. Finished, failed and cancelled jobs are stored in
+a SQLite history (Necessary/metrics.sqlite). summary() aggregates it into
+percentiles per format and quality, exported as JSON or as Prometheus text.
+"""
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+
+from yd_jobs import QUEUED, RUNNING, FINISHED, FAILED, CANCELLED, POSTPROCESSING, job_source
+from yd_progress import POSTPROCESS
+from yd_units import format_rate
+
+
+PHASES = ("queue", "extract", "ttfb", "download", "merge", "convert")
+QUANTILES = (0.5, 0.9, 0.99)
+# peak throughput is the best rate over windows of at least this many seconds
+PEAK_WINDOW = 1.0
+# history rows kept; older ones are pruned
+MAX_ROWS = 20000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_metrics (
+    uid TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    format TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    exit_codes TEXT NOT NULL,
+    retries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    queue REAL, extract REAL, ttfb REAL, download REAL, merge REAL, convert REAL,
+    total REAL NOT NULL,
+    avg_bps REAL,
+    peak_bps REAL,
+    finished_at REAL NOT NULL,
+    policy TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS job_metrics_finished ON job_metrics(finished_at);
+"""
+
+_COLUMNS = ("uid", "url", "format", "quality", "engine", "outcome", "exit_codes", "retries", "bytes") \
+    + PHASES + ("total", "avg_bps", "peak_bps", "finished_at", "policy", "source")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(1, math.ceil(q * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+class _Timing:
+    # live measurements of one job while it is in the queue
+    def __init__(self, now, retries_left):
+        self.created = now
+        self.retries_left = retries_left
+        self.queued = now
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.seen = set()
+        self.exit_codes = []
+        self.peak = 0.0
+        self.run = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] += max(0.0, seconds)
+        self.seen.add(phase)
+
+
+class _Run:
+    # one run (yt-dlp process) of a job
+    def __init__(self, now, transferred):
+        self.start = now
+        self.base = transferred
+        # extracted: yt-dlp picked the formats ("Downloading N format(s)") and starts downloading
+        self.extracted = None
+        self.first_event = None
+        self.first_byte = None
+        self.last_byte = None
+        self.merge_start = None
+        # mark: (time, bytes) where the current peak window started
+        self.mark = (now, transferred)
+
+
+class JobMetrics:
+    """
+    Use on_job_event as a JobQueue listener. Thread-safe; completed jobs are
+    written to the history database at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._live = {}
+        self._convert_start = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # histories written before the scheduling columns existed
+        have = {r[1] for r in self._db.execute("PRAGMA table_info(job_metrics)")}
+        for column in ("policy", "source"):
+            if column not in have:
+                self._db.execute(f"ALTER TABLE job_metrics ADD COLUMN {column} TEXT")
+        self._db.commit()
+        # policy: name of the scheduling policy, recorded with every job (see yd_scheduling)
+        self.policy = "fifo"
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ----- listener -----
+    def on_job_event(self, job, kind, data):
+        if kind == "log" and not data.startswith("[info] "):
+            return
+        now = time.monotonic()
+        with self._lock:
+            t = self._live.get(job.id)
+            if t is None:
+                t = self._live[job.id] = _Timing(now, job.retries_left)
+            if kind == "log":
+                if t.run and t.run.extracted is None and "format(s)" in data:
+                    t.run.extracted = now
+                    t.add("extract", now - t.run.start)
+            elif kind == "state":
+                self._on_state(job, t, data, now)
+            elif kind == "progress" and t.run:
+                self._on_progress(job, t, now)
+            elif kind == "stage" and t.run and data == POSTPROCESS:
+                self._end_download(t, now)
+                t.run.merge_start = now
+
+    def _on_state(self, job, t, state, now):
+        if t.run and state != RUNNING:
+            self._end_run(job, t, state, now)
+        if state == QUEUED:
+            t.queued = now
+        elif state == RUNNING:
+            t.add("queue", now - t.queued)
+            t.run = _Run(now, job.transferred)
+        elif state == POSTPROCESSING:
+            self._convert_start[job.id] = now
+        if state in (FINISHED, FAILED) and job.id in self._convert_start:
+            t.add("convert", now - self._convert_start.pop(job.id))
+        if state in (FINISHED, FAILED, CANCELLED):
+            self._store(job, t, state, now)
+            del self._live[job.id]
+            self._convert_start.pop(job.id, None)
+
+    def _on_progress(self, job, t, now):
+        run = t.run
+        if run.first_event is None:
+            run.first_event = now
+            if run.extracted is None:
+                # no format line (e.g. a generic extractor): extraction lasted until now
+                run.extracted = now
+                t.add("extract", now - run.start)
+        if job.transferred > run.base:
+            if run.first_byte is None:
+                run.first_byte = now
+                run.mark = (now, job.transferred)
+                t.add("ttfb", now - run.extracted)
+            run.last_byte = now
+        mark_t, mark_b = run.mark
+        if now - mark_t >= PEAK_WINDOW:
+            t.peak = max(t.peak, (job.transferred - mark_b) / (now - mark_t))
+            run.mark = (now, job.transferred)
+
+    def _end_download(self, t, now):
+        run = t.run
+        if run.first_byte is not None and run.merge_start is None:
+            t.add("download", (run.last_byte or now) - run.first_byte)
+
+    def _end_run(self, job, t, state, now):
+        # a run ended: finished, failed, paused, cancelled or re-queued
+        run = t.run
+        if run.merge_start is None:
+            self._end_download(t, now)
+        else:
+            t.add("merge", now - run.merge_start)
+        # paused / cancelled runs are stopped before their exit code is known
+        if state in (FINISHED, FAILED, POSTPROCESSING, QUEUED) and job.returncode is not None:
+            t.exit_codes.append(job.returncode)
+        t.run = None
+
+    # ----- history -----
+    def _store(self, job, t, outcome, now):
+        opts = job.options or {}
+        fmt = opts.get("format") or job.fmt
+        quality = "" if fmt in ("mp3", "wav") else str(opts.get("quality") or "")
+        download = t.phases["download"]
+        avg = job.transferred / download if download > 0 else None
+        row = {
+            "uid": job.uid, "url": job.url, "format": fmt, "quality": quality,
+            "engine": job.engine, "outcome": outcome,
+            "exit_codes": ",".join("-" if c is None else str(c) for c in t.exit_codes),
+            "retries": max(0, t.retries_left - job.retries_left), "bytes": int(job.transferred),
+            "total": now - t.created,
+            "avg_bps": avg,
+            # downloads shorter than PEAK_WINDOW only have their average
+            "peak_bps": max(t.peak, avg or 0) or None,
+            "finished_at": time.time(),
+            "policy": self.policy,
+            "source": job_source(job),
+        }
+        for phase in PHASES:
+            row[phase] = t.phases[phase] if phase in t.seen else None
+        try:
+            self._db.execute(f"INSERT OR REPLACE INTO job_metrics VALUES ({', '.join('?' * len(_COLUMNS))})",
+                             [row[c] for c in _COLUMNS])
+            count = self._db.execute("SELECT COUNT(*) FROM job_metrics").fetchone()[0]
+            if count > MAX_ROWS:
+                self._db.execute("DELETE FROM job_metrics WHERE uid IN "
+                                 "(SELECT uid FROM job_metrics ORDER BY finished_at LIMIT ?)", (count - MAX_ROWS,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            print("Metrics error:", e)
+
+    def rows(self, since=None):
+        """History rows (dicts), oldest first; since is a time.time() value."""
+        with self._lock:
+            cur = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM job_metrics WHERE finished_at >= ? ORDER BY finished_at",
+                                   (since or 0,))
+            return [dict(zip(_COLUMNS, r)) for r in cur]
+
+    def summary(self, since=None):
+        """
+        Aggregates per (format, quality): job counts by outcome and the
+        QUANTILES of every phase, the total time and the throughput of the
+        finished jobs. Returns a list of dicts sorted by format and quality.
+        """
+        groups = {}
+        for r in self.rows(since):
+            groups.setdefault((r["format"], r["quality"]), []).append(r)
+        out = []
+        for (fmt, quality), rows in sorted(groups.items()):
+            done = [r for r in rows if r["outcome"] == FINISHED]
+            entry = {
+                "format": fmt,
+                "quality": quality,
+                "jobs": len(rows),
+                "finished": len(done),
+                "failed": sum(1 for r in rows if r["outcome"] == FAILED),
+                "cancelled": sum(1 for r in rows if r["outcome"] == CANCELLED),
+                "retries": sum(r["retries"] for r in rows),
+                "bytes": sum(r["bytes"] for r in done),
+                "quantiles": {},
+            }
+            for field in PHASES + ("total", "avg_bps", "peak_bps"):
+                values = [r[field] for r in done]
+                entry["quantiles"][field] = {str(q): percentile(values, q) for q in QUANTILES}
+            out.append(entry)
+        return out
+
+    # ----- export -----
+    def export_json(self, path, since=None):
+        """Write summary() and the live job count as JSON to path."""
+        data = {"generated_at": time.time(), "live_jobs": self.live_count(), "groups": self.summary(since)}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    def prometheus_text(self, since=None):
+        """summary() in the Prometheus text exposition format (summaries with quantile labels)."""
+        lines = [
+            "# HELP yd_jobs_total Jobs in the history by outcome.",
+            "# TYPE yd_jobs_total counter",
+        ]
+        summary = self.summary(since)
+        for g in summary:
+            labels = f'format="{g["format"]}",quality="{g["quality"]}"'
+            for outcome in (FINISHED, FAILED, CANCELLED):
+                lines.append(f'yd_jobs_total{{{labels},outcome="{outcome}"}} {g[outcome]}')
+        lines += ["# HELP yd_job_retries_total Automatic retries.", "# TYPE yd_job_retries_total counter"]
+        lines += [f'yd_job_retries_total{{format="{g["format"]}",quality="{g["quality"]}"}} {g["retries"]}' for g in summary]
+        lines += ["# HELP yd_downloaded_bytes_total Bytes downloaded by finished jobs.", "# TYPE yd_downloaded_bytes_total counter"]
+        lines += [f'yd_downloaded_bytes_total{{format="{g["format"]}",quality="{g["quality"]}"}} {g["bytes"]}' for g in summary]
+        metrics = [("yd_job_phase_seconds", "Time per job phase of finished jobs.", PHASES + ("total",)),
+                   ("yd_job_throughput_bytes_per_second", "Average download rate of finished jobs.", ("avg_bps",)),
+                   ("yd_job_peak_throughput_bytes_per_second", "Peak download rate of finished jobs.", ("peak_bps",))]
+        for name, help_text, fields in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+            for g in summary:
+                for field in fields:
+                    labels = f'format="{g["format"]}",quality="{g["quality"]}"'
+                    if name == "yd_job_phase_seconds":
+                        labels += f',phase="{field}"'
+                    for q, value in g["quantiles"][field].items():
+                        if value is not None:
+                            lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6g}')
+        return "\n".join(lines) + "\n"
+
+    def live_count(self):
+        """Jobs currently being measured."""
+        return len(self._live)
+
+
+def summary_table(summary):
+    """Plain-text table of summary() (median / p90) for the CLI and the stats view."""
+    header = ("format", "jobs", "ok", "fail", "total p50/p90", "ttfb p50", "download p50", "convert p50", "rate p50", "peak p90")
+    rows = [header]
+
+    def sec(v):
+        return "-" if v is None else f"{v:.1f}s"
+
+    for g in summary:
+        q = g["quantiles"]
+        name = g["format"] + (f" {g['quality']}p" if g["quality"] else "")
+        rows.append((
+            name, str(g["jobs"]), str(g["finished"]), str(g["failed"]),
+            f"{sec(q['total']['0.5'])}/{sec(q['total']['0.9'])}",
+            sec(q["ttfb"]["0.5"]), sec(q["download"]["0.5"]), sec(q["convert"]["0.5"]),
+            format_rate(q["avg_bps"]["0.5"]), format_rate(q["peak_bps"]["0.9"]),
+        ))
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    return "\n".join("  ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip() for r in rows)
@@ -0,0 +1,385 @@
+"""
+Post-processing stage of the download pipeline.
+Audio extraction and video re-encodes run on a pool of ffmpeg workers that
+is separate from the download slots: yt-dlp only downloads (merging and
+remuxing are stream copies and stay with it), then hands the finished file
+over, and its slot starts the next download while ffmpeg converts this one.
+StageMeter samples how busy both stages are to show which one is the
+bottleneck.
+"""
+import os
+import re
+import time
+import threading
+import itertools
+import subprocess
+from collections import deque
+
+from yd_jobs import popen_kwargs
+
+
+UTIL_WINDOW = 60
+PROGRESS_EVERY = 0.5
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def post_step(opts):
+    """
+    The CPU-heavy conversion an options snapshot asks for, or None:
+    {"kind": "audio", "ext": "mp3" / "wav"} or {"kind": "video", "ext": "mov" / "mp4"},
+    the latter with "video": "copy" when only the audio needs re-encoding.
+    Steps of local jobs may also name the output ("base"), copy the audio
+    ("audio": "copy") and mux in subtitle files ("subtitle_files"), see
+    yd_streamstore.
+    """
+    fmt = opts.get("format")
+    plan = opts.get("format_plan")
+    if plan and fmt not in ("mp3", "wav"):
+        # the planner picked streams that only need a stream copy (done by
+        # yt-dlp) or an audio re-encode with the video copied
+        if plan["action"] == "audio":
+            return {"kind": "video", "ext": fmt, "video": "copy"}
+        if plan["action"] != "encode":
+            return None
+    if fmt in ("mp3", "wav"):
+        return {"kind": "audio", "ext": fmt}
+    if fmt == "mov":
+        return {"kind": "video", "ext": "mov"}
+    if fmt == "mp4" and opts.get("recode_mp4") and not opts.get("remux_mp4"):
+        return {"kind": "video", "ext": "mp4"}
+    return None
+
+
+def ffmpeg_command(ffmpeg_path, step, src, dst, threads=0):
+    """ffmpeg arguments for one conversion, with machine-readable progress on stdout."""
+    cmd = [ffmpeg_path, "-y", "-nostdin", "-hide_banner", "-i", src]
+    subs = (step.get("subtitle_files") or []) if step["kind"] == "video" else []
+    for path in subs:
+        cmd.extend(["-i", path])
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    if step["kind"] == "audio":
+        cmd.extend(["-vn", "-sn"])
+        if step["ext"] == "mp3":
+            # same as yt-dlp's --extract-audio default quality
+            cmd.extend(["-c:a", "libmp3lame", "-q:a", "5"])
+        else:
+            cmd.extend(["-c:a", "pcm_s16le"])
+    else:
+        # ffmpeg's defaults for mp4/mov (H.264 + AAC) like --recode-video;
+        # subtitles embedded during the download are carried over
+        vcodec = "copy" if step.get("video") == "copy" else "libx264"
+        acodec = "copy" if step.get("audio") == "copy" else "aac"
+        cmd.extend(["-map", "0:v?", "-map", "0:a?"])
+        # fetched subtitle files (<name>.<lang>.srt) first, so their language tags line up
+        for i, path in enumerate(subs):
+            lang = os.path.splitext(os.path.splitext(path)[0])[1].lstrip(".")
+            cmd.extend(["-map", f"{i + 1}:s"] + ([f"-metadata:s:s:{i}", f"language={lang}"] if lang else []))
+        scodec = "webvtt" if step["ext"] == "webm" else "mov_text"
+        cmd.extend(["-map", "0:s?", "-c:v", vcodec, "-c:a", acodec, "-c:s", scodec])
+    cmd.extend(["-progress", "pipe:1", "-nostats", dst])
+    return cmd
+
+
+def rewrite_manifest(path, renames):
+    """Replace converted source paths by their outputs in a yt-dlp after_move manifest."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        out = []
+        for line in lines:
+            parts = line.split("\t", 2)
+            if len(parts) == 3 and parts[2] in renames:
+                parts[2] = renames[parts[2]]
+            out.append("\t".join(parts))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(out) + ("\n" if out else ""))
+    except OSError:
+        pass
+
+
+def manifest_files(path):
+    """Final file paths listed in an after_move manifest (existing files only)."""
+    files = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 2)
+                if len(parts) == 3 and os.path.exists(parts[2]) and parts[2] not in files:
+                    files.append(parts[2])
+    except OSError:
+        pass
+    return files
+
+
+# ---------------- Tasks ----------------
+class PostTask:
+    """One ffmpeg conversion of one downloaded file."""
+    _ids = itertools.count(1)
+
+    def __init__(self, job, src, step):
+        self.id = next(PostTask._ids)
+        self.job = job
+        self.src = src
+        self.step = step
+        base, ext = os.path.splitext(src)
+        # "base": output path without extension when it is not the source's (yd_streamstore)
+        self.dst = f"{step.get('base') or base}.{step['ext']}"
+        # converting into the same name goes through a temp file like yt-dlp does
+        self.out = f"{base}.temp.{step['ext']}" if self.dst == src else self.dst
+        self.state = "queued"
+        self.progress = 0.0
+        self.duration = None
+        self.proc = None
+        self.cancelled = False
+        self.error = ""
+        self.queued_at = time.time()
+        self.started = None
+        self.ended = None
+
+
+class PostProcessPool:
+    """
+    Converts the files of jobs handed over by a JobQueue (install it as
+    job_queue.post_processor) on `workers` parallel ffmpeg processes, by
+    default one per CPU core. A lone task gets all cores; once the pool is
+    full every ffmpeg runs single-threaded so they do not fight for them.
+    """
+
+    def __init__(self, job_queue, ffmpeg_path, workers=0):
+        self.job_queue = job_queue
+        self.ffmpeg_path = ffmpeg_path
+        self.workers = 1
+        self.completed = 0
+        self.failed = 0
+        self._pending = deque()
+        self._tasks = {}
+        self._running = set()
+        self._threads = {}
+        self._cond = threading.Condition()
+        self.set_workers(workers)
+
+    def set_workers(self, n):
+        """Resize the pool (0 = one worker per CPU core)."""
+        with self._cond:
+            self.workers = max(1, int(n or os.cpu_count() or 1))
+            for slot in range(self.workers):
+                if slot not in self._threads:
+                    t = threading.Thread(target=self._worker, args=(slot,), daemon=True)
+                    self._threads[slot] = t
+                    t.start()
+            self._cond.notify_all()
+
+    # ----- counters -----
+    def busy(self):
+        return len(self._running)
+
+    def waiting(self):
+        return len(self._pending)
+
+    # ----- JobQueue hand-over -----
+    def submit(self, job):
+        """Queue the conversions of a downloaded job (called by JobQueue)."""
+        step = job.options.get("post_step")
+        files = manifest_files(job.options.get("manifest", "")) if step else []
+        # a file that already has the target format needs no conversion
+        tasks = [PostTask(job, src, step) for src in files
+                 if step["kind"] == "video" or not src.endswith("." + step["ext"])]
+        if not tasks:
+            if files or not step:
+                self.job_queue.finish_post(job)
+            else:
+                self.job_queue.finish_post(job, "no downloaded file found to convert")
+            return
+        job.post_progress = 0.0
+        with self._cond:
+            self._tasks[job.id] = tasks
+            self._pending.extend(tasks)
+            self._cond.notify_all()
+        self.job_queue.log(job, f"Queued {len(tasks)} file(s) for conversion to {step['ext']} ({self.waiting()} waiting)")
+
+    def cancel(self, job):
+        """Drop queued conversions of job and stop running ones."""
+        with self._cond:
+            tasks = self._tasks.pop(job.id, [])
+            for task in tasks:
+                task.cancelled = True
+                if task in self._pending:
+                    self._pending.remove(task)
+        for task in tasks:
+            if task.proc:
+                self.job_queue.reaper.stop(task.proc, kill=True)
+
+    # ----- workers -----
+    def _worker(self, slot):
+        while True:
+            with self._cond:
+                while not self._pending and slot < self.workers:
+                    self._cond.wait()
+                if slot >= self.workers:
+                    del self._threads[slot]
+                    return
+                task = self._pending.popleft()
+                self._running.add(task.id)
+                threads = 0 if len(self._running) == 1 and not self._pending else 1
+            try:
+                self._convert(task, threads)
+            except Exception as e:
+                task.error = str(e)
+            finally:
+                with self._cond:
+                    self._running.discard(task.id)
+                self._task_done(task)
+
+    def _convert(self, task, threads):
+        job = task.job
+        task.state = "running"
+        task.started = time.time()
+        self.job_queue.log(job, f"[convert] {os.path.basename(task.src)} -> {task.step['ext']}")
+        cmd = ffmpeg_command(self.ffmpeg_path, task.step, task.src, task.out, threads)
+        task.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     text=True, encoding="utf-8", errors="replace", **popen_kwargs(group=True))
+        if task.cancelled:
+            self.job_queue.reaper.stop(task.proc, kill=True)
+        errors = deque(maxlen=5)
+
+        def read_stderr(proc):
+            for line in proc.stderr:
+                if task.duration is None:
+                    m = _DURATION.search(line)
+                    if m:
+                        h, mi, s = m.groups()
+                        task.duration = int(h) * 3600 + int(mi) * 60 + float(s)
+                if line.strip():
+                    errors.append(line.strip())
+
+        reader = threading.Thread(target=read_stderr, args=(task.proc,), daemon=True)
+        reader.start()
+        last = 0
+        for line in task.proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and task.duration and value.isdigit():
+                task.progress = min(100.0, int(value) / 1e6 * 100.0 / task.duration)
+                if time.monotonic() - last >= PROGRESS_EVERY:
+                    last = time.monotonic()
+                    self._report(job)
+        returncode = task.proc.wait()
+        reader.join(timeout=1)
+        task.proc = None
+        if task.cancelled:
+            self._remove(task.out)
+            return
+        if returncode != 0:
+            task.error = errors[-1] if errors else f"ffmpeg failed with code {returncode}"
+            self._remove(task.out)
+            return
+        try:
+            written = os.path.getsize(task.out)
+        except OSError:
+            written = 0
+        if not written:
+            # exit code 0 without output: keep the source, do not report success
+            task.error = errors[-1] if errors else "ffmpeg wrote no output"
+            self._remove(task.out)
+            return
+        if task.out != task.dst:
+            os.replace(task.out, task.dst)
+        elif task.src != task.dst:
+            self._remove(task.src)
+        # muxed in now, like yt-dlp's --embed-subs
+        for path in task.step.get("subtitle_files") or []:
+            self._remove(path)
+        task.progress = 100.0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _report(self, job):
+        tasks = self._tasks.get(job.id)
+        if tasks:
+            job.post_progress = sum(t.progress for t in tasks) / len(tasks)
+            self.job_queue.notify(job, "progress", job.progress)
+
+    def _task_done(self, task):
+        task.ended = time.time()
+        job = task.job
+        if task.cancelled:
+            task.state = "cancelled"
+            return
+        task.state = "failed" if task.error else "done"
+        if task.error:
+            self.failed += 1
+            self.job_queue.log(job, f"ERROR: conversion of {os.path.basename(task.src)} failed: {task.error}")
+        else:
+            self.completed += 1
+            self.job_queue.log(job, f"[convert] done in {task.ended - task.started:.1f}s "
+                                    f"(waited {task.started - task.queued_at:.1f}s): {os.path.basename(task.dst)}")
+        with self._cond:
+            tasks = self._tasks.get(job.id, [])
+            if any(t.state in ("queued", "running") for t in tasks):
+                self._report(job)
+                return
+            self._tasks.pop(job.id, None)
+        rewrite_manifest(job.options.get("manifest", ""), {t.src: t.dst for t in tasks if t.state == "done"})
+        failed = [t for t in tasks if t.state == "failed"]
+        job.post_progress = 100.0
+        self.job_queue.finish_post(job, failed[0].error if failed else None)
+
+
+# ---------------- Utilization ----------------
+class StageMeter:
+    """
+    Samples every pipeline stage once a second; stages maps a name to a
+    function returning (busy, capacity, waiting). utilization() averages the
+    busy fraction over the last `window` seconds.
+    """
+
+    def __init__(self, stages, window=UTIL_WINDOW, interval=1.0):
+        self.stages = dict(stages)
+        self.interval = interval
+        self._samples = {name: deque(maxlen=max(1, int(window / interval))) for name in self.stages}
+        self._last = {}
+        self._sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        for name, fn in self.stages.items():
+            try:
+                busy, capacity, waiting = fn()
+            except Exception:
+                continue
+            self._samples[name].append(busy / capacity if capacity else 0.0)
+            self._last[name] = (capacity, waiting)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self._sample()
+
+    def utilization(self):
+        """{stage: (average busy fraction, capacity, waiting)}."""
+        out = {}
+        for name, samples in self._samples.items():
+            capacity, waiting = self._last.get(name, (0, 0))
+            out[name] = (sum(samples) / len(samples) if samples else 0.0, capacity, waiting)
+        return out
+
+    def report(self):
+        """One line like "download 100% of 3 (4 waiting) · convert 25% of 8" naming the bottleneck."""
+        util = self.utilization()
+        parts = []
+        for name, (frac, capacity, waiting) in util.items():
+            text = f"{name} {frac * 100:.0f}% of {capacity}"
+            if waiting:
+                text += f" ({waiting} waiting)"
+            parts.append(text)
+        busiest = max(util.items(), key=lambda kv: (kv[1][0], kv[1][2]), default=None)
+        line = " · ".join(parts)
+        if busiest and busiest[1][0] >= 0.9 and busiest[1][2]:
+            line += f" → bottleneck: {busiest[0]}"
+        return line
@@ -0,0 +1,230 @@
+"""
+Transcode-avoidance format planner.
+The fixed format strings of format_selector pick the "best" streams and
+leave it to --recode-video to make them fit the container, so a MOV or a
+re-encoded MP4 always pays for a full encode. The planner looks at the
+cached format list of the video instead and, among the streams at the best
+available height under the quality cap, picks the combination that needs
+the least CPU to become the requested container:
+
+    copy    streams already in the target container (merging is a stream copy)
+    remux   compatible codecs in another container, rewritten with -c copy
+    audio   video stream copied, only the audio re-encoded
+    encode  full video re-encode (what --recode-video does)
+
+The plan is stored in the job options (format_plan), so it is journaled and
+a resumed job keeps it; build_command / build_ydl_opts / yd_pipeline turn
+it into flags.
+"""
+import os
+import time
+
+from yd_cache import _is_audio_only, _is_video_only
+
+
+COPY = "copy"
+REMUX = "remux"
+AUDIO = "audio"
+ENCODE = "encode"
+
+# rough CPU seconds per second of media on a desktop CPU; encode is for
+# 1080p with ffmpeg's default x264 preset and scales with the pixel count
+CPU_COST = {COPY: 0.002, REMUX: 0.004, AUDIO: 0.03, ENCODE: 0.6}
+FULL_HD = 1920 * 1080
+
+# codecs ffmpeg can stream-copy into each container, and the file extensions
+# that already are that container
+CONTAINERS = {
+    "mp4": {"video": {"avc1", "hevc", "av01", "vp09"}, "audio": {"mp4a", "mp3", "opus", "ac-3", "ec-3", "flac"}, "ext": {"mp4", "m4a"}},
+    "mov": {"video": {"avc1", "hevc", "mp4v", "prores"}, "audio": {"mp4a", "mp3", "alac", "pcm"}, "ext": {"mov"}},
+    "webm": {"video": {"vp8", "vp09", "av01"}, "audio": {"opus", "vorbis"}, "ext": {"webm"}},
+}
+
+_ALIASES = {
+    "h264": "avc1", "avc": "avc1", "avc3": "avc1", "hev1": "hevc", "hvc1": "hevc", "h265": "hevc",
+    "vp9": "vp09", "av1": "av01", "aac": "mp4a", "ac3": "ac-3", "eac3": "ec-3",
+    "apch": "prores", "apcn": "prores", "apcs": "prores", "apco": "prores", "ap4h": "prores",
+}
+
+# metadata lookups for a plan wait at most this long
+FETCH_TIMEOUT = 20
+
+
+def codec_family(codec):
+    """'avc1.640028' -> 'avc1', 'vp9' -> 'vp09', 'none' / None -> None."""
+    if not codec or codec == "none":
+        return None
+    name = codec.split(".", 1)[0].lower()
+    if name.startswith("pcm"):
+        return "pcm"
+    return _ALIASES.get(name, name)
+
+
+def allowed_actions(opts):
+    """
+    Plans the user's conversion settings allow. Plain MP4 and WEBM never
+    convert, so only the stream-copy plans are open to them.
+    """
+    fmt = opts.get("format")
+    if fmt in ("mp3", "wav"):
+        return (COPY, AUDIO)
+    if fmt == "mov":
+        return (COPY, REMUX, AUDIO, ENCODE)
+    if fmt == "mp4":
+        if opts.get("recode_mp4"):
+            return (COPY, REMUX, AUDIO, ENCODE)
+        if opts.get("remux_mp4"):
+            return (COPY, REMUX)
+        return (COPY,)
+    if fmt == "webm":
+        return (COPY, REMUX)
+    return ()
+
+
+def _action(target, video, audio):
+    # cheapest way to turn one candidate (video and/or audio format) into target
+    if target in ("mp3", "wav"):
+        if target == "mp3" and codec_family(audio.get("acodec")) == "mp3":
+            return COPY
+        return AUDIO
+    spec = CONTAINERS[target]
+    vcodec = codec_family(video.get("vcodec"))
+    acodec = codec_family((audio or video).get("acodec"))
+    if vcodec not in spec["video"]:
+        return ENCODE
+    if acodec and acodec not in spec["audio"]:
+        return AUDIO
+    exts = {video.get("ext")} | ({audio.get("ext")} if audio else set())
+    return COPY if exts <= spec["ext"] else REMUX
+
+
+def _cost(action, video, duration):
+    per_second = CPU_COST[action]
+    if action == ENCODE and video:
+        pixels = (video.get("width") or (video.get("height") or 1080) * 16 // 9) * (video.get("height") or 1080)
+        per_second *= max(0.1, pixels / FULL_HD)
+    return per_second * (duration or 0)
+
+
+def _describe(f):
+    if _is_audio_only(f):
+        return f"{f['format_id']} ({codec_family(f.get('acodec'))} {f.get('ext')})"
+    return f"{f['format_id']} ({codec_family(f.get('vcodec'))} {f.get('height') or '?'}p {f.get('ext')})"
+
+
+def plan_formats(info, opts):
+    """
+    The cheapest plan for an options snapshot from a cached metadata entry
+    (see MetadataCache.get), or None when the formats are unknown or no plan
+    fits the allowed actions (the fixed format strings are used then).
+    A plan is a dict: action, selector, container, cost (estimated CPU
+    seconds), encode_cost (what a full re-encode would take, if the settings
+    allow one) and summary.
+    """
+    target = opts.get("format")
+    allowed = allowed_actions(opts)
+    formats = [f for f in (info or {}).get("formats") or [] if f.get("format_id")]
+    if not allowed or not formats:
+        return None
+    duration = info.get("duration")
+    audio = [f for f in formats if _is_audio_only(f)]
+
+    candidates = []
+    if target in ("mp3", "wav"):
+        candidates = [(None, a) for a in audio]
+    else:
+        try:
+            cap = int(opts.get("quality"))
+        except (TypeError, ValueError):
+            cap = 100000
+        video = [f for f in formats if (f.get("height") or 0) <= cap and f.get("vcodec") not in (None, "none")]
+        if not video:
+            return None
+        # never trade resolution for CPU: only streams at the best height compete
+        best_height = max(f.get("height") or 0 for f in video)
+        for v in video:
+            if (v.get("height") or 0) != best_height:
+                continue
+            if _is_video_only(v):
+                candidates.extend((v, a) for a in audio)
+            else:
+                candidates.append((v, None))
+
+    best = None
+    for v, a in candidates:
+        action = _action(target, v, a)
+        if action not in allowed:
+            continue
+        rate = ((v or {}).get("tbr") or 0) + ((a or {}).get("abr") or (a or {}).get("tbr") or 0)
+        rank = (CPU_COST[action], -rate)
+        if best is None or rank < best[0]:
+            best = (rank, action, v, a)
+    if best is None:
+        return None
+
+    _, action, v, a = best
+    picked = [f for f in (v, a) if f]
+    return {
+        "action": action,
+        "selector": "+".join(f["format_id"] for f in picked),
+        "container": target,
+        "cost": round(_cost(action, v, duration), 2),
+        # what the fixed format strings would cost (None when they never encode)
+        "encode_cost": round(_cost(ENCODE, v, duration), 2) if v and ENCODE in allowed else None,
+        "summary": " + ".join(_describe(f) for f in picked),
+    }
+
+
+def plan_text(plan):
+    """Log line for a plan."""
+    text = f"[plan] {plan['action']}: {plan['summary']} -> {plan['container']}, est. CPU ~{plan['cost']:.1f}s"
+    if plan["encode_cost"] and plan["action"] != ENCODE:
+        text += f" (re-encoding would take ~{plan['encode_cost']:.0f}s)"
+    return text
+
+
+# ---------------- Start hook ----------------
+class FormatPlanner:
+    """
+    JobQueue start hook (install with job_queue.add_start_hook(planner.before_start)).
+    Plans every job once, on its worker thread right before the first run.
+    The format list comes from the metadata cache; on a miss it is fetched
+    (one `yt-dlp --dump-json`) only when the fixed strings would re-encode
+    the video, since the plan cannot save anything otherwise. Resumed jobs
+    that pinned their formats keep them.
+    """
+
+    def __init__(self, job_queue, metadata_cache, yt_dlp_path, post_step=None):
+        self.job_queue = job_queue
+        self.metadata_cache = metadata_cache
+        self.yt_dlp_path = yt_dlp_path
+        # post_step(opts) of yd_pipeline, to hand the plan's conversion to the pool
+        self.post_step = post_step
+        self.enabled = True
+
+    def before_start(self, job):
+        opts = job.options
+        if not self.enabled or not opts or "format_plan" in opts or opts.get("format_pin"):
+            return
+        started = time.monotonic()
+        info = self.metadata_cache.get(opts["url"])
+        if info is None and self._would_encode(opts) and os.path.exists(self.yt_dlp_path):
+            extra = ["--no-playlist"]
+            if opts.get("proxy"):
+                extra.extend(["--proxy", opts["proxy"]])
+            entries = self.metadata_cache.fetch(opts["url"], self.yt_dlp_path, timeout=FETCH_TIMEOUT, extra_args=extra)
+            info = entries[0] if len(entries) == 1 else None
+        plan = plan_formats(info, opts)
+        # planned once; None means the fixed format strings stay in use
+        opts["format_plan"] = plan
+        if plan is None:
+            if info is not None:
+                self.job_queue.log(job, "[plan] no cheaper streams than the default selection")
+            return
+        if "post_step" in opts and self.post_step:
+            opts["post_step"] = self.post_step(opts)
+        self.job_queue.log(job, f"{plan_text(plan)} (planned in {time.monotonic() - started:.1f}s)")
+
+    def _would_encode(self, opts):
+        fmt = opts.get("format")
+        return fmt == "mov" or (fmt == "mp4" and opts.get("recode_mp4") and not opts.get("remux_mp4"))
@@ -0,0 +1,142 @@
+"""
+Streaming playlist expansion.
+Lists a playlist or channel with `yt-dlp --flat-playlist --lazy-playlist -j`
+and turns every entry into its own queued job the moment yt-dlp prints it,
+so the first videos download while a long playlist is still being listed
+and entries spread over all worker slots.
+"""
+import json
+import time
+import uuid
+import threading
+import subprocess
+import itertools
+
+from yd_jobs import popen_kwargs
+
+
+def upload_date(info):
+    """YYYYMMDD of a listing entry, from its date or timestamp fields ("" if none)."""
+    date = info.get("upload_date") or info.get("release_date")
+    if not date:
+        ts = info.get("timestamp") or info.get("release_timestamp")
+        if ts:
+            date = time.strftime("%Y%m%d", time.gmtime(ts))
+    return date or ""
+
+
+class PlaylistExpander:
+    """
+    Expands one playlist URL on a background thread.
+    on_entry(entry) is called for every listed entry with a dict holding
+    "url", "id", "key" ("<extractor>:<id>"), "title", "duration", "index" and
+    "upload_date" (YYYYMMDD, "" when the listing does not say);
+    on_done(expander) when listing has ended. Counters are updated as it goes.
+    error is set when the listing failed without listing anything (an
+    exception, or yt-dlp exiting with an error code): its last stderr line.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, url, yt_dlp_path, on_entry, on_done=None, on_log=None, extra_args=None, uid=None):
+        self.id = next(PlaylistExpander._ids)
+        # uid: stable id across restarts (journal key and Job.group of the entries)
+        self.uid = uid or uuid.uuid4().hex
+        self.url = url
+        self.yt_dlp_path = yt_dlp_path
+        self.on_entry = on_entry
+        self.on_done = on_done
+        self.on_log = on_log or (lambda line: None)
+        self.extra_args = list(extra_args or [])
+        self.listed = 0
+        self.queued = 0
+        self.skipped = 0
+        self.finished = False
+        self.cancelled = False
+        self.error = ""
+        self._last_error = ""
+        self._proc = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop listing; entries that were already queued are left alone."""
+        self.cancelled = True
+        proc = self._proc
+        if proc:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+
+    def _run(self):
+        cmd = [self.yt_dlp_path, "--flat-playlist", "--lazy-playlist", "--dump-json",
+               "--ignore-errors", "--no-warnings", *self.extra_args, self.url]
+        try:
+            self._proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                text=True, encoding="utf-8", errors="replace", **popen_kwargs()
+            )
+            # drain stderr on the side so a chatty yt-dlp never blocks on a full pipe
+            reader = threading.Thread(target=self._read_errors, args=(self._proc,), daemon=True)
+            reader.start()
+            for line in self._proc.stdout:
+                if self.cancelled:
+                    break
+                line = line.strip()
+                if not line.startswith("{"):
+                    continue
+                try:
+                    info = json.loads(line)
+                except ValueError:
+                    continue
+                entry = self._entry(info)
+                if not entry:
+                    continue
+                self.listed += 1
+                try:
+                    self.on_entry(entry)
+                except Exception as e:
+                    self.on_log(f"ERROR: could not queue {entry['url']}: {e}")
+            returncode = self._proc.wait()
+            # the last stderr line is the reason of a failure
+            reader.join(timeout=5)
+            if returncode != 0 and not self.listed and not self.cancelled:
+                self.error = self._last_error or f"yt-dlp exited with code {returncode}"
+                self.on_log(f"ERROR: playlist listing failed (exit code {returncode})")
+        except Exception as e:
+            self.error = str(e)
+            self.on_log(f"ERROR: playlist listing failed: {e}")
+        finally:
+            self._proc = None
+            self.finished = True
+            if self.on_done:
+                self.on_done(self)
+
+    def _read_errors(self, proc):
+        for line in proc.stderr:
+            line = line.rstrip()
+            if line:
+                self._last_error = line
+                self.on_log(line)
+
+    def _entry(self, info):
+        vid = info.get("id")
+        url = info.get("url") or info.get("webpage_url")
+        if not vid or not url:
+            return None
+        extractor = (info.get("ie_key") or info.get("extractor_key") or "generic").lower()
+        if extractor == "youtube" and not url.startswith("http"):
+            url = f"https://www.youtube.com/watch?v={vid}"
+        return {
+            "url": url,
+            "id": vid,
+            "key": f"{extractor}:{vid}",
+            "title": info.get("title") or vid,
+            "duration": info.get("duration"),
+            "index": info.get("playlist_index") or self.listed + 1,
+            "upload_date": upload_date(info),
+        }
@@ -0,0 +1,101 @@
+"""
+Machine-readable progress protocol.
+yt-dlp.exe is run with --newline and a --progress-template that prints one
+prefixed JSON line per progress update, so the subprocess engine no longer
+has to guess numbers out of the human-readable output:
+
+    [yd-progress] {"status": "downloading", "downloaded_bytes": 3072, ...} "137"
+
+parse_progress_line turns such a line into a ProgressEvent; everything else
+is a normal log line. The in-process engine builds the same events from its
+progress hook dicts (from_hook), so the queue handles both engines alike.
+"""
+import json
+
+
+PREFIX = "[yd-progress] "
+
+# progress fields yt-dlp fills in (see its progress_hooks documentation)
+_FIELDS = ("status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta",
+           "fragment_index", "fragment_count", "filename", "tmpfilename")
+
+# stages: what yt-dlp is doing while it reports
+DOWNLOAD = "download"
+POSTPROCESS = "postprocess"
+
+
+def template_args():
+    """yt-dlp arguments that make it print progress in this protocol."""
+    fields = ",".join(_FIELDS)
+    return [
+        "--newline",
+        "--progress-template", f"download:{PREFIX}%(progress.{{{fields}}})j %(info.format_id)j",
+        "--progress-template", f"postprocess:{PREFIX}%(progress.{{status,postprocessor}})j null",
+    ]
+
+
+class ProgressEvent:
+    """
+    One progress update. stage is DOWNLOAD or POSTPROCESS, status yt-dlp's
+    ("downloading", "finished", "started", ...). Byte counts, speed (bytes/s)
+    and eta (seconds) are None when yt-dlp does not know them.
+    """
+    __slots__ = ("stage", "status", "downloaded_bytes", "total_bytes", "speed", "eta",
+                 "fragment_index", "fragment_count", "filename", "format_id", "postprocessor")
+
+    def __init__(self, stage, status, downloaded_bytes=None, total_bytes=None, speed=None, eta=None,
+                 fragment_index=None, fragment_count=None, filename=None, format_id=None, postprocessor=None):
+        self.stage = stage
+        self.status = status
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.speed = speed
+        self.eta = eta
+        self.fragment_index = fragment_index
+        self.fragment_count = fragment_count
+        self.filename = filename
+        self.format_id = format_id
+        self.postprocessor = postprocessor
+
+    @property
+    def percent(self):
+        """Percent of the current file, or None if its size is unknown."""
+        if self.downloaded_bytes is None or not self.total_bytes:
+            return None
+        return min(100.0, self.downloaded_bytes * 100.0 / self.total_bytes)
+
+    def __repr__(self):
+        return f"<ProgressEvent {self.stage} {self.status} {self.downloaded_bytes}/{self.total_bytes}>"
+
+
+def from_hook(d, format_id=None):
+    """ProgressEvent from a yt-dlp progress or postprocessor hook dict."""
+    if d.get("postprocessor"):
+        return ProgressEvent(POSTPROCESS, d.get("status"), postprocessor=d.get("postprocessor"))
+    eta = d.get("eta")
+    return ProgressEvent(
+        DOWNLOAD, d.get("status"),
+        downloaded_bytes=d.get("downloaded_bytes"),
+        total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+        speed=d.get("speed"),
+        eta=int(eta) if eta is not None else None,
+        fragment_index=d.get("fragment_index"),
+        fragment_count=d.get("fragment_count"),
+        filename=d.get("filename"),
+        format_id=format_id,
+    )
+
+
+def parse_progress_line(line):
+    """ProgressEvent for a protocol line, None for any other output line."""
+    if not line.startswith(PREFIX):
+        return None
+    data, _, format_id = line[len(PREFIX):].rpartition(" ")
+    try:
+        d = json.loads(data)
+        format_id = json.loads(format_id)
+    except ValueError:
+        return None
+    if not isinstance(d, dict):
+        return None
+    return from_hook(d, format_id if isinstance(format_id, str) else None)
@@ -0,0 +1,288 @@
+"""
+Proxy pool.
+The proxy setting may list several proxies (separated by commas, spaces or
+new lines). ProxyPool probes each of them in the background (latency of a
+small request through the proxy, or of a TCP connect for SOCKS), measures
+the throughput the jobs get through it, and assigns every starting job the
+proxy with the lowest expected cost: its latency plus the time per byte at
+the measured per-job throughput, multiplied by the jobs it already carries.
+A running job that gets no output for STALL_SECONDS is restarted on
+another proxy (yt-dlp resumes the .part file), and its proxy is avoided
+until a probe succeeds again.
+"""
+import time
+import socket
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+from yd_jobs import RUNNING, FINISHED, POSTPROCESSING, ACTIVE_STATES
+from yd_progress import DOWNLOAD
+from yd_units import format_rate
+
+
+SCHEMES = ("http", "https", "socks4", "socks4a", "socks5", "socks5h")
+# generate_204 answers with an empty body, so the probe measures the round trip
+PROBE_URL = "http://www.gstatic.com/generate_204"
+PROBE_INTERVAL = 60.0
+PROBE_TIMEOUT = 10.0
+TICK = 2.0
+STALL_SECONDS = 30.0
+# weight of a new sample in the running averages
+EWMA = 0.3
+# assumed per-job throughput of a proxy nothing has been measured on yet
+DEFAULT_BPS = 1024 * 1024
+# error output that means the proxy itself failed, not the video
+_PROXY_ERRORS = ("unable to connect to proxy", "proxyerror", "tunnel connection failed", "proxy authentication",
+                 "socks5 error", "socks4 error", "connection refused")
+
+
+def parse_proxies(text):
+    """
+    Parse a proxy list like "http://a:8080, socks5://b:1080". Entries
+    without a scheme are HTTP proxies. Raises ValueError for an invalid entry.
+    """
+    proxies = []
+    for entry in (text or "").replace(",", " ").split():
+        if "://" not in entry:
+            entry = "http://" + entry
+        parts = urlsplit(entry)
+        try:
+            parts.port
+        except ValueError:
+            raise ValueError(f"invalid proxy port: {entry!r}")
+        if parts.scheme.lower() not in SCHEMES or not parts.hostname:
+            raise ValueError(f"invalid proxy: {entry!r}")
+        if entry not in proxies:
+            proxies.append(entry)
+    return proxies
+
+
+def display_name(proxy):
+    """The proxy URL with the password hidden, for logs and tables."""
+    parts = urlsplit(proxy)
+    if parts.password is None:
+        return proxy
+    return proxy.replace(f":{parts.password}@", ":***@", 1)
+
+
+class ProxyStats:
+    """What the pool knows about one proxy."""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        # latency: seconds of the last probes (EWMA), None before the first probe
+        self.latency = None
+        # bps: throughput of one job through this proxy (EWMA over TICK samples)
+        self.bps = None
+        self.active = 0
+        self.jobs = 0
+        self.failures = 0
+        self.last_error = ""
+        self.checked = None
+
+    def as_dict(self):
+        return {"proxy": display_name(self.url), "healthy": self.healthy, "latency": self.latency, "bps": self.bps,
+                "active": self.active, "jobs": self.jobs, "failures": self.failures, "last_error": self.last_error,
+                "checked": self.checked}
+
+
+class ProxyPool:
+    """
+    Assigns proxies to the jobs of a JobQueue:
+        job_queue.add_start_hook(pool.before_start)
+        job_queue.add_listener(pool.on_job_event)
+    Only jobs whose options have a proxy (use_proxy was on) are assigned.
+    A background thread probes the proxies every PROBE_INTERVAL seconds and
+    checks the running jobs for stalls every TICK seconds.
+    """
+
+    def __init__(self, job_queue, proxies=None, probe_url=PROBE_URL):
+        self.job_queue = job_queue
+        self.probe_url = probe_url
+        self.proxies = {}
+        self._assigned = {}
+        self._activity = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.configure(proxies or [])
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def configure(self, proxies, probe_url=None):
+        """Set the proxy list; stats of proxies that stay in it are kept."""
+        with self._lock:
+            self.proxies = {p: self.proxies.get(p) or ProxyStats(p) for p in proxies}
+            if probe_url:
+                self.probe_url = probe_url
+        self._wake.set()
+
+    def stats(self):
+        """Per-proxy stats as dicts, in list order."""
+        with self._lock:
+            return [s.as_dict() for s in self.proxies.values()]
+
+    # ----- choosing -----
+    def _cost(self, s, nominal):
+        # seconds per MiB for one more job on this proxy, plus the round trip
+        bps = s.bps or nominal
+        return (s.latency or 0) + (s.active + 1) * 1048576 / bps
+
+    def choose(self, exclude=None):
+        """The proxy for the next job, or None if the pool is empty."""
+        with self._lock:
+            candidates = [s for s in self.proxies.values() if s.url != exclude] or list(self.proxies.values())
+            if not candidates:
+                return None
+            healthy = [s for s in candidates if s.healthy] or candidates
+            measured = sorted(s.bps for s in self.proxies.values() if s.bps)
+            nominal = measured[len(measured) // 2] if measured else DEFAULT_BPS
+            # the least used proxy wins a tie
+            best = min(healthy, key=lambda s: (self._cost(s, nominal), s.jobs))
+            return best.url
+
+    def before_start(self, job):
+        opts = job.options
+        if not opts or not opts.get("proxy") or not self.proxies:
+            return
+        with self._lock:
+            old = self._assigned.pop(job.id, None)
+            if old in self.proxies:
+                self.proxies[old].active -= 1
+        proxy = self.choose(exclude=opts.pop("proxy_avoid", None))
+        with self._lock:
+            stats = self.proxies.get(proxy)
+            if stats is None:
+                return
+            stats.active += 1
+            stats.jobs += 1
+            self._assigned[job.id] = proxy
+            self._activity[job.id] = time.monotonic()
+            self._samples.pop(job.id, None)
+        if len(self.proxies) > 1:
+            self.job_queue.log(job, f"[proxy] using {display_name(proxy)}")
+        opts["proxy"] = proxy
+
+    # ----- job events -----
+    def on_job_event(self, job, kind, data):
+        if kind in ("log", "progress"):
+            if job.id in self._assigned:
+                self._activity[job.id] = time.monotonic()
+            if (kind == "log" and job.id in self._assigned and data.startswith(("ERROR", "WARNING"))
+                    and any(e in data.lower() for e in _PROXY_ERRORS)):
+                self._failed(self._assigned.get(job.id), data.strip())
+        elif kind == "state" and data not in ACTIVE_STATES:
+            # the QUEUED event of a job can arrive after its start hook ran
+            with self._lock:
+                proxy = self._assigned.pop(job.id, None)
+                self._activity.pop(job.id, None)
+                self._samples.pop(job.id, None)
+                stats = self.proxies.get(proxy)
+                if stats is not None:
+                    stats.active -= 1
+                    if data in (FINISHED, POSTPROCESSING):
+                        stats.healthy = True
+
+    def _failed(self, proxy, error):
+        with self._lock:
+            stats = self.proxies.get(proxy)
+            if stats is None:
+                return
+            stats.failures += 1
+            stats.last_error = error[:200]
+            stats.healthy = False
+
+    # ----- background -----
+    def probe(self, proxy):
+        """Round trip through proxy in seconds. Raises OSError if it does not answer."""
+        parts = urlsplit(proxy)
+        start = time.monotonic()
+        if parts.scheme.startswith("socks"):
+            # urllib cannot speak SOCKS: check that the proxy accepts connections
+            socket.create_connection((parts.hostname, parts.port or 1080), PROBE_TIMEOUT).close()
+        else:
+            handler = urllib.request.ProxyHandler({"http": proxy, "https": proxy})
+            try:
+                with urllib.request.build_opener(handler).open(self.probe_url, timeout=PROBE_TIMEOUT) as r:
+                    r.read(1024)
+            except urllib.error.HTTPError as e:
+                # any answer from the site means the proxy works; 5xx come from the proxy
+                if e.code >= 500:
+                    raise
+        return time.monotonic() - start
+
+    def _probe_all(self):
+        with self._lock:
+            proxies = list(self.proxies.values())
+        for s in proxies:
+            try:
+                latency = self.probe(s.url)
+            except Exception as e:
+                with self._lock:
+                    s.healthy = False
+                    s.failures += 1
+                    s.last_error = str(e)[:200]
+                    s.checked = time.time()
+                continue
+            with self._lock:
+                s.latency = latency if s.latency is None else (1 - EWMA) * s.latency + EWMA * latency
+                s.healthy = True
+                s.checked = time.time()
+
+    def _measure(self):
+        now = time.monotonic()
+        with self._lock:
+            assigned = dict(self._assigned)
+        for job_id, proxy in assigned.items():
+            job = self.job_queue.jobs.get(job_id)
+            if job is None or job.state != RUNNING:
+                continue
+            last = self._samples.get(job_id)
+            self._samples[job_id] = (now, job.transferred)
+            if last is not None and job.transferred > last[1] and now > last[0]:
+                rate = (job.transferred - last[1]) / (now - last[0])
+                with self._lock:
+                    s = self.proxies.get(proxy)
+                    if s is not None:
+                        s.bps = rate if s.bps is None else (1 - EWMA) * s.bps + EWMA * rate
+            idle = now - self._activity.get(job_id, now)
+            if idle >= STALL_SECONDS and job.stage == DOWNLOAD:
+                self._stalled(job, proxy, idle)
+
+    def _stalled(self, job, proxy, idle):
+        self._failed(proxy, f"no data for {idle:.0f}s")
+        other = self.choose(exclude=proxy)
+        self._activity[job.id] = time.monotonic()
+        if other is None or other == proxy:
+            self.job_queue.log(job, f"[proxy] {display_name(proxy)} stalled for {idle:.0f}s, no other proxy to switch to")
+            return
+        job.options["proxy_avoid"] = proxy
+        self.job_queue.restart(job.id, f"[proxy] {display_name(proxy)} stalled for {idle:.0f}s, switching proxy")
+
+    def _loop(self):
+        next_probe = 0.0
+        while True:
+            self._wake.wait(TICK)
+            try:
+                if self._wake.is_set() or time.monotonic() >= next_probe:
+                    self._wake.clear()
+                    next_probe = time.monotonic() + PROBE_INTERVAL
+                    self._probe_all()
+                self._measure()
+            except Exception as e:
+                print("Proxy pool error:", e)
+
+
+def stats_text(stats):
+    """One line per proxy for the CLI."""
+    lines = []
+    for s in stats:
+        latency = f"{s['latency'] * 1000:.0f} ms" if s["latency"] is not None else "-"
+        rate = format_rate(s["bps"])
+        state = "ok" if s["healthy"] else f"down ({s['last_error']})"
+        lines.append(f"{s['proxy']}: {state}, latency {latency}, {rate} per job, "
+                     f"{s['active']} active / {s['jobs']} jobs, {s['failures']} failure(s)")
+    return "\n".join(lines)
@@ -0,0 +1,51 @@
+import time
+from tkinter import ttk
+
+from yd_units import format_rate
+
+
+REFRESH_MS = 2000
+
+
+class ProxyView(ttk.Frame):
+    """
+    Live table of a ProxyPool: health, probe latency, per-job throughput,
+    load and failures of every proxy. Refreshes itself while it is shown.
+    """
+
+    def __init__(self, master, pool, **kwargs):
+        super().__init__(master, **kwargs)
+        self.pool = pool
+        columns = (("proxy", "Proxy", 190), ("status", "Status", 70), ("latency", "Latency", 70),
+                   ("rate", "Per job", 80), ("jobs", "Active / jobs", 85), ("failures", "Failures", 60))
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show="headings", height=4)
+        for col, heading, width in columns:
+            self.tree.heading(col, text=heading)
+            self.tree.column(col, width=width, anchor="w" if col in ("proxy", "status") else "e")
+        self.tree.pack(fill="x")
+        self.error_label = ttk.Label(self, text="", font=("TkDefaultFont", 8), wraplength=520)
+        self.error_label.pack(anchor="w", pady=(2, 0))
+        self.refresh()
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        stats = self.pool.stats()
+        self.tree.delete(*self.tree.get_children())
+        errors = []
+        for s in stats:
+            latency = f"{s['latency'] * 1000:.0f} ms" if s["latency"] is not None else "-"
+            rate = format_rate(s["bps"])
+            if s["checked"] is None:
+                status = "checking"
+            else:
+                status = "ok" if s["healthy"] else "down"
+            self.tree.insert("", "end", values=(s["proxy"], status, latency, rate, f"{s['active']} / {s['jobs']}",
+                                                s["failures"]))
+            if not s["healthy"] and s["last_error"]:
+                ago = f", {time.time() - s['checked']:.0f}s ago" if s["checked"] else ""
+                errors.append(f"{s['proxy']}: {s['last_error']}{ago}")
+        if not stats:
+            self.tree.insert("", "end", values=("(no proxies in use)", "", "", "", "", ""))
+        self.error_label.configure(text="\n".join(errors))
+        self.after(REFRESH_MS, self.refresh)
@@ -0,0 +1,88 @@
+import queue
+
+
+class UiPump:
+    """
+    Batches job events from worker threads onto the Tk thread.
+    Reader threads call push() (thread-safe, never touches Tk). A single
+    root.after loop drains the queue at a fixed frame rate: per tick every job
+    gets at most one row refresh with its latest progress, and all new log lines
+    are handed over in one list so they can be inserted in one go.
+    """
+
+    def __init__(self, root, apply_logs, apply_jobs, fps=20, max_events_per_tick=5000):
+        # apply_logs(lines): called with all log lines of one tick
+        # apply_jobs(jobs, state_changed): called with the jobs that changed
+        self.root = root
+        self.apply_logs = apply_logs
+        self.apply_jobs = apply_jobs
+        self.interval_ms = max(1, int(1000 / fps))
+        self.max_events_per_tick = max_events_per_tick
+        self._queue = queue.SimpleQueue()
+        self._after_id = None
+        # counters
+        self.events_received = 0
+        self.events_coalesced = 0
+        self.ticks = 0
+
+    def push(self, job, kind, data=None):
+        """Queue one event; safe to call from any thread."""
+        self._queue.put((job, kind, data))
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def stats(self):
+        """Counters as a dict (received, coalesced, ticks)."""
+        return {
+            "received": self.events_received,
+            "coalesced": self.events_coalesced,
+            "ticks": self.ticks,
+        }
+
+    def _drain(self):
+        # pull up to max_events_per_tick events and merge them
+        lines = []
+        dirty = {}
+        job_events = 0
+        state_changed = False
+        n = 0
+        while n < self.max_events_per_tick:
+            try:
+                job, kind, data = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            n += 1
+            if kind == "log":
+                lines.append(f"[#{job.id}] {data}")
+            else:
+                job_events += 1
+                dirty[job.id] = job
+                if kind == "state":
+                    state_changed = True
+        self.events_received += n
+        # everything beyond one bulk insert and one refresh per job was folded
+        self.events_coalesced += max(0, len(lines) - 1) + (job_events - len(dirty))
+        return lines, list(dirty.values()), state_changed
+
+    def _tick(self):
+        try:
+            lines, jobs, state_changed = self._drain()
+            if lines:
+                self.apply_logs(lines)
+            if jobs:
+                self.apply_jobs(jobs, state_changed)
+            self.ticks += 1
+        except Exception as e:
+            print("UI pump error:", e)
+        finally:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
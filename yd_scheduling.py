@@ -0,0 +1,282 @@
+"""
+Scheduling policies for queued jobs.
+JobQueue starts pending jobs in the order its policy returns
+(job_queue.policy; None keeps them first in, first out):
+
+    fifo        paste order
+    priority    higher options["priority"] first; a waiting job gains one
+                level every PRIORITY_AGING seconds
+    sjf         shortest estimated job first: the bytes still to download
+                (from the cached format list, else the duration at a
+                typical bitrate) at the measured download rate. Every
+                second a job waits counts as AGING seconds less work, so
+                a long video waits at most about its own download time
+                while short ones keep arriving
+    fair        round robin over sources (subscription, playlist or site):
+                the source with the fewest running jobs goes next
+
+Explicit priorities come first under sjf and fair as well. The metrics
+history records the policy of every job: policy_report() gives the mean
+and p95 time to completion per policy as measured, simulate() replays the
+recorded job mix (arrival times, sizes, slot times) under every policy so
+they can be compared on the same work.
+"""
+import math
+import time
+import heapq
+from collections import deque
+
+from yd_jobs import RUNNING, FINISHED, DONE_STATES, job_source
+from yd_cache import estimate_size
+from yd_metrics import percentile
+
+
+POLICIES = ("fifo", "priority", "sjf", "fair")
+# priority: seconds of waiting that are worth one priority level
+PRIORITY_AGING = 600.0
+# sjf: seconds of estimated work a second of waiting cancels out
+AGING = 1.0
+# bytes per second of media when only the duration is known (about 2.4 Mbit/s)
+MEDIA_BPS = 300000
+# download rate that turns bytes into seconds while the history has none
+DEFAULT_RATE = 2 * 1024 * 1024
+# seconds of metrics history the typical download rate is taken from
+RATE_HISTORY = 30 * 86400
+# estimated seconds of a job nothing is known about yet
+UNKNOWN_SECONDS = 120.0
+# seconds before an unknown size is looked up again
+RECHECK = 30.0
+# history rows simulate() replays at most (the most recent ones)
+SIMULATE_ROWS = 2000
+
+
+def priority(job):
+    try:
+        return int((job.options or {}).get("priority") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+# ---------------- Policies ----------------
+class FifoPolicy:
+    """
+    A policy has a name, order(pending, running, now) -> the pending jobs in
+    start order, and on_job_event for the queue listener (see DownloadCore).
+    """
+    name = "fifo"
+
+    def order(self, pending, running, now):
+        return list(pending)
+
+    def on_job_event(self, job, kind, data):
+        pass
+
+
+class PriorityPolicy(FifoPolicy):
+    name = "priority"
+
+    def order(self, pending, running, now):
+        # stable: equal priorities keep their queue order
+        return sorted(pending, key=lambda j: -(priority(j) + (now - j.created) / PRIORITY_AGING))
+
+
+class ShortestJobPolicy(FifoPolicy):
+    """estimate(job) -> seconds of work left (see WorkEstimator)."""
+    name = "sjf"
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+
+    def order(self, pending, running, now):
+        return sorted(pending, key=lambda j: (-priority(j), self.estimate(j) - (now - j.created) * AGING))
+
+
+class FairPolicy(FifoPolicy):
+    """
+    Among sources with equally many running jobs, the one that started a
+    job least recently goes first.
+    """
+    name = "fair"
+
+    def __init__(self):
+        # source -> number of the start that last served it
+        self._served = {}
+        self._starts = 0
+
+    def on_job_event(self, job, kind, data):
+        if kind == "state" and data == RUNNING:
+            self._starts += 1
+            self._served[job_source(job)] = self._starts
+
+    def order(self, pending, running, now):
+        load = {}
+        for job in running:
+            load[job_source(job)] = load.get(job_source(job), 0) + 1
+        out = []
+        for level in sorted({priority(j) for j in pending}, reverse=True):
+            queues = {}
+            for job in pending:
+                if priority(job) == level:
+                    queues.setdefault(job_source(job), deque()).append(job)
+            # (jobs of the source running or already placed, last served, first seen, source)
+            heap = [(load.get(src, 0), self._served.get(src, 0), i, src) for i, src in enumerate(queues)]
+            heapq.heapify(heap)
+            turn = self._starts
+            while heap:
+                n, _, i, src = heapq.heappop(heap)
+                out.append(queues[src].popleft())
+                if queues[src]:
+                    turn += 1
+                    heapq.heappush(heap, (n + 1, turn, i, src))
+        return out
+
+
+def make_policy(name, estimate=None):
+    """Policy object for a name in POLICIES. Raises ValueError for others."""
+    if name == "fifo":
+        return FifoPolicy()
+    if name == "priority":
+        return PriorityPolicy()
+    if name == "sjf":
+        return ShortestJobPolicy(estimate or (lambda job: UNKNOWN_SECONDS))
+    if name == "fair":
+        return FairPolicy()
+    raise ValueError(f"unknown scheduling policy {name!r} (use {', '.join(POLICIES)})")
+
+
+# ---------------- Estimates ----------------
+class WorkEstimator:
+    """
+    Seconds of download work a job still has: its estimated size (the
+    cached format list the size estimate uses, else options["duration"]
+    at MEDIA_BPS) minus what it has, at `rate` bytes per second. Sizes are
+    looked up once per job; register on_job_event to forget finished jobs.
+    """
+
+    def __init__(self, metadata_cache, rate=DEFAULT_RATE):
+        self.metadata_cache = metadata_cache
+        self.rate = rate
+        # job id -> (bytes or None, looked up at)
+        self._sizes = {}
+
+    def size(self, job):
+        now = time.monotonic()
+        entry = self._sizes.get(job.id)
+        if entry is None or (entry[0] is None and now - entry[1] >= RECHECK):
+            opts = job.options or {}
+            info = self.metadata_cache.get(job.url, touch=False) if opts.get("format") else None
+            size = estimate_size(info, opts["format"], opts.get("quality", "")) if info else 0
+            if not size:
+                duration = opts.get("duration") or (info or {}).get("duration")
+                size = duration * MEDIA_BPS if duration else None
+            entry = self._sizes[job.id] = (size, now)
+        return entry[0]
+
+    def __call__(self, job):
+        size = self.size(job)
+        if size is None:
+            return UNKNOWN_SECONDS
+        return max(0, size - job.transferred) / self.rate
+
+    def on_job_event(self, job, kind, data):
+        if kind == "state" and data in DONE_STATES:
+            self._sizes.pop(job.id, None)
+
+
+def typical_rate(rows):
+    """Median download rate of finished history rows (DEFAULT_RATE without any)."""
+    rate = percentile([r["avg_bps"] for r in rows if r["outcome"] == FINISHED and r["avg_bps"]], 0.5)
+    return rate or DEFAULT_RATE
+
+
+# ---------------- Report ----------------
+def completion_stats(times):
+    """{"jobs", "mean", "p95"} of a list of completion times in seconds."""
+    return {
+        "jobs": len(times),
+        "mean": sum(times) / len(times) if times else None,
+        "p95": percentile(times, 0.95),
+    }
+
+
+def policy_report(rows):
+    """Measured time to completion (queued until done) of finished rows, per recorded policy."""
+    by_policy = {}
+    for r in rows:
+        if r["outcome"] == FINISHED:
+            by_policy.setdefault(r.get("policy") or "fifo", []).append(r["total"])
+    return {name: completion_stats(times) for name, times in sorted(by_policy.items())}
+
+
+class _SimJob:
+    # a history row replayed by simulate()
+    def __init__(self, i, row):
+        self.id = i
+        self.url = row["url"]
+        self.group = None
+        self.options = {"source": row.get("source") or ""}
+        self.created = row["finished_at"] - row["total"]
+        # time the job held a download slot (the conversion pool runs beside the slots)
+        self.work = max(0.0, row["total"] - (row["queue"] or 0) - (row["convert"] or 0))
+        self.size = row["bytes"]
+        self.transferred = 0
+
+
+def simulate(rows, policy, slots):
+    """
+    Replay finished history rows with their recorded arrival times and slot
+    times on `slots` parallel downloads, starting queued jobs in the order
+    policy picks. Returns the completion time of every job.
+    """
+    jobs = sorted((_SimJob(i, r) for i, r in enumerate(rows) if r["outcome"] == FINISHED), key=lambda j: j.created)
+    pending, running, times = [], [], []
+    i = 0
+    while i < len(jobs) or pending or running:
+        now = min(jobs[i].created if i < len(jobs) else math.inf, running[0][0] if running else math.inf)
+        while running and running[0][0] <= now:
+            end, _, job = heapq.heappop(running)
+            times.append(end - job.created)
+        while i < len(jobs) and jobs[i].created <= now:
+            pending.append(jobs[i])
+            i += 1
+        while pending and len(running) < slots:
+            job = policy.order(pending, [r[2] for r in running], now)[0]
+            pending.remove(job)
+            policy.on_job_event(job, "state", RUNNING)
+            heapq.heappush(running, (now + job.work, job.id, job))
+    return times
+
+
+def compare_policies(rows, slots):
+    """simulate() the last SIMULATE_ROWS history rows under every policy: {name: completion_stats}."""
+    rows = [r for r in rows if r["outcome"] == FINISHED][-SIMULATE_ROWS:]
+    rate = typical_rate(rows)
+    out = {}
+    for name in POLICIES:
+        # sjf sees the recorded sizes, as the format list would have told it
+        policy = make_policy(name, lambda job: max(0, job.size) / rate)
+        out[name] = completion_stats(simulate(rows, policy, slots))
+    return out
+
+
+def report_text(rows, slots, current):
+    """Plain-text comparison for the CLI: measured per policy, then simulated on the recorded mix."""
+    def sec(v):
+        return "-" if v is None else f"{v:.1f}s"
+
+    lines = ["time to completion (queued until done)"]
+    measured = policy_report(rows)
+    if not measured:
+        lines.append("  no finished downloads in the history yet")
+        return "\n".join(lines)
+    lines.append("  measured:")
+    for name, s in measured.items():
+        lines.append(f"    {name:<9} {s['jobs']:>6} jobs  mean {sec(s['mean']):>9}  p95 {sec(s['p95']):>9}")
+    simulated = compare_policies(rows, slots)
+    means = {name: s["mean"] for name, s in simulated.items()}
+    best = min(means, key=means.get) if len(set(means.values())) > 1 else None
+    lines.append(f"  simulated on the last {simulated['fifo']['jobs']} finished downloads with {slots} parallel:")
+    for name, s in simulated.items():
+        marks = (" <- current" if name == current else "") + (" (lowest mean)" if name == best else "")
+        lines.append(f"    {name:<9} mean {sec(s['mean']):>9}  p95 {sec(s['p95']):>9}{marks}")
+    return "\n".join(lines)
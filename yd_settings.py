@@ -0,0 +1,137 @@
+"""
+Settings file and bundled tool locations.
+Kept free of Tk and of the download machinery so every entry point can load
+it first without paying for anything else.
+"""
+import os
+import sys
+import json
+import shutil
+
+
+# ---------------- Resource & Settings ----------------
+def resource_path(relative_path):
+    """
+    Return path to a bundled resource.
+    If script is bundled by pyinstaller (--onefile) use sys._MEIPASS.
+    Otherwise use the local folder and the 'Necessary' subfolder.
+    """
+    try:
+        base = sys._MEIPASS
+    except Exception:
+        base = os.path.abspath(os.path.dirname(__file__))
+    # executables & settings live in the Necessary folder
+    return os.path.join(base, "Necessary", relative_path)
+
+
+def tool_path(name):
+    """
+    Path of an external tool ("yt-dlp" or "ffmpeg").
+    Prefers Necessary/<name>.exe, then Necessary/<name>, then the PATH
+    (Linux servers usually have both installed system-wide). Falls back to
+    the Necessary/<name>.exe path so error messages point at the usual place.
+    """
+    for candidate in (resource_path(name + ".exe"), resource_path(name)):
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which(name) or resource_path(name + ".exe")
+
+
+# SETTINGS_FILE lives in the Necessary folder
+SETTINGS_FILE = resource_path("settings.json")
+DEFAULT_SETTINGS = {
+    "default_output": os.path.join(os.path.expanduser("~"), "Downloads"),
+    "use_proxy": False,
+    # one or more proxies, separated by commas or spaces (see yd_proxy)
+    "proxy": "",
+    # URL the proxy pool requests through each proxy to check it (empty = default)
+    "proxy_probe_url": "",
+    "remux_mp4": True,
+    "recode_mp4": False,
+    "extract_audio": False,
+    "theme": "cosmo",
+    "max_parallel": 3,
+    # "auto": in-process yt_dlp package if installed, else yt-dlp.exe
+    "engine": "auto",
+    "skip_downloaded": True,
+    # queue every playlist entry as its own job while the playlist is listed
+    "expand_playlists": True,
+    "entry_retries": 2,
+    # global download budget like "5M" (empty = unlimited) and optional
+    # time-of-day overrides like "08:00-18:00=2M, 23:00-06:00=0"
+    "bandwidth_limit": "",
+    "bandwidth_profiles": "",
+    # convert (MP3/WAV extraction, re-encodes) in a separate ffmpeg pool so
+    # the download slot is free for the next item; 0 workers = CPU cores
+    "overlap_postprocessing": True,
+    "postprocess_workers": 0,
+    # pick streams from the format list that only need a stream copy or
+    # remux for the chosen container instead of a full re-encode
+    "plan_formats": True,
+    # learn per-site fragment concurrency / chunk size from measured
+    # throughput; set external_downloader to "aria2c" to let it try aria2c
+    "adaptive_tuning": True,
+    "external_downloader": "",
+    # keep downloaded source streams (up to the size limit, e.g. "20G";
+    # empty = no limit) so other formats of a video need no new download
+    "stream_store": True,
+    "stream_store_limit": "20G",
+    # restart a download that got no data for stall_timeout seconds
+    # (0 = never), waiting longer before each of up to stall_retries restarts
+    "stall_timeout": 120,
+    "stall_retries": 5,
+    # check free space before a download starts (sizes from the cached format
+    # list): disk_reserve is always left free, overflow_output takes the jobs
+    # that do not fit, scratch_dir (e.g. a fast SSD) holds partial downloads
+    # and merges until they are moved to the output folder (empty = off)
+    "disk_check": True,
+    "disk_reserve": "1G",
+    "overflow_output": "",
+    "scratch_dir": "",
+    # local HTTP API for scripts (see yd_api); api_token empty = no token,
+    # api_backlog = submissions waiting for admission before clients get 429
+    "api_enabled": False,
+    "api_port": 8765,
+    "api_token": "",
+    "api_backlog": 1000,
+    # subscriptions (yd_subscriptions): check channels / playlists in the
+    # background, and how often new subscriptions are checked (minutes)
+    "subscription_sync": True,
+    "subscription_interval": 60,
+    # order queued downloads start in (yd_scheduling): "fifo" paste order,
+    # "priority" by the job's priority, "sjf" shortest estimated download
+    # first, "fair" round robin over subscriptions / playlists / sites
+    "scheduling_policy": "fifo",
+    # shared secret between a --coordinator and its workers (yd_distributed);
+    # required for a coordinator that listens beyond 127.0.0.1
+    "shared_queue_token": "",
+}
+
+def load_settings():
+    """
+    Load settings from SETTINGS_FILE if present.
+    Merge with DEFAULT_SETTINGS so new keys get defaults.
+    Returns a dict (copy on failure).
+    """
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                return {**DEFAULT_SETTINGS, **data}
+    except Exception:
+        pass
+    return DEFAULT_SETTINGS.copy()
+
+def save_settings(s):
+    """
+    Save provided settings dict to SETTINGS_FILE.
+    Ensures the Necessary folder exists before writing.
+    """
+    try:
+        # Ensure Necessary folder exists (e.g. first run)
+        settings_dir = os.path.dirname(SETTINGS_FILE)
+        os.makedirs(settings_dir, exist_ok=True)
+        with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
+            json.dump(s, f, indent=2, ensure_ascii=False)
+    except Exception as e:
+        print("Error saving settings:", e)
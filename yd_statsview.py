@@ -0,0 +1,107 @@
+import time
+from tkinter import ttk, filedialog, messagebox
+
+from yd_units import format_rate, format_size
+
+
+# (summary field, quantile, heading, width)
+_COLUMNS = (
+    ("total", "0.5", "Total p50", 80),
+    ("total", "0.9", "Total p90", 80),
+    ("extract", "0.5", "Extract p50", 80),
+    ("ttfb", "0.5", "TTFB p50", 70),
+    ("download", "0.5", "Download p50", 90),
+    ("merge", "0.5", "Merge p50", 75),
+    ("convert", "0.5", "Convert p50", 80),
+    ("avg_bps", "0.5", "Rate p50", 85),
+    ("peak_bps", "0.9", "Peak p90", 85),
+)
+
+_PERIODS = (("Last 24 hours", 24 * 3600), ("Last 7 days", 7 * 24 * 3600), ("All history", None))
+
+
+class StatsView(ttk.Frame):
+    """
+    Table of the download history aggregates of a JobMetrics store: one row
+    per format and quality with job counts and phase / throughput
+    percentiles, plus JSON and Prometheus export buttons. With a
+    StreamStore, the downloads it saved are shown below the table.
+    """
+
+    def __init__(self, master, metrics, stream_store=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.metrics = metrics
+        self.stream_store = stream_store
+
+        bar = ttk.Frame(self)
+        bar.pack(fill="x", pady=(0, 6))
+        self.period = ttk.Combobox(bar, values=[p[0] for p in _PERIODS], state="readonly", width=16)
+        self.period.set(_PERIODS[-1][0])
+        self.period.bind("<<ComboboxSelected>>", lambda e: self.refresh())
+        self.period.pack(side="left", padx=(0, 6))
+        ttk.Button(bar, text="↻ Refresh", bootstyle="info-outline", command=self.refresh).pack(side="left")
+        ttk.Button(bar, text="Export Prometheus", bootstyle="light", command=self.export_prometheus).pack(side="right")
+        ttk.Button(bar, text="Export JSON", bootstyle="light", command=self.export_json).pack(side="right", padx=(0, 6))
+
+        columns = ("format", "jobs", "ok", "failed", "retries") + tuple(f"{field}-{q}" for field, q, _, _ in _COLUMNS)
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=10)
+        for col, heading, width in (("format", "Format", 90), ("jobs", "Jobs", 50), ("ok", "OK", 45),
+                                    ("failed", "Failed", 55), ("retries", "Retries", 60)):
+            self.tree.heading(col, text=heading)
+            self.tree.column(col, width=width, anchor="w" if col == "format" else "e")
+        for field, q, heading, width in _COLUMNS:
+            self.tree.heading(f"{field}-{q}", text=heading)
+            self.tree.column(f"{field}-{q}", width=width, anchor="e")
+        self.tree.pack(fill="both", expand=True)
+        self.info_label = ttk.Label(self, text="", font=("TkDefaultFont", 8))
+        self.info_label.pack(anchor="w", pady=(4, 0))
+        self.refresh()
+
+    def _since(self):
+        seconds = dict(_PERIODS).get(self.period.get())
+        return time.time() - seconds if seconds else None
+
+    def refresh(self):
+        summary = self.metrics.summary(self._since())
+        self.tree.delete(*self.tree.get_children())
+        for g in summary:
+            values = [g["format"] + (f" {g['quality']}p" if g["quality"] else ""), g["jobs"], g["finished"], g["failed"], g["retries"]]
+            for field, q, _, _ in _COLUMNS:
+                value = g["quantiles"][field][q]
+                if value is None:
+                    values.append("-")
+                elif field.endswith("_bps"):
+                    values.append(format_rate(value))
+                else:
+                    values.append(f"{value:.1f}s")
+            self.tree.insert("", "end", values=values)
+        jobs = sum(g["jobs"] for g in summary)
+        text = f"{jobs} job(s) in {self.metrics.path}; {self.metrics.live_count()} still running or queued"
+        if self.stream_store is not None:
+            s = self.stream_store.stats()
+            text += (f"\nStream store: {s['streams']} stream(s), {format_size(s['bytes'])}; "
+                     f"{s['derived']} job(s) made locally, {format_size(s['saved_bytes'])} not downloaded")
+        self.info_label.configure(text=text)
+
+    def export_json(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json", initialfile="download-stats.json",
+                                            filetypes=[("JSON", "*.json")])
+        if path:
+            self._export(lambda: self.metrics.export_json(path, self._since()), path)
+
+    def export_prometheus(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".prom", initialfile="download-stats.prom",
+                                            filetypes=[("Prometheus text", "*.prom *.txt")])
+        if path:
+            def write():
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(self.metrics.prometheus_text(self._since()))
+            self._export(write, path)
+
+    def _export(self, fn, path):
+        try:
+            fn()
+        except OSError as e:
+            messagebox.showerror("Export failed", str(e), parent=self)
+            return
+        self.info_label.configure(text=f"Exported to {path}")
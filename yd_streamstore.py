@@ -0,0 +1,305 @@
+"""
+Source stream store.
+Keeps the streams yt-dlp downloaded (before any conversion) in a local
+content-addressed store, Necessary/streams/<fingerprint>.<ext>, indexed by
+video key and format id in Necessary/streams.sqlite. A later request for the
+same video that can be made from a stored stream is produced locally with
+ffmpeg and makes no network request:
+
+    mp3 / wav           audio extracted from any stored stream with audio
+    mov / mp4           the stored video, stream-copied when its codec fits
+                        the container (re-encoded only where the user's
+                        conversion settings allow it)
+    same container      the stored file itself (e.g. a lower quality cap
+                        that picks the same stream, or a deleted output)
+
+Subtitles embedded in a stored stream come along; subtitle languages the
+stream does not have are fetched on their own (yt-dlp --skip-download) and
+muxed into the stored stream with a stream copy. Files are hard
+links where possible, so a stream shared with an output file costs no
+space until the output is deleted. The store is trimmed to its size limit
+by evicting the least recently used streams.
+"""
+import os
+import glob
+import time
+import shutil
+import sqlite3
+import threading
+
+from yd_jobs import FINISHED, POSTPROCESSING
+from yd_archive import fingerprint
+from yd_engine import subtitle_langs
+from yd_pipeline import manifest_files, post_step
+from yd_planner import CONTAINERS, ENCODE, allowed_actions, codec_family
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    video_key TEXT NOT NULL,
+    format_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    height INTEGER,
+    vcodec TEXT,
+    acodec TEXT,
+    subs TEXT NOT NULL,
+    quality_cap INTEGER,
+    title TEXT NOT NULL,
+    added REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (video_key, format_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS streams_digest ON streams(digest);
+CREATE INDEX IF NOT EXISTS streams_used ON streams(last_used);
+CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+_COLUMNS = ("video_key", "format_id", "digest", "ext", "size", "height", "vcodec", "acodec", "subs",
+            "quality_cap", "title", "added", "last_used")
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def stream_info(formats, format_ids):
+    """
+    Height and codecs of a download from the cached format list and the
+    format ids yt-dlp picked ("137+140"). Unknown values are None.
+    """
+    by_id = {f.get("format_id"): f for f in formats or []}
+    picked = [by_id[i] for i in (format_ids or "").split("+") if i in by_id]
+    if not picked:
+        return None, None, None
+    video = next((f for f in picked if f.get("vcodec") not in (None, "none")), None)
+    audio = next((f for f in picked if f.get("acodec") not in (None, "none")), None)
+    return (_int(video.get("height")) if video else None,
+            video.get("vcodec") if video else "none",
+            audio.get("acodec") if audio else "none")
+
+
+def derive_step(row, opts):
+    """
+    How to make the output of opts from a stored stream row: (True, step)
+    with a yd_pipeline step, or step None when the stored file already is
+    the output; (False, None) when it cannot be made from this stream.
+    Subtitle languages the stream lacks are listed in step["subs"].
+    """
+    fmt = opts["format"]
+    if fmt in ("mp3", "wav"):
+        if row["acodec"] == "none":
+            return False, None
+        return True, {"kind": "audio", "ext": fmt}
+    have = set(filter(None, row["subs"].split(",")))
+    missing = [] if "all" in have else [lang for lang in subtitle_langs(opts.get("subtitles")) or [] if lang not in have]
+    # the stream is what yt-dlp would pick if the new cap is between its
+    # height and the cap it was picked with
+    q = _int(opts.get("quality"))
+    if row["height"] is None or q is None or row["quality_cap"] is None or not row["height"] <= q <= row["quality_cap"]:
+        return False, None
+    if row["ext"] == fmt:
+        step = None
+    elif fmt == "webm" or fmt not in CONTAINERS:
+        return False, None
+    elif codec_family(row["vcodec"]) in CONTAINERS[fmt]["video"]:
+        step = {"kind": "video", "ext": fmt, "video": "copy"}
+    elif ENCODE in allowed_actions(opts):
+        step = {"kind": "video", "ext": fmt}
+    else:
+        return False, None
+    if missing:
+        # the fetched subtitles are muxed in; the streams themselves are copied
+        step = dict(step or {"kind": "video", "ext": fmt, "video": "copy", "audio": "copy"}, subs=missing)
+    return True, step
+
+
+class StreamStore:
+    """
+    Content-addressed store of downloaded source streams. Register
+    on_job_event as a JobQueue listener; it stores the downloaded files of
+    a job when they are handed to the post-processing pool, or when the
+    job finished with stream copies only. derive(opts, video_key) turns an
+    options snapshot into a local job when a stored stream can serve it.
+    """
+
+    def __init__(self, root, db_path, limit=0, formats_for=None):
+        self.root = root
+        self.limit = limit
+        # formats_for(url) -> cached format list or None (heights and codecs)
+        self.formats_for = formats_for
+        self.enabled = True
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+
+    # ----- totals -----
+    def _add_total(self, name, n):
+        self._db.execute("INSERT INTO totals VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                         (name, n, n))
+
+    def stats(self):
+        """{"streams", "bytes", "saved_bytes", "derived"} for the whole store."""
+        with self._lock:
+            streams, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM streams)").fetchone()
+            totals = dict(self._db.execute("SELECT name, value FROM totals").fetchall())
+        return {"streams": streams, "bytes": size, "saved_bytes": totals.get("saved_bytes", 0),
+                "derived": totals.get("derived", 0)}
+
+    # ----- storing -----
+    def add(self, video_key, format_id, path, opts, formats=None):
+        """Store one downloaded file. Returns the store path."""
+        size = os.path.getsize(path)
+        digest = fingerprint(path, size)
+        ext = os.path.splitext(path)[1].lstrip(".").lower() or "bin"
+        target = self._path(digest, ext)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = target + ".tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            try:
+                os.link(path, tmp)
+            except OSError:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        height, vcodec, acodec = stream_info(formats, format_id)
+        subs = ""
+        if opts.get("format") not in ("mp3", "wav"):
+            subs = ",".join(subtitle_langs(opts.get("subtitles")) or [])
+        now = time.time()
+        title = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO streams ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                (video_key, format_id, digest, ext, size, height, vcodec, acodec, subs,
+                 _int(opts.get("quality")) if height else None, title, now, now))
+            self._db.commit()
+        self.trim()
+        return target
+
+    def trim(self):
+        """Evict least recently used streams until the store fits its limit."""
+        if not self.limit:
+            return
+        with self._lock:
+            total = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM streams)").fetchone()[0]
+            rows = self._db.execute("SELECT video_key, format_id, digest, ext, size FROM streams ORDER BY last_used").fetchall()
+            for key, format_id, digest, ext, size in rows:
+                if total <= self.limit:
+                    break
+                self._db.execute("DELETE FROM streams WHERE video_key = ? AND format_id = ?", (key, format_id))
+                if not self._db.execute("SELECT 1 FROM streams WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+                    try:
+                        os.remove(self._path(digest, ext))
+                    except OSError:
+                        pass
+                    total -= size
+            self._db.commit()
+
+    def on_job_event(self, job, kind, data):
+        if kind != "state" or not self.enabled or not job.options:
+            return
+        opts = job.options
+        if opts.get("source_stream"):
+            if data == FINISHED:
+                self._derived(job)
+            return
+        # POSTPROCESSING: the downloaded files, before the pool converts them;
+        # FINISHED: only outputs yt-dlp did not re-encode
+        if data == POSTPROCESSING or (data == FINISHED and not opts.get("post_step") and post_step(opts) is None):
+            self._store_job(job)
+
+    def _store_job(self, job):
+        manifest = job.options.get("manifest")
+        if not manifest:
+            return
+        formats = None
+        try:
+            with open(manifest, "r", encoding="utf-8") as f:
+                lines = [line.rstrip("\n").split("\t", 2) for line in f]
+        except OSError:
+            return
+        present = set(manifest_files(manifest))
+        for parts in lines:
+            if len(parts) != 3 or parts[2] not in present:
+                continue
+            if formats is None and self.formats_for:
+                formats = self.formats_for(job.url) or []
+            try:
+                self.add(f"{parts[0].lower()}:{parts[1]}", job.format_ids or "best", parts[2], job.options, formats)
+            except (OSError, sqlite3.Error) as e:
+                print("Stream store error:", e)
+
+    def _derived(self, job):
+        saved = job.options["source_stream"].get("saves", 0)
+        with self._lock:
+            self._add_total("saved_bytes", saved)
+            self._add_total("derived", 1)
+            self._db.commit()
+
+    # ----- deriving -----
+    def candidates(self, video_key):
+        """Stored streams of a video, most recently used first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM streams WHERE video_key = ? ORDER BY last_used DESC",
+                                    (video_key,)).fetchall()
+        return [dict(zip(_COLUMNS, r)) for r in rows]
+
+    def derive(self, opts, video_key, download_size=None):
+        """
+        opts for a local job made from a stored stream, or None when no
+        stored stream fits. download_size (if known) is what the network
+        download would have cost and is counted as saved once the job is done.
+        """
+        if not self.enabled or not video_key:
+            return None
+        for row in self.candidates(video_key):
+            ok, step = derive_step(row, opts)
+            path = self._path(row["digest"], row["ext"])
+            if not ok or not os.path.isfile(path):
+                continue
+            with self._lock:
+                self._db.execute("UPDATE streams SET last_used = ? WHERE video_key = ? AND format_id = ?",
+                                 (time.time(), row["video_key"], row["format_id"]))
+                self._db.commit()
+            extractor, _, video_id = row["video_key"].partition(":")
+            base = os.path.join(opts["outdir"], row["title"])
+            hidden = os.path.join(opts["outdir"], f".{row['title']}.{row['digest'][:8]}")
+            if step is None:
+                dest = f"{base}.{row['ext']}"
+            else:
+                # a hidden link the conversion reads and then removes; an
+                # output of the same name in outdir is left alone
+                dest = f"{hidden}.{row['ext']}"
+                step = dict(step, base=base)
+            source = {
+                "path": path,
+                "dest": dest,
+                "manifest_line": f"{extractor}\t{video_id}\t{os.path.abspath(dest)}",
+                "format_id": row["format_id"],
+                "saves": download_size or row["size"],
+                # conversion of a normal download, should the stored stream be gone
+                "post_step": opts.get("post_step"),
+            }
+            if step and step.get("subs"):
+                # fetched next to the hidden link: <hidden>.<lang>.srt (the command is the caller's)
+                source["subtitles"] = {"langs": step["subs"], "base": hidden,
+                                       "pattern": f"{glob.escape(hidden)}.*.srt"}
+            return dict(opts, source_stream=source, post_step=step)
+        return None
@@ -0,0 +1,397 @@
+"""
+Channel and playlist subscriptions.
+A subscription keeps a watermark of its last sync: the IDs seen so far,
+the newest upload date, the position reached and the order the listing
+comes in. A sync reads only as much of the listing as it must:
+
+    newest first    channels and their tabs (and uploads playlists): the
+                    listing stops after STOP_AFTER known entries in a row,
+                    so a channel with thousands of uploads costs one page
+    oldest first    other playlists: the listing starts OVERLAP entries
+                    before the position reached last time (yt-dlp -I);
+                    when those are not the known entries (items were
+                    removed or moved) the playlist is listed in full once
+
+yt-dlp lists lazily (see yd_playlist), so stopping early also stops it
+from fetching further pages. Only entries that were never seen are
+queued, oldest first, with the subscription's format, quality and folder;
+the download archive still skips anything that was downloaded otherwise.
+The scheduler syncs each subscription every `interval` seconds, spread by
++-JITTER so subscriptions added together do not poll together.
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from yd_settings import tool_path
+from yd_playlist import PlaylistExpander
+
+
+NEWEST_FIRST = "newest"
+OLDEST_FIRST = "oldest"
+# known entries in a row that end a newest-first listing (pinned or re-sorted items)
+STOP_AFTER = 3
+# known entries listed again in front of the new ones of an oldest-first playlist
+OVERLAP = 3
+# last seen IDs kept in the watermark, newest first
+HEAD_SIZE = 20
+# scheduler: random spread of the interval, check period, parallel syncs
+JITTER = 0.1
+TICK = 15.0
+MAX_SYNCS = 2
+# seconds until a failed sync is tried again (at most its interval)
+RETRY = 600.0
+# subscriptions overdue at startup are spread over this many seconds
+STARTUP_SPREAD = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    listing_order TEXT NOT NULL,
+    format TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    subtitles TEXT NOT NULL,
+    outdir TEXT NOT NULL,
+    interval REAL NOT NULL,
+    backfill INTEGER NOT NULL,
+    created REAL NOT NULL,
+    next_sync REAL NOT NULL,
+    last_sync REAL,
+    position INTEGER NOT NULL DEFAULT 0,
+    newest_date TEXT NOT NULL DEFAULT '',
+    head TEXT NOT NULL DEFAULT '[]',
+    seen INTEGER NOT NULL DEFAULT 0,
+    last_listed INTEGER NOT NULL DEFAULT 0,
+    last_new INTEGER NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS seen (
+    subscription INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    upload_date TEXT NOT NULL,
+    PRIMARY KEY (subscription, key)
+) WITHOUT ROWID;
+"""
+
+
+def listing_order(url):
+    """Order yt-dlp lists url in: playlists oldest first, channels (and their uploads playlist) newest first."""
+    playlist = parse_qs(urlsplit(url).query).get("list", [""])[0]
+    # UU...: the uploads playlist of a channel
+    if playlist and not playlist.startswith("UU"):
+        return OLDEST_FIRST
+    return NEWEST_FIRST
+
+
+def jittered(interval):
+    return interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+class SubscriptionManager:
+    """
+    Subscriptions of a DownloadCore, kept in SQLite (subscriptions.sqlite).
+    start() runs the scheduler; sync() runs one sync on the calling thread.
+    New entries are queued through core.add, like pasted URLs.
+    """
+
+    def __init__(self, core, path):
+        self.core = core
+        self.path = path
+        # enabled: the scheduler syncs due subscriptions (manual syncs always run)
+        self.enabled = True
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.row_factory = sqlite3.Row
+        # subscription id -> PlaylistExpander of its running sync (None before it starts)
+        self._syncing = {}
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            running = [exp for exp in self._syncing.values() if exp is not None]
+        for exp in running:
+            exp.cancel()
+        with self._lock:
+            self._db.close()
+
+    def log(self, line):
+        self.core.log_store.combined.append(f"[subscriptions] {line}")
+
+    # ----- subscriptions -----
+    def add(self, url, outdir="", fmt="mp4", quality="1080", subtitles="none", interval=3600, backfill=True, order=None):
+        """
+        Subscribe to a channel or playlist (or change the options of an
+        existing subscription to url). With backfill off, the first sync only
+        records what is there and later syncs queue what is new. The first
+        sync is due at once. Returns the subscription id.
+        """
+        url = url.strip()
+        if not url:
+            raise ValueError("no URL")
+        if interval <= 0:
+            raise ValueError("the interval must be positive")
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO subscriptions (url, listing_order, format, quality, subtitles, outdir, interval, backfill, created, next_sync) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET listing_order=excluded.listing_order, "
+                "format=excluded.format, quality=excluded.quality, subtitles=excluded.subtitles, outdir=excluded.outdir, "
+                "interval=excluded.interval",
+                (url, order or listing_order(url), fmt, str(quality), subtitles, outdir or "", float(interval),
+                 int(bool(backfill)), now, now))
+            self._db.commit()
+            sub_id = self._db.execute("SELECT id FROM subscriptions WHERE url=?", (url,)).fetchone()[0]
+        self._wake.set()
+        return sub_id
+
+    def remove(self, ref):
+        """Unsubscribe by id or URL (the downloads stay). Returns True if it existed."""
+        sub = self.get(ref)
+        if sub is None:
+            return False
+        with self._lock:
+            exp = self._syncing.get(sub["id"])
+            self._db.execute("DELETE FROM seen WHERE subscription=?", (sub["id"],))
+            self._db.execute("DELETE FROM subscriptions WHERE id=?", (sub["id"],))
+            self._db.commit()
+        if exp is not None:
+            exp.cancel()
+        return True
+
+    def get(self, ref):
+        """Subscription dict by id or URL, None if unknown."""
+        with self._lock:
+            if str(ref).isdigit():
+                row = self._db.execute("SELECT * FROM subscriptions WHERE id=?", (int(ref),)).fetchone()
+            else:
+                row = self._db.execute("SELECT * FROM subscriptions WHERE url=?", (str(ref).strip(),)).fetchone()
+        return dict(row) if row else None
+
+    def subscriptions(self):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM subscriptions ORDER BY id").fetchall()
+        out = [dict(r) for r in rows]
+        for sub in out:
+            sub["syncing"] = sub["id"] in self._syncing
+        return out
+
+    def sync_now(self, ref=None):
+        """Make one subscription (or all) due now; the scheduler picks them up."""
+        with self._lock:
+            if ref is None:
+                self._db.execute("UPDATE subscriptions SET next_sync=?", (time.time(),))
+            else:
+                self._db.execute("UPDATE subscriptions SET next_sync=? WHERE id=? OR url=?", (time.time(), ref, ref))
+            self._db.commit()
+        self._wake.set()
+
+    def busy(self):
+        with self._lock:
+            return bool(self._syncing)
+
+    # ----- scheduler -----
+    def start(self):
+        if self._thread is not None:
+            return self
+        now = time.time()
+        with self._lock:
+            # after a long pause everything is due: do not poll every source at once
+            # (new subscriptions have their first sync right away)
+            overdue = self._db.execute("SELECT id FROM subscriptions WHERE next_sync<=? AND last_sync IS NOT NULL",
+                                       (now,)).fetchall()
+            for (sub_id,) in overdue:
+                self._db.execute("UPDATE subscriptions SET next_sync=? WHERE id=?",
+                                 (now + random.uniform(0, STARTUP_SPREAD), sub_id))
+            self._db.commit()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._closed:
+            self._wake.wait(TICK)
+            self._wake.clear()
+            if self._closed:
+                break
+            if not self.enabled:
+                continue
+            try:
+                self._start_due()
+            except Exception as e:
+                print("Subscription scheduler error:", e)
+
+    def _start_due(self):
+        with self._lock:
+            free = MAX_SYNCS - len(self._syncing)
+            if free <= 0:
+                return
+            rows = self._db.execute("SELECT id FROM subscriptions WHERE next_sync<=? ORDER BY next_sync",
+                                    (time.time(),)).fetchall()
+            due = [sub_id for (sub_id,) in rows if sub_id not in self._syncing][:free]
+            for sub_id in due:
+                self._syncing[sub_id] = None
+        for sub_id in due:
+            threading.Thread(target=self.sync, args=(sub_id, True), daemon=True).start()
+
+    # ----- sync -----
+    def sync(self, sub_id, claimed=False):
+        """
+        Sync one subscription now on this thread: list the new part of the
+        listing and queue what was never seen. Returns the number of queued
+        downloads (None if it is already syncing, was removed or failed).
+        """
+        with self._lock:
+            if not claimed and sub_id in self._syncing:
+                return None
+            self._syncing[sub_id] = None
+        try:
+            sub = self.get(sub_id)
+            if sub is None:
+                return None
+            try:
+                return self._sync(sub)
+            except Exception as e:
+                if self._closed:
+                    return None
+                self.log(f"{sub['url']}: sync failed: {e}")
+                now = time.time()
+                with self._lock:
+                    self._db.execute("UPDATE subscriptions SET last_sync=?, next_sync=?, error=? WHERE id=?",
+                                     (now, now + jittered(min(RETRY, sub["interval"])), str(e), sub_id))
+                    self._db.commit()
+                return None
+        finally:
+            with self._lock:
+                self._syncing.pop(sub_id, None)
+
+    def _known(self, sub_id):
+        with self._lock:
+            return {r[0] for r in self._db.execute("SELECT key FROM seen WHERE subscription=?", (sub_id,))}
+
+    def _list(self, sub, known, start=1):
+        """
+        Run one listing. Returns (entries read, new entries, complete) where
+        complete is False when an oldest-first listing did not start at the
+        known entries it was expected to.
+        """
+        state = {"read": [], "new": [], "run": 0, "complete": True}
+        newest_first = sub["listing_order"] == NEWEST_FIRST
+        date = sub["newest_date"]
+        # oldest first from start > 1: the first entries must be the known end of the playlist
+        overlap = min(OVERLAP, sub["position"]) if start > 1 else 0
+
+        def on_entry(entry):
+            if exp.cancelled:
+                return
+            state["read"].append(entry)
+            is_new = entry["key"] not in known
+            if is_new:
+                state["new"].append(entry)
+            if newest_first and known:
+                # an unknown entry older than the watermark (e.g. made public late) is queued but still old
+                old = not is_new or (date and entry["upload_date"] and entry["upload_date"] < date)
+                state["run"] = state["run"] + 1 if old else 0
+                if state["run"] >= STOP_AFTER:
+                    exp.cancel()
+            elif len(state["read"]) <= overlap and is_new:
+                state["complete"] = False
+                exp.cancel()
+
+        done = threading.Event()
+        extra = ["-I", f"{start}:"] if start > 1 else []
+        exp = PlaylistExpander(sub["url"], tool_path("yt-dlp"), on_entry, on_done=lambda e: done.set(),
+                               on_log=lambda line: self.log(f"{sub['url']}: {line}"), extra_args=extra)
+        with self._lock:
+            self._syncing[sub["id"]] = exp
+        exp.start()
+        done.wait()
+        if exp.error and not state["read"]:
+            raise RuntimeError(exp.error)
+        if len(state["read"]) < overlap:
+            # the playlist got shorter
+            state["complete"] = False
+        return state["read"], state["new"], state["complete"]
+
+    def _sync(self, sub):
+        known = self._known(sub["id"])
+        t0 = time.monotonic()
+        start = 1
+        if sub["listing_order"] == OLDEST_FIRST and known and sub["position"] > OVERLAP:
+            start = sub["position"] - OVERLAP + 1
+        read, new, complete = self._list(sub, known, start)
+        if not complete:
+            self.log(f"{sub['url']}: playlist changed since the last sync, listing it in full")
+            read, new, _ = self._list(sub, known)
+        if self.get(sub["id"]) is None or self._closed:
+            # removed (or shutting down) while listing
+            return 0
+        queued = 0
+        if known or sub["backfill"]:
+            ordered = list(reversed(new)) if sub["listing_order"] == NEWEST_FIRST else new
+            for entry in ordered:
+                if self._queue(sub, entry):
+                    queued += 1
+        self._record(sub, read, len(new))
+        what = "first sync" if not known else f"{len(read)} entries read"
+        self.log(f"{sub['url']}: {what}, {len(new)} new, {queued} queued ({time.monotonic() - t0:.1f}s)")
+        return queued
+
+    def _queue(self, sub, entry):
+        core = self.core
+        outdir = sub["outdir"] or core.settings["default_output"]
+        opts = core.options(entry["url"], outdir, sub["format"], sub["quality"], sub["subtitles"])
+        opts["no_playlist"] = True
+        # duration: size estimate for the "sjf" policy; source: one subscription is one queue under "fair"
+        opts["duration"] = entry["duration"]
+        opts["source"] = sub["url"]
+        return core.add(opts, label=entry["title"]) is not None
+
+    def _record(self, sub, read, new):
+        now = time.time()
+        position = sub["position"]
+        date = sub["newest_date"]
+        head = json.loads(sub["head"])
+        if read:
+            position = max(position, max(e["index"] for e in read))
+            date = max([date] + [e["upload_date"] for e in read])
+            newest = list(reversed(read)) if sub["listing_order"] == OLDEST_FIRST else read
+            ids = [e["key"] for e in newest]
+            head = (ids + [k for k in head if k not in ids])[:HEAD_SIZE]
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO seen (subscription, key, position, upload_date) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(subscription, key) DO UPDATE SET position=excluded.position",
+                [(sub["id"], e["key"], e["index"], e["upload_date"]) for e in read])
+            seen = self._db.execute("SELECT COUNT(*) FROM seen WHERE subscription=?", (sub["id"],)).fetchone()[0]
+            self._db.execute("UPDATE subscriptions SET last_sync=?, next_sync=?, position=?, newest_date=?, head=?, seen=?, "
+                             "last_listed=?, last_new=?, error='' WHERE id=?",
+                             (now, now + jittered(sub["interval"]), position, date, json.dumps(head), seen,
+                              len(read), new, sub["id"]))
+            self._db.commit()
+
+
+def subscriptions_text(manager):
+    """One line per subscription, for yd_cli.py --subscriptions."""
+    lines = []
+    now = time.time()
+    for sub in manager.subscriptions():
+        when = "syncing" if sub["syncing"] else f"next sync in {max(0, sub['next_sync'] - now) / 60:.0f} min"
+        last = f", last: {sub['last_listed']} read / {sub['last_new']} new" if sub["last_sync"] else ""
+        error = f", error: {sub['error']}" if sub["error"] else ""
+        lines.append(f"#{sub['id']} {sub['url']} [{sub['format']} {sub['quality']}, every {sub['interval'] / 60:.0f} min, "
+                     f"{sub['listing_order']} first] {sub['seen']} seen{last}, {when}{error}")
+    return "\n".join(lines) or "no subscriptions"
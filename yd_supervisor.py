@@ -0,0 +1,207 @@
+"""
+Process supervision.
+yt-dlp starts ffmpeg (merging, HLS, conversions) as child processes, so
+stopping only the yt-dlp process can leave ffmpeg running. yt-dlp and
+ffmpeg are started in their own process group (popen_kwargs(group=True):
+a new session on POSIX, CREATE_NEW_PROCESS_GROUP on Windows), and
+ProcessReaper stops whole groups on its own thread: a polite signal first,
+a hard kill of whatever is left of the group after a grace period. Pause,
+cancel and closing the window never wait for a process to exit.
+
+StallWatchdog restarts downloads that made no progress for a while, with
+exponential backoff between attempts; yt-dlp continues from the .part file.
+"""
+import os
+import time
+import signal
+import threading
+import subprocess
+
+from yd_progress import DOWNLOAD
+
+
+# seconds a stopped process gets to exit before its group is killed
+GRACE = 5.0
+KILL_GRACE = 0.5
+REAP_POLL = 0.1
+# watchdog: check interval, first restart delay and its cap
+TICK = 5.0
+BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+
+
+def signal_group(proc, hard=False):
+    """Signal the process group of proc (started with popen_kwargs(group=True))."""
+    if os.name == "nt":
+        if hard:
+            # /T takes the children along; TerminateProcess alone would leave ffmpeg running
+            subprocess.run(["taskkill", "/PID", str(proc.pid), "/T", "/F"], capture_output=True,
+                           creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        elif proc.poll() is None:
+            proc.send_signal(signal.CTRL_BREAK_EVENT)
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL if hard else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        # the group is gone already
+        pass
+
+
+class ProcessReaper:
+    """
+    Stops process groups in the background. stop() returns at once; the
+    reaper thread signals the group, waits up to the grace period for the
+    process to exit and then kills whatever is left of the group.
+    """
+
+    def __init__(self):
+        # [proc, grace, kill_at]; kill_at is None until the group was signalled
+        self._procs = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, proc, kill=False):
+        """Stop proc and its children; kill=True allows KILL_GRACE instead of GRACE."""
+        with self._cond:
+            for entry in self._procs:
+                if entry[0] is proc:
+                    if kill:
+                        entry[1] = KILL_GRACE
+                        if entry[2] is not None:
+                            entry[2] = min(entry[2], time.monotonic() + KILL_GRACE)
+                    return
+            self._procs.append([proc, KILL_GRACE if kill else GRACE, None])
+            self._cond.notify_all()
+
+    def pending(self):
+        """Number of processes that are still being stopped."""
+        with self._cond:
+            return len(self._procs)
+
+    def wait(self, timeout=None):
+        """Wait until every stopped process is gone. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._procs:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._procs:
+                    self._cond.wait()
+                entries = list(self._procs)
+            done = []
+            for entry in entries:
+                proc, grace, kill_at = entry
+                try:
+                    if kill_at is None:
+                        signal_group(proc)
+                        entry[2] = time.monotonic() + grace
+                        continue
+                    if proc.poll() is None and time.monotonic() < kill_at:
+                        continue
+                    # exited or out of time: no child of the group may survive it
+                    signal_group(proc, hard=True)
+                    proc.wait(timeout=1)
+                except Exception as e:
+                    print("Process reaper error:", e)
+                done.append(entry)
+            with self._cond:
+                self._procs = [e for e in self._procs if not any(e is d for d in done)]
+                self._cond.notify_all()
+            time.sleep(REAP_POLL)
+
+
+class StallWatchdog:
+    """
+    Restarts running downloads that made no progress for timeout seconds.
+    Progress is downloaded bytes; before the first byte of a run any output
+    counts, so a slow extraction is not mistaken for a stall. Conversions
+    are not watched. The n-th restart of a job waits BACKOFF * 2^(n-1)
+    seconds (at most MAX_BACKOFF); after retries restarts the job is
+    paused with an error instead. In-process jobs have no process to stop;
+    they notice the restart at yt-dlp's next progress callback, at the
+    latest when its socket timeout ends the stalled request. Register
+    on_job_event as a JobQueue listener.
+    """
+
+    def __init__(self, job_queue, timeout=0, retries=5):
+        self.job_queue = job_queue
+        # timeout 0 turns the watchdog off
+        self.timeout = timeout
+        self.retries = retries
+        self._lock = threading.Lock()
+        # job id -> [last activity (monotonic), transferred then, transferred at run start]
+        self._watch = {}
+        # job id -> restarts since the job last left the queue
+        self._stalls = {}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def configure(self, timeout, retries=None):
+        self.timeout = max(0, float(timeout or 0))
+        if retries is not None:
+            self.retries = max(0, int(retries))
+
+    def on_job_event(self, job, kind, data):
+        from yd_jobs import RUNNING, ACTIVE_STATES
+        with self._lock:
+            if kind == "state":
+                if data == RUNNING:
+                    now = time.monotonic()
+                    self._watch[job.id] = [now, job.transferred, job.transferred]
+                elif data not in ACTIVE_STATES:
+                    # the QUEUED event of a restart is no reason to forget the count
+                    self._watch.pop(job.id, None)
+                    self._stalls.pop(job.id, None)
+            elif kind in ("log", "stage"):
+                entry = self._watch.get(job.id)
+                if entry is not None and (kind == "stage" or job.transferred == entry[2]):
+                    entry[0] = time.monotonic()
+
+    def _check(self):
+        from yd_jobs import RUNNING
+        now = time.monotonic()
+        stalled = []
+        with self._lock:
+            for job_id, entry in self._watch.items():
+                job = self.job_queue.jobs.get(job_id)
+                if job is None or job.state != RUNNING or job.restart_pending:
+                    continue
+                if job.transferred != entry[1] or job.stage != DOWNLOAD:
+                    entry[0], entry[1] = now, job.transferred
+                elif now - entry[0] >= self.timeout:
+                    entry[0] = now
+                    stalled.append(job)
+        for job in stalled:
+            self._stalled(job)
+
+    def _stalled(self, job):
+        with self._lock:
+            n = self._stalls.get(job.id, 0) + 1
+            self._stalls[job.id] = n
+        idle = f"no progress for {self.timeout:.0f}s"
+        if n > self.retries:
+            self.job_queue.log(job, f"[watchdog] {idle}, giving up after {self.retries} restarts")
+            job.error = f"Stalled: {idle}"
+            self.job_queue.pause(job.id)
+            return
+        delay = min(BACKOFF * 2 ** (n - 1), MAX_BACKOFF)
+        self.job_queue.restart(job.id, f"[watchdog] {idle}, restarting in {delay:.0f}s (attempt {n}/{self.retries})",
+                               delay=delay)
+
+    def _loop(self):
+        while True:
+            time.sleep(TICK)
+            if not self.timeout:
+                continue
+            try:
+                self._check()
+            except Exception as e:
+                print("Stall watchdog error:", e)
@@ -0,0 +1,224 @@
+"""
+Adaptive download tuning.
+yt-dlp fetches DASH/HLS fragments one at a time and plain HTTP downloads in
+one request unless told otherwise. DownloadTuner picks, per job, the
+fragment concurrency (-N), the HTTP chunk size (--http-chunk-size) and
+optionally an external downloader (aria2c), measures the throughput the run
+actually gets, and remembers the results per host and format in a small
+JSON profile (Necessary/tuning.json). Every job uses the best known
+settings, except that untried neighbours of the best (half / double the
+concurrency, another chunk size, the other downloader) are tried first and
+re-checked every EXPLORE_EVERY jobs, so the profile follows changes.
+"""
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+
+from yd_settings import tool_path
+from yd_jobs import ACTIVE_STATES, FINISHED, POSTPROCESSING
+
+
+CONCURRENCY = (1, 2, 4, 8, 16)
+CHUNK_SIZES = ("", "10M")
+DEFAULT = {"concurrency": 4, "chunk": "10M", "downloader": ""}
+# aria2c: 8 connections per file, 1 MiB pieces
+ARIA2C_ARGS = "aria2c:-x 8 -s 8 -k 1M"
+EXPLORE_EVERY = 10
+# runs below these are too short to say anything about throughput
+MIN_BYTES = 1024 * 1024
+MIN_SECONDS = 1.0
+# weight of a new sample in a setting's running average
+EWMA = 0.3
+SAVE_INTERVAL = 5.0
+
+
+def profile_key(url, fmt):
+    """"youtube.com|mp4": host without www./m. plus the output format."""
+    host = (urlsplit(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return f"{host}|{fmt}"
+
+
+def setting_key(s):
+    return f"N={s['concurrency']},chunk={s['chunk'] or '-'},dl={s['downloader'] or 'native'}"
+
+
+def parse_setting_key(key):
+    parts = dict(p.split("=", 1) for p in key.split(","))
+    return {"concurrency": int(parts["N"]), "chunk": "" if parts["chunk"] == "-" else parts["chunk"],
+            "downloader": "" if parts["dl"] == "native" else parts["dl"]}
+
+
+def tuning_args(tuning):
+    """yt-dlp.exe arguments for a job's options["tuning"]."""
+    args = []
+    if tuning.get("concurrency", 1) > 1:
+        args.extend(["-N", str(tuning["concurrency"])])
+    if tuning.get("chunk"):
+        args.extend(["--http-chunk-size", tuning["chunk"]])
+    if tuning.get("downloader"):
+        args.extend(["--downloader", tool_path(tuning["downloader"]), "--downloader-args", ARIA2C_ARGS])
+    return args
+
+
+def tuning_params(tuning):
+    """The same choices as YoutubeDL params for the in-process engine."""
+    params = {}
+    if tuning.get("concurrency", 1) > 1:
+        params["concurrent_fragment_downloads"] = tuning["concurrency"]
+    if tuning.get("chunk"):
+        from yd_units import parse_size
+        params["http_chunk_size"] = parse_size(tuning["chunk"])
+    if tuning.get("downloader"):
+        params["external_downloader"] = {"default": tool_path(tuning["downloader"])}
+        name, _, args = ARIA2C_ARGS.partition(":")
+        params["external_downloader_args"] = {name: args.split()}
+    return params
+
+
+class DownloadTuner:
+    """
+    JobQueue start hook and listener:
+        job_queue.add_start_hook(tuner.before_start)
+        job_queue.add_listener(tuner.on_job_event)
+    aria2c is only tried when external_downloader is set to "aria2c" (the
+    caller checks that it is installed). Runs limited by the bandwidth budget are not measured, since
+    their throughput says nothing about the settings.
+    """
+
+    def __init__(self, job_queue, path, external_downloader=None):
+        self.job_queue = job_queue
+        self.path = path
+        self.external_downloader = external_downloader
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._dirty = False
+        self._saved = 0.0
+        self.profiles = self._load()
+
+    # ----- profile file -----
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, force=False):
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved < SAVE_INTERVAL):
+                return
+            data = json.dumps(self.profiles, indent=1, sort_keys=True)
+            self._dirty = False
+            self._saved = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print("Error saving tuning profile:", e)
+
+    # ----- choosing -----
+    def _neighbours(self, best, fragmented):
+        out = []
+        if fragmented is not False:
+            i = CONCURRENCY.index(best["concurrency"]) if best["concurrency"] in CONCURRENCY else 2
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(CONCURRENCY):
+                    out.append(dict(best, concurrency=CONCURRENCY[j]))
+        if fragmented is not True:
+            for chunk in CHUNK_SIZES:
+                if chunk != best["chunk"]:
+                    out.append(dict(best, chunk=chunk))
+            if self.external_downloader:
+                out.append(dict(best, downloader="" if best["downloader"] else self.external_downloader))
+        return out
+
+    def choose(self, key):
+        """Settings for the next job of a profile key, and why they were picked."""
+        with self._lock:
+            entry = self.profiles.get(key)
+            if not entry or not entry.get("trials"):
+                return dict(DEFAULT), "default (no measurements yet)"
+            trials = entry["trials"]
+            best_key = max(trials, key=lambda k: trials[k]["bps"])
+            best = parse_setting_key(best_key)
+            if best["downloader"] and not self.external_downloader:
+                best["downloader"] = ""
+            entry["jobs"] = entry.get("jobs", 0) + 1
+            self._dirty = True
+            neighbours = self._neighbours(best, entry.get("fragmented"))
+            untried = [n for n in neighbours if setting_key(n) not in trials]
+            if untried:
+                return untried[0], f"trying a neighbour of {best_key}"
+            if neighbours and entry["jobs"] % EXPLORE_EVERY == 0:
+                # re-check the oldest neighbour measurement
+                oldest = min(neighbours, key=lambda n: trials[setting_key(n)].get("t", 0))
+                return oldest, f"re-checking a neighbour of {best_key}"
+            return best, f"best known ({trials[best_key]['bps'] / 1048576:.1f} MB/s)"
+
+    def before_start(self, job):
+        opts = job.options
+        if opts is None:
+            return
+        if not self.enabled:
+            opts.pop("tuning", None)
+            return
+        key = profile_key(job.url, opts.get("format", ""))
+        setting, reason = self.choose(key)
+        opts["tuning"] = setting
+        with self._lock:
+            self._runs[job.id] = {"key": key, "setting": setting, "start": None, "bytes0": 0, "last": None, "bytes": 0}
+        args = " ".join(tuning_args(setting)) or "yt-dlp defaults"
+        self.job_queue.log(job, f"[tune] {args} ({reason})")
+
+    # ----- measuring -----
+    def on_job_event(self, job, kind, data):
+        if kind == "progress":
+            with self._lock:
+                run = self._runs.get(job.id)
+                if run is None:
+                    return
+                now = time.monotonic()
+                if run["start"] is None:
+                    if job.transferred:
+                        run["start"], run["bytes0"] = now, job.transferred
+                    return
+                run["last"], run["bytes"] = now, job.transferred - run["bytes0"]
+        elif kind == "state" and data not in ACTIVE_STATES:
+            # the QUEUED event of a job can arrive after its start hook ran
+            with self._lock:
+                run = self._runs.pop(job.id, None)
+            if run and data in (FINISHED, POSTPROCESSING):
+                self._record(job, run)
+
+    def _limited(self, job):
+        return bool(job.options.get("rate_limit") or (job.throttle is not None and job.throttle.rate))
+
+    def _record(self, job, run):
+        if run["last"] is None or self._limited(job):
+            return
+        seconds = run["last"] - run["start"]
+        if run["bytes"] < MIN_BYTES or seconds < MIN_SECONDS:
+            return
+        bps = run["bytes"] / seconds
+        with self._lock:
+            entry = self.profiles.setdefault(run["key"], {"trials": {}})
+            entry["fragmented"] = job.fragments is not None
+            trial = entry["trials"].setdefault(setting_key(run["setting"]), {"bps": bps, "n": 0})
+            trial["bps"] = bps if trial["n"] == 0 else (1 - EWMA) * trial["bps"] + EWMA * bps
+            trial["n"] += 1
+            trial["t"] = time.time()
+            self._dirty = True
+        self.job_queue.log(job, f"[tune] {setting_key(run['setting'])}: {bps / 1048576:.2f} MB/s over {seconds:.0f}s "
+                                f"({'fragmented' if job.fragments else 'single file'})")
+        self.save()
@@ -0,0 +1,53 @@
+"""
+Byte sizes and rates: parsing the "500K" / "2.5M" notation of the settings
+and formatting numbers for logs and windows.
+Has no imports from the rest of the app so any module can use it.
+"""
+import re
+
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_rate(text):
+    """
+    Parse rates like "500K", "2.5M" or "1048576" (bytes per second, the same
+    notation as yt-dlp's --limit-rate). Empty / "0" means unlimited -> 0.
+    """
+    text = (text or "").strip().upper().replace("B/S", "").replace("IB", "").rstrip("B")
+    if not text:
+        return 0
+    m = re.fullmatch(r"([0-9]*\.?[0-9]+)\s*([KMG]?)", text)
+    if not m:
+        raise ValueError(f"invalid rate: {text!r}")
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def parse_size(text):
+    """
+    Parse sizes like "1G", "500MB", "1.5T" or "1048576" (bytes, 1024 based).
+    Empty / "0" -> 0, which callers take as "no limit" or "nothing".
+    """
+    text = (text or "").strip().upper().replace("IB", "").rstrip("B")
+    if not text:
+        return 0
+    m = re.fullmatch(r"([0-9]*\.?[0-9]+)\s*([KMGT]?)", text)
+    if not m:
+        raise ValueError(f"invalid size: {text!r}")
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def format_size(n):
+    for unit, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if n >= factor:
+            return f"{n / factor:.1f} {unit}"
+    return f"{int(n)} B"
+
+
+def format_rate(bps):
+    if not bps:
+        return "-"
+    for unit, factor in (("GB/s", 1024 ** 3), ("MB/s", 1024 ** 2), ("KB/s", 1024)):
+        if bps >= factor:
+            return f"{bps / factor:.1f} {unit}"
+    return f"{bps:.0f} B/s"
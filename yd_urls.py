@@ -0,0 +1,100 @@
+import re
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+
+# YouTube video ids are 11 chars of [A-Za-z0-9_-]
+_YT_ID = r"[A-Za-z0-9_-]{11}"
+_YT_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com", "www.youtube-nocookie.com")
+_YT_PATH_ID = re.compile(rf"^/(?:shorts|embed|live|v|e)/({_YT_ID})(?:[/?#]|$)")
+
+
+def video_key(url):
+    """
+    Return "youtube:<id>" for a single-video YouTube URL, None otherwise.
+    Works offline: this only parses the URL.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except Exception:
+        return None
+    host = (parts.hostname or "").lower()
+    if host in ("youtu.be", "www.youtu.be"):
+        vid = parts.path.lstrip("/").split("/", 1)[0]
+        return f"youtube:{vid}" if re.fullmatch(_YT_ID, vid) else None
+    if host in _YT_HOSTS:
+        if parts.path == "/watch":
+            vid = parse_qs(parts.query).get("v", [""])[0]
+            return f"youtube:{vid}" if re.fullmatch(_YT_ID, vid) else None
+        m = _YT_PATH_ID.match(parts.path)
+        if m:
+            return f"youtube:{m.group(1)}"
+    return None
+
+
+def info_key(info):
+    """Cache / archive key for a yt-dlp info dict ("<extractor>:<id>")."""
+    extractor = (info.get("extractor_key") or info.get("ie_key") or info.get("extractor") or "generic").lower()
+    return f"{extractor}:{info.get('id')}"
+
+
+def is_playlist_url(url):
+    """
+    True for URLs that list several videos: playlist pages, channels and
+    watch URLs that carry a list= parameter.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except Exception:
+        return False
+    host = (parts.hostname or "").lower()
+    if host not in _YT_HOSTS and host not in ("youtu.be", "www.youtu.be"):
+        return False
+    if "list" in parse_qs(parts.query):
+        return True
+    return bool(re.match(r"^/(?:playlist|channel/|c/|user/|@)", parts.path))
+
+
+# query parameters that never change what is downloaded: everywhere (plus every
+# utm_*), and on YouTube pages
+_TRACKING = {"fbclid", "gclid"}
+_YT_TRACKING = _TRACKING | {"si", "feature", "t", "start", "pp", "ab_channel", "index", "ref"}
+# "example.com/..." without a scheme
+_BARE_HOST = re.compile(r"^[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}(?:[/?#]|$)")
+
+
+def canonical_url(url):
+    """
+    (key, url) for a URL from a pasted list or import file, or None if it
+    is not an http(s) URL ("https://" is assumed for "host/path"). Works
+    offline like video_key:
+    - a YouTube video in any form (youtu.be, watch?v=, shorts, embed, also
+      inside a playlist or with a start time) -> ("youtube:<id>", watch URL)
+    - a YouTube playlist page -> ("youtube:playlist:<list>", playlist URL)
+    - anything else -> ("url:<host><path>?<query>", the URL as given), with
+      the host lowercased, "www." and the fragment dropped and tracking
+      parameters (utm_*, fbclid, gclid; YouTube's own on YouTube) removed,
+      so trivial variants get the same key
+    """
+    url = url.strip()
+    if "://" not in url and _BARE_HOST.match(url):
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except Exception:
+        return None
+    if parts.scheme.lower() not in ("http", "https") or not host:
+        return None
+    key = video_key(url)
+    if key:
+        return key, f"https://www.youtube.com/watch?v={key.partition(':')[2]}"
+    query = parse_qs(parts.query, keep_blank_values=True)
+    if host in _YT_HOSTS and parts.path == "/playlist" and query.get("list", [""])[0]:
+        playlist = query["list"][0]
+        return f"youtube:playlist:{playlist}", f"https://www.youtube.com/playlist?list={playlist}"
+    tracking = _YT_TRACKING if host in _YT_HOSTS else _TRACKING
+    kept = sorted((k, v) for k, values in query.items() for v in values
+                  if not k.lower().startswith("utm_") and k.lower() not in tracking)
+    query = urlencode(kept)
+    host = host[4:] if host.startswith("www.") else host
+    return f"url:{host}{parts.path.rstrip('/') or '/'}" + (f"?{query}" if query else ""), url